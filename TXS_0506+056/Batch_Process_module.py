@@ -0,0 +1,207 @@
+##########################################################
+#
+# Purpose: Process many Mimrec run directories (e.g. the output of sweep_mimrec) with one command.
+#   - The tables shared by all runs (input model, performance files, background scaling) are read once,
+#     and handed to each worker process together with the Process_MEGAlib instance.
+#   - The runs are processed in parallel with a process pool (Effective_Area, Make_SED, Make_LC, ...);
+#     a failed run is recorded in the summary and does not stop the other runs.
+#   - No figures are made while processing; the requested figures are rendered afterwards (see Plot_MEGAlib_module).
+#   - A summary table with one row per run is written (batch_summary.dat).
+#
+# Index of functions:
+#
+#   find_run_dirs(home, wdirs)
+#   run_summary(instance, wdir)
+#   process_runs(input_yaml, wdirs="Mimrec/*", steps=["Effective_Area","Make_SED"], lc_numbins=None, workers=None, home=None, summary_file="default", plots=[])
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import glob
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Process_MEGAlib_module import Process_MEGAlib
+from Significance_module import significance
+from Plot_MEGAlib_module import render_all
+##########################################################
+
+#Process_MEGAlib instance of each worker process (set by _init_worker):
+_instance = None
+
+def find_run_dirs(home, wdirs):
+
+    """
+
+     List of Mimrec run directories.
+
+     input definitions:
+
+     home: main working directory
+
+     wdirs: glob pattern (e.g. "Mimrec/sweep_*"), or list of paths or patterns, relative to home
+       - only directories with extracted_spectrum.dat or extracted_lc.dat are kept
+
+    """
+
+    if isinstance(wdirs, str):
+        wdirs = [wdirs]
+
+    run_dirs = []
+    for pattern in wdirs:
+        for each in sorted(glob.glob(os.path.join(home,pattern))):
+            if os.path.isfile(os.path.join(each,"extracted_spectrum.dat")) or os.path.isfile(os.path.join(each,"extracted_lc.dat")):
+                if os.path.abspath(each) not in run_dirs:
+                    run_dirs.append(os.path.abspath(each))
+
+    return run_dirs
+
+def run_summary(instance, wdir):
+
+    """
+
+     Summary of the processed output of one run directory (one row of the batch summary).
+
+     Note: the significance of the SED bins is the same as in Make_SED, counts/sqrt(counts+bg).
+
+    """
+
+    summary = {}
+
+    spectrum_file = os.path.join(wdir,"extracted_spectrum.dat")
+    if os.path.isfile(spectrum_file) == True:
+        df = pd.read_csv(spectrum_file,delim_whitespace=True)
+        src_counts = np.array(df["src_ct/keV"]*df["BW[keV]"])
+        bg_counts = np.array(df["bg_ct/keV"]*df["BW[keV]"])*instance._background_scale()
+        sigma = significance(src_counts, bg_counts)
+        summary.update({"numbins":len(df), "Emin[keV]":df["EL[keV]"].min(), "Emax[keV]":df["EH[keV]"].max(),
+            "src_counts":np.sum(src_counts), "bg_counts":np.sum(bg_counts),
+            "max_sigma":np.max(sigma) if len(sigma) > 0 else np.nan, "bins_3sigma":int(np.sum(sigma >= 3))})
+
+    aeff_file = os.path.join(wdir,"total_Aeff_and_BG_for_LC.dat")
+    if os.path.isfile(aeff_file) == True:
+        df = pd.read_csv(aeff_file,delim_whitespace=True)
+        summary["Aeff_total[cm^2]"] = df["Aeff_total[cm^2]"][0]
+
+    lc_file = os.path.join(wdir,"Rebinned_LC_summary.dat")
+    if os.path.isfile(lc_file) == True:
+        df = pd.read_csv(lc_file,delim_whitespace=True)
+        summary["LC_max_sigma"] = df["sigma"].max()
+
+    return summary
+
+def _init_worker(instance):
+
+    """Keep the Process_MEGAlib instance (with its shared tables) in the worker process."""
+
+    global _instance
+    _instance = instance
+
+    return
+
+def _process_run(wdir, steps, lc_numbins):
+
+    """Run the processing steps for one run directory (without figures), in a worker process; returns the summary row and the results of each step."""
+
+    start = time.time()
+    row = {"wdir":wdir, "status":"done", "error":""}
+    results = {}
+    try:
+        for step in steps:
+            if step == "Make_LC":
+                results[step] = _instance.Make_LC(wdir, lc_numbins, plot=False)
+            else:
+                results[step] = getattr(_instance, step)(wdir, plot=False)
+        row.update(run_summary(_instance, wdir))
+    except Exception as e:
+        traceback.print_exc()
+        row["status"] = "failed"
+        row["error"] = "%s: %s" %(type(e).__name__, e)
+    row["run_time[s]"] = time.time() - start
+
+    return row, results
+
+def process_runs(input_yaml, wdirs="Mimrec/*", steps=["Effective_Area","Make_SED"], lc_numbins=None, workers=None, home=None, summary_file="default", plots=[]):
+
+    """
+
+     Process many Mimrec run directories in parallel and write a summary table.
+
+     input definitions:
+
+     input_yaml: inputs.yaml of the runs
+
+     wdirs: Optional input. Glob pattern, or list of paths or patterns, of the run directories (relative to home).
+       - Default is all runs in the Mimrec directory (see find_run_dirs).
+
+     steps: Optional input. List of Process_MEGAlib methods to run for each directory, in order.
+       - Make_SED needs Aeff.dat, so Effective_Area must come first (or have been run before).
+       - Make_LC needs lc_numbins.
+
+     lc_numbins: Optional input. Number of bins for Make_LC.
+
+     workers: Optional input. Number of worker processes; default is the number of cores (1 runs without a pool).
+
+     home: Optional input. Main working directory; default is the current working directory.
+
+     summary_file: Optional input. Name of the summary table; default is <Mimrec directory>/batch_summary.dat.
+
+     plots: Optional input. List of the steps whose figures are rendered (e.g. ["Make_SED"]), or "all"; default is no figures.
+       - Figures are rendered after all runs are processed, in worker processes with the Agg backend (not shown).
+
+     Note: returns the summary as a data frame (one row per run directory).
+
+    """
+
+    #make print statement:
+    print()
+    print("********** Batch_Process_Module ************")
+    print("Running process_runs...")
+    print()
+
+    if home is None:
+        home = os.getcwd()
+    if "Make_LC" in steps and lc_numbins is None:
+        raise ValueError("Make_LC needs lc_numbins")
+
+    instance = Process_MEGAlib(input_yaml, home)
+    instance.plots = False
+    instance.load_tables()
+
+    run_dirs = find_run_dirs(home, wdirs)
+    print("processing %s run directories..." %len(run_dirs))
+
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(int(workers), len(run_dirs)))
+
+    if workers == 1:
+        _init_worker(instance)
+        output = [_process_run(each, steps, lc_numbins) for each in run_dirs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(instance,)) as pool:
+            output = list(pool.map(_process_run, run_dirs, [steps]*len(run_dirs), [lc_numbins]*len(run_dirs)))
+
+    #render requested figures:
+    if plots == "all":
+        plots = steps
+    to_render = [results[step] for row,results in output for step in plots if step in results]
+    if len(to_render) > 0:
+        print("rendering %s figures..." %len(to_render))
+        render_all(to_render, workers)
+
+    summary = pd.DataFrame(data=[row for row,results in output])
+    if summary_file == "default":
+        summary_file = os.path.join(instance.context.mimrec_dir,"batch_summary.dat")
+    summary.to_csv(summary_file,sep="\t",index=False)
+
+    failed = summary["status"] == "failed" if len(summary) > 0 else []
+    print()
+    print("processed %s run directories (%s failed); summary in %s" %(len(summary), int(np.sum(failed)), summary_file))
+    print()
+
+    return summary
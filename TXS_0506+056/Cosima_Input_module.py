@@ -0,0 +1,203 @@
+##########################################################
+#
+# Purpose: Convert many model SEDs (E^2 dN/dE) to Cosima inputs at once: a DP spectrum file and a .source file per model.
+#   - The models are treated as piecewise power laws (straight lines in log-log between the tabulated points),
+#     so the integral flux over the energy range is calculated exactly, with array math for all models of a table at once.
+#   - The energy grid of each spectrum file is adaptive: the tabulated points of the model in the energy range, and,
+#     for linear interpolation in Cosima (IP LIN), log midpoints added until linear interpolation is within a tolerance.
+#   - The .source file of each model is the source file of the run with the file name, spectrum file, and flux of the model.
+#   - Nothing is plotted.
+#
+# Index of functions:
+#
+#   read_sed_table(table_file)
+#   loglog_values(energy, flux, x)
+#   powerlaw_integral(energy, flux, e_min, e_max)
+#   spectrum_grid(energy, flux, e_min, e_max, interpolation="LIN", tolerance=0.01, max_points=2000)
+#   write_source_file(template, output, name, spectrum_file, flux)
+#
+##########################################################
+
+##########################################################
+#imports:
+import numpy as np
+##########################################################
+
+#erg to keV (same as Make_Cosima_input):
+ERG_TO_KEV = 6.242e8
+
+def read_sed_table(table_file):
+
+    """
+
+     Read a table of model SEDs: a column energy[eV], and one column per model with E^2 dN/dE [erg/cm^2/s].
+
+     Note: returns the model names (column headers), energy [keV], and the differential photon flux [ph/cm^2/s/keV]
+       with shape (models, energies), converted as in Make_Cosima_input.
+
+    """
+
+    with open(table_file,"r") as f:
+        names = f.readline().split()
+    if len(names) < 2 or names[0] != "energy[eV]":
+        raise ValueError("%s needs a header with energy[eV] and the model names" %table_file)
+
+    data = np.loadtxt(table_file, skiprows=1, ndmin=2)
+    data = data[np.argsort(data[:,0])]
+    energy = data[:,0]*(1e-3) #keV
+
+    return names[1:], energy, data[:,1:].T/(energy**2)*ERG_TO_KEV
+
+def loglog_values(energy, flux, x):
+
+    """
+
+     Log-log interpolation of models at the energies x.
+
+     input definitions:
+
+     energy: tabulated energies (increasing)
+
+     flux: tabulated values, shape (energies,) or (models, energies)
+
+     x: energies to interpolate to (within the tabulated energies)
+
+     Note: returns shape (models, len(x)); segments with a value of 0 at either end are 0.
+
+    """
+
+    energy = np.asarray(energy,dtype=float)
+    flux = np.atleast_2d(np.asarray(flux,dtype=float))
+    x = np.asarray(x,dtype=float)
+
+    i = np.clip(np.searchsorted(energy, x, side="right") - 1, 0, len(energy)-2)
+    t = np.log(x/energy[i])/np.log(energy[i+1]/energy[i])
+    F1 = flux[:,i]
+    F2 = flux[:,i+1]
+    positive = (F1 > 0) & (F2 > 0)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        values = np.exp((1-t)*np.log(F1) + t*np.log(F2))
+
+    return np.where(positive, values, np.where(t == 0, F1, np.where(t == 1, F2, 0.0)))
+
+def powerlaw_integral(energy, flux, e_min, e_max):
+
+    """
+
+     Exact integral of piecewise power-law models from e_min to e_max.
+
+     input definitions:
+
+     energy: tabulated energies [keV] (increasing; must cover e_min to e_max)
+
+     flux: tabulated differential flux [ph/cm^2/s/keV], shape (energies,) or (models, energies)
+
+     e_min, e_max: energy range of the integral [keV]
+
+     Note: returns the integral flux [ph/cm^2/s] of each model. On each segment, dN/dE = F1 (E/E1)^g with
+       g = ln(F2/F1)/ln(E2/E1), so the integral is F1 E1 ((E2/E1)^(g+1) - 1)/(g+1) (or F1 E1 ln(E2/E1) for g = -1).
+
+    """
+
+    energy = np.asarray(energy,dtype=float)
+    if e_min < energy[0] or e_max > energy[-1]:
+        raise ValueError("energy range %s-%s keV is outside of the model (%s-%s keV)" %(e_min, e_max, energy[0], energy[-1]))
+
+    grid = np.unique(np.concatenate([[e_min], energy[(energy > e_min) & (energy < e_max)], [e_max]]))
+    values = loglog_values(energy, flux, grid)
+
+    E1 = grid[:-1]
+    ratio = grid[1:]/E1
+    F1 = values[:,:-1]
+    F2 = values[:,1:]
+    positive = (F1 > 0) & (F2 > 0)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        g1 = np.log(F2/F1)/np.log(ratio) + 1
+        segment = np.where(np.abs(g1) < 1e-9, F1*E1*np.log(ratio), F1*E1*(ratio**g1 - 1)/g1)
+
+    return np.sum(np.where(positive, segment, 0.0), axis=1)
+
+def spectrum_grid(energy, flux, e_min, e_max, interpolation="LIN", tolerance=0.01, max_points=2000):
+
+    """
+
+     Energy grid and values of the spectrum file of one model.
+
+     input definitions:
+
+     energy: tabulated energies [keV] of the model
+
+     flux: tabulated differential flux [ph/cm^2/s/keV] of the model
+
+     e_min, e_max: energy range of the spectrum [keV]
+
+     interpolation: Optional input. Interpolation of the spectrum in Cosima (IP line): "LIN" or "LOGLOG".
+       - LOGLOG: the tabulated points in the energy range reproduce the model exactly.
+       - LIN: log midpoints are added to each segment until linear interpolation deviates by less than tolerance from the model.
+
+     tolerance: Optional input. Maximum relative deviation of linear interpolation at the log midpoints (LIN).
+
+     max_points: Optional input. Maximum number of points (LIN).
+
+     Note: the value at a log midpoint of a segment is sqrt(F1*F2), since the model is a power law on each segment.
+
+    """
+
+    energy = np.asarray(energy,dtype=float)
+    grid = np.unique(np.concatenate([[e_min], energy[(energy > e_min) & (energy < e_max)], [e_max]]))
+    values = loglog_values(energy, flux, grid)[0]
+
+    if interpolation == "LOGLOG":
+        return grid, values
+
+    while len(grid) < max_points:
+        E1, E2 = grid[:-1], grid[1:]
+        F1, F2 = values[:-1], values[1:]
+        E_mid = np.sqrt(E1*E2)
+        F_mid = np.sqrt(F1*F2)
+        linear = F1 + (F2 - F1)*(E_mid - E1)/(E2 - E1)
+        refine = np.flatnonzero((F_mid > 0) & (np.abs(linear - F_mid) > tolerance*F_mid))
+        if len(refine) == 0:
+            break
+        refine = refine[:max_points - len(grid)]
+        grid = np.insert(grid, refine+1, E_mid[refine])
+        values = np.insert(values, refine+1, F_mid[refine])
+
+    return grid, values
+
+def write_source_file(template, output, name, spectrum_file, flux):
+
+    """
+
+     Write the Cosima source file of a model, from the source file of the run.
+
+     input definitions:
+
+     template: lines of the source file of the run
+
+     output: path of the new source file
+
+     name: name of the model (<run>.FileName)
+
+     spectrum_file: name of the spectrum file of the model (<source>.Spectrum File)
+
+     flux: integral flux of the model [ph/cm^2/s] (<source>.Flux)
+
+    """
+
+    new_lines = []
+    for line in template:
+        values = line.split()
+        if len(values) >= 2 and values[0].endswith(".FileName"):
+            line = "%s %s" %(values[0],name)
+        elif len(values) >= 2 and values[0].endswith(".Spectrum") and values[1] == "File":
+            line = "%s File %s" %(values[0],spectrum_file)
+        elif len(values) >= 2 and values[0].endswith(".Flux"):
+            line = "%s %s" %(values[0],repr(float(flux)))
+        new_lines.append(line)
+
+    f = open(output,"w")
+    f.write("\n".join(new_lines) + "\n")
+    f.close()
+
+    return output
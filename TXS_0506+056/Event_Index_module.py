@@ -0,0 +1,736 @@
+##########################################################
+#
+# Purpose: Index the events of a .tra or .sim file, for random access without scanning the text file.
+#   - The index holds the byte offset, size, time (TI), ID, event type (ET), and total energy of every event (SE block).
+#     It is written once to a sidecar file (<event_file>.idx.npz) and reused while the file is unchanged.
+#   - Events are found by binary search on time or ID; energy ranges are selected on the index before reading.
+#   - The selected events are read through a memory map of the file, without rewriting it.
+#   - Any number of files (e.g. a source and several background components or realizations) can be merged
+#     in time order into one .tra file or binary event cache, optionally rescaling and shifting their times.
+#   - The exposure of the file (or of a time window) follows from the indexed time range,
+#     so the background does not need to be scaled with a hard-coded simulation time.
+#
+# Index of functions:
+#
+#   build_index(event_file, index_file=None, chunk_size=CHUNK_SIZE)
+#   load_index(event_file, index_dir=None)
+#   select_events(index, t0=None, t1=None, energy_range=None)
+#   find_event(index, meta, event_id)
+#   read_event(event_file, event_id, index_dir=None)
+#   iter_time_window(event_file, t0, t1, index_dir=None, energy_range=None)
+#   read_time_window(tra_file, t0, t1, index_dir=None, energy_range=None)
+#   extract_time_window(event_file, t0, t1, output, index_dir=None, energy_range=None)
+#   merge_event_files(event_files, output, time_offsets=None, time_scales=None, index_dir=None, block_size=MERGE_BLOCK)
+#   exposure(event_file, t0=None, t1=None, index_dir=None)
+#   background_scale(observation_time, tra_file, background_exposure=7200.0, index_dir=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import mmap
+import json
+import hashlib
+import tempfile
+import numpy as np
+from Tra_Reader_module import CHUNK_SIZE, EVENT_TYPES, parse_events, write_events
+##########################################################
+
+#version of the index format (older sidecars are rebuilt):
+INDEX_VERSION = 4
+
+#columns of the index; file is the number of the file in the list of indexed files (IN includes):
+INDEX_DTYPE = np.dtype([("file","i2"), ("offset","i8"), ("size","i8"), ("time","f8"),
+    ("id","i8"), ("type","i1"), ("energy","f4")])
+
+#records read for the index, and the number of values needed from each:
+#   TI time, ID event ID, CE Compton energies (gamma, error, electron), PE/PP/PI pair (or photo) energies.
+#   ET (event type) and IA INIT (initial photon of .sim files, energy is the last value) are read as well.
+INDEX_RECORDS = {b"TI":1, b"ID":1, b"CE":3, b"PE":1, b"PP":1, b"PI":1}
+
+#number of events read at a time when merging files:
+MERGE_BLOCK = 100000
+
+def _lines(block):
+
+    """Start and end of each line of a block of bytes."""
+
+    buf = np.frombuffer(block,dtype=np.uint8)
+    newlines = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0],newlines+1))
+    ends = np.concatenate((newlines,[len(buf)]))
+
+    return buf, starts, ends
+
+def _is_record(buf, starts, ends, record):
+
+    """Lines with only the two-letter record (e.g. SE or EN), allowing trailing whitespace."""
+
+    match = (ends - starts >= 2) & (buf[np.minimum(starts,len(buf)-1)] == record[0])
+    match &= buf[np.minimum(starts+1,len(buf)-1)] == record[1]
+    match &= (ends - starts == 2) | (buf[np.minimum(starts+2,len(buf)-1)] <= 32)
+
+    return match
+
+def _record_lines(buf, starts, ends, record):
+
+    """Lines starting with a record key followed by whitespace, e.g. b"TI"."""
+
+    match = (ends - starts > 3) & (buf[np.minimum(starts,len(buf)-1)] == record[0])
+    match &= (buf[np.minimum(starts+1,len(buf)-1)] == record[1]) & (buf[np.minimum(starts+2,len(buf)-1)] <= 32)
+
+    return match
+
+def _scan_file(event_file, chunk_size):
+
+    """
+
+     Byte offsets of the events of one file, the offsets and values of the records in INDEX_RECORDS (and ET, IA INIT),
+     the header lines (before the first event), the footer lines (after EN), and the end of the events.
+
+    """
+
+    se_offsets = []
+    records = dict([(key,([],[])) for key in list(INDEX_RECORDS.keys()) + [b"ET", b"IA"]])
+    header = []
+    footer = []
+    in_header = True
+    end = None
+
+    base = 0
+    rest = b""
+    with open(event_file,"rb") as f:
+        while end is None:
+
+            data = f.read(chunk_size)
+            block = rest + data
+            block_base = base - len(rest)
+            base += len(data)
+
+            #only whole lines:
+            cut = block.rfind(b"\n") + 1 if len(data) > 0 else len(block)
+            rest = block[cut:]
+            block = block[:cut]
+            if len(block) == 0:
+                if len(data) == 0:
+                    break
+                continue
+
+            buf, starts, ends = _lines(block)
+            is_se = _is_record(buf, starts, ends, b"SE")
+            is_en = _is_record(buf, starts, ends, b"EN")
+
+            #stop at end of file marker:
+            if np.any(is_en):
+                first_en = np.flatnonzero(is_en)[0]
+                end = block_base + starts[first_en]
+                footer = block[ends[first_en]+1:].decode(errors="replace").splitlines() + (rest + f.read()).decode(errors="replace").splitlines()
+                keep = np.arange(len(starts)) < first_en
+                starts, ends, is_se = starts[keep], ends[keep], is_se[keep]
+
+            #header lines until the first event:
+            if in_header == True:
+                first_se = np.flatnonzero(is_se)[0] if np.any(is_se) else len(starts)
+                header += [block[s:e].decode(errors="replace") for s,e in zip(starts[:first_se],ends[:first_se])]
+                in_header = first_se == len(starts)
+
+            se_offsets.append(block_base + starts[is_se])
+
+            #records of the index:
+            for key,(offsets,values) in records.items():
+                is_record = _record_lines(buf, starts, ends, key)
+                if np.any(is_record) == False:
+                    continue
+                lines = [block[s+3:e] for s,e in zip(starts[is_record],ends[is_record])]
+                if key == b"ET":
+                    this_values = np.array([[EVENT_TYPES.get(line.strip().decode(),0)] for line in lines])
+                elif key == b"IA":
+                    keep = np.array([line[:4] == b"INIT" for line in lines],dtype=bool)
+                    lines = [line for line in lines if line[:4] == b"INIT"]
+                    is_record[is_record] = keep
+                    this_values = np.array([[float(line.rsplit(b";",1)[-1])] for line in lines])
+                else:
+                    n = INDEX_RECORDS[key]
+                    this_values = np.array([(line.split() + [b"nan"]*n)[:n] for line in lines]).astype(float)
+                offsets.append(block_base + starts[is_record])
+                values.append(this_values)
+
+            if len(data) == 0:
+                break
+
+    if end is None:
+        end = base
+
+    se_offsets = np.concatenate(se_offsets) if len(se_offsets) > 0 else np.zeros(0,dtype=np.int64)
+    for key,(offsets,values) in list(records.items()):
+        if len(offsets) == 0:
+            records[key] = (np.zeros(0,dtype=np.int64), np.zeros((0,max(1,INDEX_RECORDS.get(key,1)))))
+        else:
+            records[key] = (np.concatenate(offsets), np.concatenate(values))
+
+    return se_offsets, records, header, footer, end
+
+def _include(include, parent_dir):
+
+    """Path of an IN include: as given, relative to the including file, or its basename next to it."""
+
+    for this_path in [include, os.path.join(parent_dir,include), os.path.join(parent_dir,os.path.basename(include))]:
+        if os.path.isfile(this_path):
+            return os.path.abspath(this_path)
+
+    raise FileNotFoundError("IN file %s not found (included from %s)" %(include,parent_dir))
+
+def _index_file(event_file, files, chunk_size):
+
+    """Index rows of a file and of its IN includes (appended to files), and its header values."""
+
+    if event_file.endswith(".gz"):
+        raise ValueError("%s: gzipped files can not be indexed (they can not be memory-mapped)" %event_file)
+
+    files.append(os.path.abspath(event_file))
+    file_number = len(files) - 1
+    se_offsets, records, header, footer, end = _scan_file(event_file, chunk_size)
+
+    rows = []
+    info = {"header":[], "start":None, "stop":None}
+    for line in header:
+        values = line.split()
+        if len(values) >= 2 and values[0] == "IN":
+            rows.append(_index_file(_include(line.strip()[3:].strip(), os.path.dirname(files[file_number])), files, chunk_size)[0])
+            continue
+        #TB and TE are written by the writers of new files, so they are not kept in the header:
+        if len(values) >= 2 and values[0] == "TB":
+            info["start"] = float(values[1])
+            continue
+        if len(values) >= 1 and values[0] == "TE":
+            continue
+        info["header"].append(line)
+    for line in footer:
+        values = line.split()
+        if len(values) >= 2 and values[0] == "TE":
+            info["stop"] = float(values[1])
+
+    n_events = len(se_offsets)
+    this_index = np.zeros(n_events,dtype=INDEX_DTYPE)
+    this_index["file"] = file_number
+    this_index["offset"] = se_offsets
+    this_index["size"] = np.diff(np.append(se_offsets,end))
+    this_index["time"] = np.nan
+    this_index["id"] = -1
+    this_index["energy"] = np.nan
+
+    def record_values(key):
+        offsets, values = records[key]
+        event = np.searchsorted(se_offsets, offsets, side="right") - 1
+        return event[event >= 0], values[event >= 0]
+
+    event, values = record_values(b"TI")
+    this_index["time"][event] = values[:,0]
+    event, values = record_values(b"ID")
+    this_index["id"][event] = values[:,0]
+    event, values = record_values(b"ET")
+    this_index["type"][event] = values[:,0]
+
+    #total energy: Compton (gamma + electron), pair (electron + positron + initial deposit), photo (PE), or initial energy (.sim):
+    energy = np.zeros(n_events)
+    has_energy = np.zeros(n_events,dtype=bool)
+    for key in [b"PE", b"PP", b"PI"]:
+        event, values = record_values(key)
+        if key != b"PE":
+            #PP is the position of photo events:
+            keep = this_index["type"][event] == EVENT_TYPES["PA"]
+            event, values = event[keep], values[keep]
+        np.add.at(energy, event, values[:,0])
+        has_energy[event] = True
+    event, values = record_values(b"CE")
+    energy[event] = values[:,0] + values[:,2]
+    has_energy[event] = True
+    event, values = record_values(b"IA")
+    first = np.unique(event, return_index=True)[1]
+    no_energy = has_energy[event[first]] == False
+    energy[event[first][no_energy]] = values[first][no_energy,0]
+    has_energy[event[first]] = True
+    this_index["energy"][has_energy] = energy[has_energy]
+
+    rows.append(this_index)
+
+    return np.concatenate(rows), info
+
+def _index_path(event_file, index_dir):
+
+    """Path of the index sidecar of an event file."""
+
+    event_file = os.path.abspath(event_file)
+    if index_dir is None:
+        return event_file + ".idx.npz"
+
+    #keep sidecars of files with the same name in different directories apart:
+    tag = hashlib.sha1(event_file.encode()).hexdigest()[:10]
+
+    return os.path.join(index_dir, os.path.basename(event_file) + "." + tag + ".idx.npz")
+
+def _file_state(files):
+
+    """Size and modification time of each file."""
+
+    return [[each, os.path.getsize(each), os.path.getmtime(each)] for each in files]
+
+def build_index(event_file, index_file=None, chunk_size=CHUNK_SIZE):
+
+    """
+
+     Index the events of a .tra or .sim file and write the index sidecar.
+
+     input definitions:
+
+     event_file: path to .tra or .sim file (IN includes of concatenation files are followed)
+
+     index_file: Optional input. Name of the sidecar; default is event_file + ".idx.npz".
+
+     chunk_size: Optional input. Number of bytes read at a time.
+
+     Note: returns the index (structured array with columns INDEX_DTYPE, sorted by time) and its metadata.
+       - meta["by_id"] has the rows of the index sorted by event ID, and meta["sorted_id"] the sorted IDs (see find_event).
+       - The energy is the total measured energy of .tra events (CE or PE/PP/PI records),
+         or the initial energy (IA INIT) of .sim events; it is nan (and the ID -1) where a record is missing.
+       - The start and stop time of the file are taken from the TB (header) and TE (footer) records,
+         or from the first and last event time if these are not given.
+
+    """
+
+    if index_file is None:
+        index_file = _index_path(event_file, None)
+
+    files = []
+    index, info = _index_file(event_file, files, chunk_size)
+    index = index[np.argsort(index["time"],kind="stable")]
+    by_id = np.argsort(index["id"],kind="stable")
+    sorted_id = index["id"][by_id]
+
+    times = index["time"][np.isfinite(index["time"])]
+    start, stop = info["start"], info["stop"]
+    if start is None:
+        start = float(times[0]) if len(times) > 0 else 0.0
+    if stop is None:
+        stop = float(times[-1]) if len(times) > 0 else 0.0
+
+    meta = {"version":INDEX_VERSION, "event_file":os.path.abspath(event_file), "files":_file_state(files),
+        "n_events":len(index), "start":start, "stop":stop, "header":info["header"]}
+
+    #write through temporary files, so that parallel jobs never see a partial index:
+    index_dir = os.path.dirname(os.path.abspath(index_file))
+    with tempfile.NamedTemporaryFile(dir=index_dir,suffix=".npz",delete=False) as f:
+        np.savez(f,index=index,by_id=by_id,sorted_id=sorted_id)
+    os.replace(f.name,index_file)
+    with tempfile.NamedTemporaryFile("w",dir=index_dir,delete=False) as f:
+        json.dump(meta,f,indent=2)
+    os.replace(f.name,index_file + ".json")
+
+    meta["by_id"] = by_id
+    meta["sorted_id"] = sorted_id
+
+    return index, meta
+
+def load_index(event_file, index_dir=None):
+
+    """
+
+     Load the index of a .tra or .sim file, building it first if there is no valid sidecar.
+
+     input definitions:
+
+     event_file: path to .tra or .sim file
+
+     index_dir: Optional input. Directory of the sidecar; default is next to the event file.
+
+     Note: returns the index (sorted by time) and its metadata (see build_index).
+       The sidecar is valid while the size and mtime of the event file (and its IN files) are unchanged.
+
+    """
+
+    if index_dir is not None and os.path.isdir(index_dir) == False:
+        os.makedirs(index_dir)
+
+    index_file = _index_path(event_file, index_dir)
+    if os.path.isfile(index_file) == True and os.path.isfile(index_file + ".json") == True:
+        with open(index_file + ".json","r") as f:
+            meta = json.load(f)
+        try:
+            valid = meta["version"] == INDEX_VERSION and _file_state([each[0] for each in meta["files"]]) == meta["files"]
+        except OSError:
+            valid = False
+        if valid == True:
+            with np.load(index_file) as data:
+                meta["by_id"] = data["by_id"]
+                meta["sorted_id"] = data["sorted_id"]
+                return data["index"], meta
+
+    print("Indexing %s..." %event_file)
+
+    return build_index(event_file, index_file)
+
+def select_events(index, t0=None, t1=None, energy_range=None):
+
+    """
+
+     Rows of the index with t0 <= time < t1 and energy in energy_range, in file order.
+
+     input definitions:
+
+     index: index from load_index (sorted by time)
+
+     t0, t1: Optional input. Time window in seconds (binary search on the sorted times); default is all times.
+
+     energy_range: Optional input. [min, max] of the event energy in keV (min <= energy < max); default is all energies.
+
+    """
+
+    low = 0 if t0 is None else np.searchsorted(index["time"], t0, side="left")
+    high = len(index) if t1 is None else np.searchsorted(index["time"], t1, side="left")
+    rows = index[low:high]
+
+    if energy_range is not None:
+        rows = rows[(rows["energy"] >= energy_range[0]) & (rows["energy"] < energy_range[1])]
+
+    return rows[np.lexsort((rows["offset"],rows["file"]))]
+
+def find_event(index, meta, event_id):
+
+    """Row of the index of the event with ID event_id (binary search on the sorted IDs of meta), or None if there is none."""
+
+    position = np.searchsorted(meta["sorted_id"], event_id, side="left")
+    if position == len(meta["sorted_id"]) or meta["sorted_id"][position] != event_id:
+        return None
+
+    return index[meta["by_id"][position]]
+
+def _iter_rows(rows, meta):
+
+    """Yield the bytes of the events of the index rows, reading consecutive events as one block."""
+
+    for file_number in np.unique(rows["file"]):
+
+        these_rows = rows[rows["file"] == file_number]
+        if len(these_rows) == 0:
+            continue
+
+        #runs of consecutive events:
+        ends = these_rows["offset"] + these_rows["size"]
+        breaks = np.flatnonzero(these_rows["offset"][1:] != ends[:-1]) + 1
+        run_starts = these_rows["offset"][np.concatenate(([0],breaks))]
+        run_ends = ends[np.concatenate((breaks-1,[len(these_rows)-1]))]
+
+        with open(meta["files"][file_number][0],"rb") as f:
+            with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as m:
+                for s,e in zip(run_starts,run_ends):
+                    yield m[s:e]
+
+def read_event(event_file, event_id, index_dir=None):
+
+    """
+
+     Text of one event (its SE block) of a .tra or .sim file, e.g. for debugging a single event.
+
+     input definitions:
+
+     event_file: path to .tra or .sim file
+
+     event_id: ID of the event
+
+     index_dir: Optional input. Directory of the index sidecar (see load_index).
+
+     Note: raises KeyError if the file has no event with this ID.
+
+    """
+
+    index, meta = load_index(event_file, index_dir)
+    row = find_event(index, meta, event_id)
+    if row is None:
+        raise KeyError("%s has no event with ID %s" %(event_file, event_id))
+
+    return b"".join(_iter_rows(row.reshape(1), meta)).decode(errors="replace")
+
+def iter_time_window(event_file, t0, t1, index_dir=None, energy_range=None):
+
+    """
+
+     Stream the events of a .tra or .sim file with t0 <= TI < t1 as blocks of bytes (whole events, in file order).
+
+     input definitions:
+
+     event_file: path to .tra or .sim file
+
+     t0, t1: time window in seconds
+
+     index_dir: Optional input. Directory of the index sidecar (see load_index).
+
+     energy_range: Optional input. [min, max] of the event energy in keV (see select_events).
+
+    """
+
+    index, meta = load_index(event_file, index_dir)
+
+    yield from _iter_rows(select_events(index, t0, t1, energy_range), meta)
+
+def read_time_window(tra_file, t0, t1, index_dir=None, energy_range=None):
+
+    """Events of a tra file with t0 <= TI < t1 (and energy in energy_range) as a structured array (see Tra_Reader_module.iter_tra)."""
+
+    return parse_events(b"".join(iter_time_window(tra_file, t0, t1, index_dir, energy_range)))
+
+def extract_time_window(event_file, t0, t1, output, index_dir=None, energy_range=None):
+
+    """
+
+     Write the events of a .tra or .sim file with t0 <= TI < t1 to a new file (e.g. a background for a transient).
+
+     input definitions:
+
+     event_file: path to .tra or .sim file
+
+     t0, t1: time window in seconds
+
+     output: name of new file
+
+     index_dir: Optional input. Directory of the index sidecar (see load_index).
+
+     energy_range: Optional input. [min, max] of the event energy in keV (see select_events).
+
+     Note: the new file has the header of the event file, and TB and TE records with the start and stop
+       of the window (within the range of the event file), so its exposure is known (see exposure).
+
+    """
+
+    index, meta = load_index(event_file, index_dir)
+    start, stop = max(t0,meta["start"]), min(t1,meta["stop"])
+
+    with open(output,"wb") as out:
+        header = [line for line in meta["header"] if line.strip() != ""]
+        out.write(("\n".join(header + ["TB %s" %repr(float(start))]) + "\n\n").encode())
+        for block in _iter_rows(select_events(index, t0, t1, energy_range), meta):
+            out.write(block)
+        out.write(("EN\n\nTE %s\n" %repr(float(stop))).encode())
+
+    return output
+
+def _shift_times(block, times):
+
+    """Replace the TI record of each event of a block of whole events (bytes, in order) with the new times; a time of nan keeps the TI record."""
+
+    buf, starts, ends = _lines(block)
+    is_time = np.flatnonzero(_is_record(buf, starts, ends, b"TI"))
+    if len(is_time) != len(times):
+        raise ValueError("%s events with %s TI records can not be shifted" %(len(times),len(is_time)))
+
+    #pieces between the TI lines, and the new TI lines:
+    cuts = np.stack([starts[is_time],ends[is_time]],axis=1).ravel().tolist()
+    pieces = [block[i:j] for i,j in zip([0] + cuts[1::2], cuts[0::2] + [len(block)])]
+    new_lines = [block[i:j] if np.isnan(t) else ("TI %.9f" %t).encode() for i,j,t in zip(cuts[0::2],cuts[1::2],times)]
+    parts = [None]*(2*len(pieces)-1)
+    parts[0::2] = pieces
+    parts[1::2] = new_lines
+
+    return b"".join(parts)
+
+def merge_event_files(event_files, output, time_offsets=None, time_scales=None, index_dir=None, block_size=MERGE_BLOCK):
+
+    """
+
+     Merge the events of any number of .tra files in time order, e.g. to overlay a source on a background realization.
+
+     input definitions:
+
+     event_files: list of .tra files (each can be a concatenation file with IN directives)
+
+     output: name of merged file
+       - a name ending with .npy gives a binary event cache (columns TRA_DTYPE, see Tra_Reader_module.load_tra),
+         any other name gives a .tra file.
+
+     time_offsets: Optional input. List with the time [s] added to the events of each file; default is 0.
+
+     time_scales: Optional input. List with the (positive) factor multiplying the event times of each file; default is 1.
+       - The new time is time*scale + offset, e.g. to stretch a simulated light curve or to place a source in a background.
+
+     index_dir: Optional input. Directory of the index sidecars (see load_index).
+
+     block_size: Optional input. Number of events read at a time.
+
+     Note: the files do not need to be sorted; the events are merged in the order of their (new) times,
+       which is a k-way merge of the time-sorted indices of the files: each file has a window of block_size rows,
+       and the rows up to the smallest last (time, file, row) of the windows are written, as contiguous byte ranges.
+       Only the indices (a few tens of bytes per event) and block_size events per file are held in memory.
+       - Event IDs are not changed, so events from different files can have the same ID.
+       - The .tra file has the header of the first file, and TB and TE records spanning the (new) time ranges of all files.
+
+    """
+
+    if time_offsets is None:
+        time_offsets = [0.0]*len(event_files)
+    if time_scales is None:
+        time_scales = [1.0]*len(event_files)
+
+    if min([float(each) for each in time_scales]) <= 0:
+        raise ValueError("time_scales must be positive (the merge keeps the time order of each file)")
+
+    #time-sorted index of each file:
+    indices = []
+    metas = []
+    for event_file in event_files:
+        index, meta = load_index(event_file, index_dir)
+        indices.append(index)
+        metas.append(meta)
+    start = min([meta["start"]*float(scale) + float(offset) for meta,offset,scale in zip(metas,time_offsets,time_scales)])
+    stop = max([meta["stop"]*float(scale) + float(offset) for meta,offset,scale in zip(metas,time_offsets,time_scales)])
+
+    shifted = [float(offset) != 0 or float(scale) != 1 for offset,scale in zip(time_offsets,time_scales)]
+    binary = output.endswith(".npy")
+    n_total = sum([len(each) for each in indices])
+
+    def new_times(k, rows):
+        return indices[k]["time"][rows]*float(time_scales[k]) + float(time_offsets[k])
+
+    def sort_times(k, rows):
+        #events without a time go last:
+        return np.nan_to_num(new_times(k, rows), nan=np.inf)
+
+    def merged_rows():
+
+        #k-way merge in blocks: each file has a window of block_size rows; all rows up to the smallest last key
+        #of the windows, with the key (time, file, row), can be written, since all later rows have larger keys:
+        position = [0]*len(indices)
+        while True:
+            active = [k for k in range(0,len(indices)) if position[k] < len(indices[k])]
+            if len(active) == 0:
+                return
+            window = [(k, np.arange(position[k], min(position[k]+block_size, len(indices[k])))) for k in active]
+            cutoff = min([(sort_times(k, rows[-1]), k, rows[-1]) for k,rows in window])
+
+            k_list, row_list, t_list = [], [], []
+            for k,rows in window:
+                t = sort_times(k, rows)
+                keep = (t < cutoff[0]) | ((t == cutoff[0]) & ((k < cutoff[1]) | ((k == cutoff[1]) & (rows <= cutoff[2]))))
+                k_list.append(np.full(int(np.sum(keep)),k))
+                row_list.append(rows[keep])
+                t_list.append(t[keep])
+                position[k] += int(np.sum(keep))
+            k_all = np.concatenate(k_list)
+            row_all = np.concatenate(row_list)
+            t_all = np.concatenate(t_list)
+            order = np.lexsort((row_all, k_all, t_all))
+            yield k_all[order], row_all[order]
+
+    def merged_blocks(maps):
+        for k_rows, rows in merged_rows():
+
+            #runs of events that are consecutive in the same file, read as one slice:
+            this_file = np.zeros(len(rows),dtype=int)
+            offsets = np.zeros(len(rows),dtype=np.int64)
+            sizes = np.zeros(len(rows),dtype=np.int64)
+            times = np.zeros(len(rows))
+            for k in np.unique(k_rows):
+                is_k = k_rows == k
+                these = indices[k][rows[is_k]]
+                this_file[is_k] = these["file"]
+                offsets[is_k] = these["offset"]
+                sizes[is_k] = these["size"]
+                times[is_k] = new_times(k, rows[is_k])
+            breaks = np.flatnonzero((k_rows[1:] != k_rows[:-1]) | (this_file[1:] != this_file[:-1]) | (offsets[1:] != offsets[:-1] + sizes[:-1])) + 1
+            run_starts = np.concatenate(([0],breaks))
+            run_ends = np.append(breaks,len(rows))
+
+            block = b"".join([maps[k_rows[i]][this_file[i]][offsets[i]:offsets[j-1]+sizes[j-1]] for i,j in zip(run_starts,run_ends)])
+
+            if binary == True:
+                events = parse_events(block)
+                events["time"] = times
+                yield events
+            elif np.any(np.array(shifted)[k_rows]):
+                #new TI records of the events of shifted files (events without a TI record have no time in the index):
+                has_time = np.isfinite(times)
+                yield _shift_times(block, np.where(np.array(shifted)[k_rows], times, np.nan)[has_time])
+            else:
+                yield block
+
+    #memory maps of all files (and their IN files):
+    handles = []
+    maps = []
+    try:
+        for meta in metas:
+            maps.append([])
+            for each in meta["files"]:
+                handles.append(open(each[0],"rb"))
+                maps[-1].append(mmap.mmap(handles[-1].fileno(),0,access=mmap.ACCESS_READ) if each[1] > 0 else b"")
+
+        if binary == True:
+            write_events(merged_blocks(maps), output)
+        else:
+            with open(output + ".tmp","wb") as out:
+                header = [line for line in metas[0]["header"] if line.strip() != ""]
+                out.write(("\n".join(header + ["TB %s" %repr(float(start))]) + "\n\n").encode())
+                for block in merged_blocks(maps):
+                    out.write(block)
+                out.write(("EN\n\nTE %s\n" %repr(float(stop))).encode())
+            os.replace(output + ".tmp", output)
+    finally:
+        for each in maps:
+            for m in each:
+                if isinstance(m, mmap.mmap):
+                    m.close()
+        for each in handles:
+            each.close()
+
+    print("merged %s events of %s files into %s" %(n_total, len(event_files), output))
+
+    return output
+
+def exposure(event_file, t0=None, t1=None, index_dir=None):
+
+    """
+
+     Exposure [s] of a .tra or .sim file, or of the time window [t0, t1) within it.
+
+     input definitions:
+
+     event_file: path to .tra or .sim file
+
+     t0, t1: Optional input. Time window in seconds; default is the full file.
+
+     index_dir: Optional input. Directory of the index sidecar (see load_index).
+
+     Note: the time range of the file is TB to TE, or the first to the last event time if these are not given
+       (which slightly underestimates the exposure of files with few events).
+
+    """
+
+    index, meta = load_index(event_file, index_dir)
+    start, stop = meta["start"], meta["stop"]
+    if t0 is not None:
+        start = max(start,t0)
+    if t1 is not None:
+        stop = min(stop,t1)
+
+    return max(0.0, stop - start)
+
+def background_scale(observation_time, tra_file, background_exposure=7200.0, index_dir=None):
+
+    """
+
+     Factor scaling the background counts of a tra file to the observation time.
+
+     input definitions:
+
+     observation_time: observation time in seconds
+
+     tra_file: path to background tra file
+
+     background_exposure: Optional input. Exposure of the background tra file in seconds (default is 7200),
+       or "auto" to take it from the indexed time range of the file (see exposure).
+
+    """
+
+    if background_exposure == "auto":
+        background_exposure = exposure(tra_file, index_dir=index_dir)
+        print("exposure of %s: %s s" %(tra_file, background_exposure))
+
+    return float(observation_time)/float(background_exposure)
@@ -0,0 +1,291 @@
+##########################################################
+#
+# Purpose: Run MEGAlib tools (cosima, revan, mimrec, root) as subprocesses with asyncio.
+#   - The output of each tool is streamed to its log file (replaces "| tee"), the terminal, and an optional progress callback.
+#   - Non-zero exit codes and timeouts raise MEGAlibError, so failed runs do not go unnoticed.
+#   - Independent jobs run at the same time, each in its own scratch directory.
+#     When a job is done, its output files are moved from the scratch directory to the save directory.
+#   - The *_async functions are coroutines for code that already runs an event loop (e.g. a notebook);
+#     run_command, run_job, and run_jobs run them with asyncio.run, so they can not be called inside a running loop.
+#     Code that calls them (e.g. the Run_MEGAlib stages) runs in a worker thread there, with asyncio.to_thread.
+#
+# Index of functions:
+#
+#   MEGAlibError(exception)
+#   make_command(args, log_file=None, timeout=None)
+#   run_command_async(args, cwd, log_file=None, timeout=None, callback=None, name=None)
+#   run_command(args, cwd, log_file=None, timeout=None, callback=None, name=None)
+#   make_job(name, commands, scratch_dir, save_dir="none")
+#   run_job_async(job, callback=None)
+#   run_job(job, callback=None)
+#   run_jobs_async(jobs, workers=None, callback=None)
+#   run_jobs(jobs, workers=None, callback=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import shutil
+import asyncio
+##########################################################
+
+#bytes read at once from the output of a tool:
+STREAM_BLOCK = 64*1024
+
+class MEGAlibError(RuntimeError):
+
+    """Raised when a MEGAlib tool fails (non-zero exit code) or runs longer than its timeout."""
+
+    def __init__(self, args, exit_code, cwd, log_file=None, timed_out=False):
+
+        self.command = args
+        self.exit_code = exit_code
+        self.cwd = cwd
+        self.log_file = log_file
+        self.timed_out = timed_out
+
+        if timed_out == True:
+            message = "%s timed out (running in %s)" %(" ".join(args), cwd)
+        else:
+            message = "%s failed with exit code %s (running in %s)" %(" ".join(args), exit_code, cwd)
+        if log_file is not None:
+            message += "; see %s" %log_file
+
+        RuntimeError.__init__(self, message)
+
+def make_command(args, log_file=None, timeout=None):
+
+    """
+
+     input definitions:
+
+     args: list of program and arguments, e.g. ["mimrec", "-g", geo_file, ...]
+
+     log_file: Optional input. Name of file for the terminal output (relative to the directory the command runs in).
+
+     timeout: Optional input. Maximum run time in seconds.
+
+    """
+
+    return {"args":[str(each) for each in args], "log_file":log_file, "timeout":timeout}
+
+async def _stream(process, log, callback, name):
+
+    """Copy the output of a process line by line to the log file, terminal, and callback (read in blocks, so lines can be of any length)."""
+
+    def write_line(line):
+        line = line.decode(errors="replace")
+        if log is not None:
+            log.write(line)
+            log.flush()
+        if name is None:
+            print(line, end="")
+        else:
+            print("[%s] %s" %(name,line), end="")
+        if callback is not None:
+            callback(name, line)
+
+    rest = b""
+    while True:
+        block = await process.stdout.read(STREAM_BLOCK)
+        if not block:
+            break
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            write_line(line + b"\n")
+    if rest:
+        write_line(rest)
+
+    return
+
+async def _run_command(command, cwd, callback=None, name=None):
+
+    """Run one command (dictionary from make_command) and raise MEGAlibError if it fails."""
+
+    log_file = None
+    log = None
+    if command["log_file"] is not None:
+        log_file = os.path.join(cwd, command["log_file"])
+        log = open(log_file, "w")
+
+    try:
+        process = await asyncio.create_subprocess_exec(*command["args"], cwd=cwd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        try:
+            await asyncio.wait_for(_stream(process, log, callback, name), timeout=command["timeout"])
+            exit_code = await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise MEGAlibError(command["args"], None, cwd, log_file, timed_out=True)
+    finally:
+        if log is not None:
+            log.close()
+
+    if exit_code != 0:
+        raise MEGAlibError(command["args"], exit_code, cwd, log_file)
+
+    return exit_code
+
+async def run_command_async(args, cwd, log_file=None, timeout=None, callback=None, name=None):
+
+    """
+
+     Run a MEGAlib tool in the directory cwd (the working directory of python is not changed).
+
+     input definitions:
+
+     args: list of program and arguments
+
+     cwd: full path of the directory to run the command in
+
+     log_file: Optional input. Name of file for the terminal output (relative to cwd).
+
+     timeout: Optional input. Maximum run time in seconds.
+
+     callback: Optional input. Function called as callback(name, line) for every line of output.
+
+     name: Optional input. Name shown in front of each line of output.
+
+     Note: raises MEGAlibError for a non-zero exit code or a timeout.
+
+    """
+
+    return await _run_command(make_command(args, log_file, timeout), cwd, callback, name)
+
+def _run(coroutine):
+
+    """Run a coroutine with asyncio.run; raises RuntimeError with a hint inside a running event loop."""
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    coroutine.close()
+    raise RuntimeError("called from a running event loop; await the *_async function instead, "
+        "or run the calling code in a thread with asyncio.to_thread")
+
+def run_command(args, cwd, log_file=None, timeout=None, callback=None, name=None):
+
+    """Run a MEGAlib tool in the directory cwd and return its exit code (see run_command_async; not inside a running event loop)."""
+
+    return _run(run_command_async(args, cwd, log_file, timeout, callback, name))
+
+def make_job(name, commands, scratch_dir, save_dir="none"):
+
+    """
+
+     input definitions:
+
+     name: name of job (used for print statements)
+
+     commands: list of dictionaries from make_command, ran one after another in the scratch directory
+
+     scratch_dir: full path of the scratch directory of the job (created if needed)
+
+     save_dir: Optional input. Full path of the directory where the output files are moved when the job is done.
+       - Default is to leave the output in the scratch directory.
+
+    """
+
+    return {"name":name, "commands":commands, "scratch_dir":scratch_dir, "save_dir":save_dir}
+
+async def _run_job(job, callback=None, semaphore=None):
+
+    """Run the commands of a job one after another, limited by the semaphore."""
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+
+    async with semaphore:
+
+        print("Running job %s..." %job["name"])
+
+        if os.path.isdir(job["scratch_dir"]) == False:
+            os.makedirs(job["scratch_dir"])
+
+        exit_codes = []
+        for command in job["commands"]:
+            exit_codes.append(await _run_command(command, job["scratch_dir"], callback, job["name"]))
+
+        #move output to save directory:
+        if job["save_dir"] != "none":
+            for each in os.listdir(job["scratch_dir"]):
+                shutil.move(os.path.join(job["scratch_dir"],each), os.path.join(job["save_dir"],each))
+            shutil.rmtree(job["scratch_dir"])
+
+        print("Finished job %s." %job["name"])
+
+    return exit_codes
+
+async def run_job_async(job, callback=None):
+
+    """
+
+     Run the commands of a job in its scratch directory and return the list of exit codes.
+
+     input definitions:
+
+     job: dictionary from make_job
+
+     callback: Optional input. Function called as callback(name, line) for every line of output.
+
+    """
+
+    return await _run_job(job, callback)
+
+def run_job(job, callback=None):
+
+    """Run the commands of a job in its scratch directory and return the list of exit codes (see run_job_async; not inside a running event loop)."""
+
+    return _run(run_job_async(job, callback))
+
+async def _run_jobs(jobs, workers, callback):
+
+    """Run all jobs, with at most workers jobs at the same time."""
+
+    semaphore = asyncio.Semaphore(workers)
+    results = await asyncio.gather(*[_run_job(each, callback, semaphore) for each in jobs], return_exceptions=True)
+
+    for each in results:
+        if isinstance(each, BaseException):
+            raise each
+
+    return results
+
+async def run_jobs_async(jobs, workers=None, callback=None):
+
+    """
+
+     Run a list of independent jobs at the same time, and return their exit codes.
+
+     input definitions:
+
+     jobs: list of dictionaries from make_job
+
+     workers: Optional input. Number of jobs to run at the same time.
+       - Default is the number of cores.
+
+     callback: Optional input. Function called as callback(name, line) for every line of output.
+
+     Note: raises MEGAlibError if any command fails, after all other jobs are finished.
+
+    """
+
+    if len(jobs) == 0:
+        return []
+
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(int(workers), len(jobs)))
+
+    return await _run_jobs(jobs, workers, callback)
+
+def run_jobs(jobs, workers=None, callback=None):
+
+    """Run a list of independent jobs at the same time, and return their exit codes (see run_jobs_async; not inside a running event loop)."""
+
+    return _run(run_jobs_async(jobs, workers, callback))
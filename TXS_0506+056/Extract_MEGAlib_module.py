@@ -0,0 +1,433 @@
+##########################################################
+#
+# Purpose: Python replacement for the mimrec + ROOT extraction of spectra and light curves.
+#   1) Calculate the ARM of Compton and pair events with respect to one or many point source positions.
+#   2) Apply the (energy-dependent) ARM cut and histogram the selected events.
+#   3) Write the same files as ExtractSpectrum.cxx and ExtractLightCurve.cxx (extracted_spectrum.dat, extracted_lc.dat).
+#
+# Index of functions:
+#
+#   source_directions(source_positions)
+#   arm_batch(events, source_positions, pair=True)
+#   compton_arm(events, source_position=(0,0))
+#   arm_resolution_function(performance_dir, mission)
+#   log_energy_bins(numbins, energy_range)
+#   energy_dependent_spectrum(src_events, bg_events, numbins, arm_func, energy_range, source_position=(0,0))
+#   energy_spectrum(src_energy, bg_energy, numbins, energy_range)
+#   light_curve(times, numbins, time_range=None)
+#   radius_scan(events, radii, numbins, energy_range, source_positions=[(0,0)], block_size=ARM_BLOCK, arm=None)
+#   radius_scan_spectra(src_events, bg_events, numbins, radii, energy_range, source_position=(0,0), src_arm=None, bg_arm=None)
+#   bin_significance(spectrum, bg_scale=1.0)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+from Tra_Reader_module import EVENT_TYPES
+##########################################################
+
+#electron rest mass [keV]:
+ELECTRON_MASS = 510.998950
+
+#columns of extracted_spectrum.dat:
+SPECTRUM_COLUMNS = ["EC[keV]", "EL[keV]", "EH[keV]", "BW[keV]", "src_ct/keV", "bg_ct/keV"]
+
+#number of events per block in radius scans (memory is about 8 bytes x block x source positions):
+ARM_BLOCK = 1000000
+
+#columns of extracted_lc.dat:
+LC_COLUMNS = ["t_center[s]", "t_low[s]", "t_high[s]", "t_width[s]", "ct/s"]
+
+def source_directions(source_positions):
+
+    """Unit vectors (shape (M,3)) pointing to far-field point sources at (theta, phi) in degrees (detector coordinates)."""
+
+    positions = np.radians(np.atleast_2d(np.asarray(source_positions,dtype=float)))
+    theta, phi = positions[:,0], positions[:,1]
+
+    return np.stack([np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)],axis=1)
+
+def arm_batch(events, source_positions, pair=True):
+
+    """
+
+     Calculate the angular resolution measure (ARM) of each event for several source positions at once.
+
+     input definitions:
+
+     events: structured array from Tra_Reader_module.read_tra
+
+     source_positions: list of (theta, phi) of far-field point sources in degrees (detector coordinates).
+
+     pair: Optional input. If True (default), pair events get the angle between their reconstructed
+       incoming direction and the source direction, as in mimrec; if False they get nan.
+
+     Note: returns ARM in degrees with shape (number of source positions, number of events);
+       events without valid Compton (or pair) kinematics get nan.
+
+    """
+
+    source_dir = source_directions(source_positions)
+
+    eg = events["gamma_energy"]
+    ee = events["electron_energy"]
+
+    #Compton scatter angle from kinematics:
+    with np.errstate(divide="ignore",invalid="ignore"):
+        cos_phi = 1.0 - ELECTRON_MASS*(1.0/eg - 1.0/(eg+ee))
+
+    #direction of the (reversed) scattered gamma:
+    scatter = np.stack([events["x1"].astype("f8") - events["x2"], events["y1"].astype("f8") - events["y2"],
+        events["z1"].astype("f8") - events["z2"]],axis=1)
+    norm = np.sqrt(np.sum(scatter**2,axis=1))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        scatter = scatter/norm[:,None]
+
+    #geometric scatter angle for all source directions in one matrix product:
+    with np.errstate(invalid="ignore"):
+        cos_geo = source_dir @ scatter.T
+    arm = np.degrees(np.arccos(np.clip(cos_geo,-1,1)) - np.arccos(np.clip(cos_phi,-1,1)))
+
+    #reject events which are kinematically not possible:
+    good = (eg > 0) & (ee > 0) & (np.abs(cos_phi) <= 1) & (norm > 0)
+    arm[:,~good] = np.nan
+
+    #pair events: angle between the source direction and the reversed direction of the pair:
+    if pair == True:
+        is_pair = (events["type"] == EVENT_TYPES["PA"]) & np.isfinite(events["dx"])
+        if np.any(is_pair):
+            incoming = -np.stack([events["dx"][is_pair], events["dy"][is_pair], events["dz"][is_pair]],axis=1).astype("f8")
+            arm[:,is_pair] = np.degrees(np.arccos(np.clip(source_dir @ incoming.T,-1,1)))
+
+    return arm
+
+def compton_arm(events, source_position=(0,0)):
+
+    """
+
+     Calculate the angular resolution measure (ARM) of each Compton event, as done by mimrec.
+
+     input definitions:
+
+     events: structured array from Tra_Reader_module.read_tra
+
+     source_position: (theta, phi) of the far-field point source in degrees (detector coordinates).
+
+     Note: returns ARM in degrees; events without valid Compton kinematics (including pair events) get nan.
+       See arm_batch for several source positions and for pair events.
+
+    """
+
+    return arm_batch(events, [source_position], pair=False)[0]
+
+def arm_resolution_function(performance_dir, mission):
+
+    """
+
+     Returns a function giving the angular resolution [deg] as a function of energy [keV].
+
+     input definitions:
+
+     performance_dir: directory containing the mission performance files
+
+     mission: either AMEGO or AMEGO-X
+
+     Note: the untracked Compton resolution is used up to its highest tabulated energy,
+       then tracked Compton, and pair production above that.
+
+    """
+
+    tracked_compton = os.path.join(performance_dir, mission + "_compton_angular_resolution.txt")
+    untracked_compton = os.path.join(performance_dir, mission + "_untracked_compton_angular_resolution.txt")
+    pair = os.path.join(performance_dir, mission + "_pair_angular_resolution.txt")
+
+    #extract angular resolution data:
+    tc_df = pd.read_csv(tracked_compton,delim_whitespace=True)
+    tc_energy = tc_df["Energy[MeV]"]*1000 #convert to keV
+    tc_func = interp1d(tc_energy,tc_df["Resolution[deg]"],kind="linear",bounds_error=False,fill_value="extrapolate")
+
+    utc_df = pd.read_csv(untracked_compton,delim_whitespace=True)
+    utc_energy = utc_df["Energy[MeV]"]*1000 #convert to keV
+    utc_func = interp1d(utc_energy,utc_df["Resolution[deg]"],kind="linear",bounds_error=False,fill_value="extrapolate")
+
+    pair_df = pd.read_csv(pair,delim_whitespace=True)
+    pair_energy = pair_df["Energy[MeV]"]*1000 #convert to keV
+    pair_func = interp1d(pair_energy,pair_df["Resolution[deg]"],kind="linear",bounds_error=False,fill_value=2.5)
+
+    utc_max = max(utc_energy)
+    tc_max = max(tc_energy)
+
+    def arm_func(energy):
+        energy = np.asarray(energy,dtype=float)
+        return np.where(energy <= utc_max, utc_func(energy),
+            np.where(energy <= tc_max, tc_func(energy), pair_func(energy)))
+
+    return arm_func
+
+def log_energy_bins(numbins, energy_range):
+
+    """
+
+     Returns the lower and upper edges of numbins log energy bins.
+
+     input definitions:
+
+     numbins: number of log energy bins
+
+     energy_range: (min, max) of the spectrum in keV
+
+     Note: like the mimrec + ExtractSpectrum.cxx extraction, the histogram has numbins+1 bins
+       over the energy range and the last bin is not written, so numbins bins are returned.
+
+    """
+
+    edges = np.logspace(np.log10(energy_range[0]),np.log10(energy_range[1]),numbins+2)
+
+    return edges[:-2], edges[1:-1]
+
+def energy_dependent_spectrum(src_events, bg_events, numbins, arm_func, energy_range, source_position=(0,0)):
+
+    """
+
+     Extract the source and background spectra using an energy-dependent ARM cut, in one pass over the events.
+
+     input definitions:
+
+     src_events, bg_events: structured arrays from Tra_Reader_module.read_tra
+
+     numbins: number of log energy bins
+
+     arm_func: function giving the ARM cut [deg] as a function of energy [keV]
+
+     energy_range: (min, max) of the spectrum in keV
+
+     source_position: (theta, phi) of the point source in degrees
+
+     Note: returns the spectrum (dataframe with SPECTRUM_COLUMNS) and the list of ARM cuts per bin.
+
+    """
+
+    EL, EH = log_energy_bins(numbins, energy_range)
+    BW = EH - EL
+    EC = EL + BW/2.0
+    arm_list = np.asarray(arm_func(EC),dtype=float)
+    edges = np.append(EL,EH[-1])
+
+    counts = []
+    for events in [src_events, bg_events]:
+        arm = arm_batch(events, [source_position])[0]
+        this_bin = _bin_index(events["energy"], edges)
+        in_range = this_bin >= 0
+        this_bin = this_bin[in_range]
+        selected = np.abs(arm[in_range]) <= arm_list[this_bin]
+        counts.append(np.bincount(this_bin[selected],minlength=numbins))
+
+    return _spectrum_frame(EL, EH, counts[0], counts[1]), arm_list.tolist()
+
+def _bin_index(values, edges):
+
+    """Bin of each value for bins [edges[i], edges[i+1]) as in ROOT; -1 for values outside of the edges."""
+
+    this_bin = np.searchsorted(edges, values, side="right") - 1
+    this_bin[(this_bin < 0) | (this_bin >= len(edges)-1)] = -1
+
+    return this_bin
+
+def _spectrum_frame(EL, EH, src_counts, bg_counts):
+
+    """Dataframe with the columns of extracted_spectrum.dat (counts are divided by the bin width)."""
+
+    BW = EH - EL
+    EC = EL + BW/2.0
+    d = {"EC[keV]":EC, "EL[keV]":EL, "EH[keV]":EH, "BW[keV]":BW, "src_ct/keV":src_counts/BW, "bg_ct/keV":bg_counts/BW}
+
+    return pd.DataFrame(data=d,columns=SPECTRUM_COLUMNS)
+
+def energy_spectrum(src_energy, bg_energy, numbins, energy_range):
+
+    """
+
+     Histogram the energies of the selected source and background events, as ExtractSpectrum.cxx does for mimrec.
+
+     input definitions:
+
+     src_energy, bg_energy: energies [keV] of the selected events
+
+     numbins: number of log energy bins
+
+     energy_range: (min, max) of the spectrum in keV
+
+     Note: returns a dataframe with SPECTRUM_COLUMNS (see log_energy_bins for the binning).
+
+    """
+
+    EL, EH = log_energy_bins(numbins, energy_range)
+    edges = np.append(EL,EH[-1])
+
+    counts = []
+    for energy in [src_energy, bg_energy]:
+        this_bin = _bin_index(np.asarray(energy,dtype=float), edges)
+        counts.append(np.bincount(this_bin[this_bin >= 0],minlength=numbins))
+
+    return _spectrum_frame(EL, EH, counts[0], counts[1])
+
+def light_curve(times, numbins, time_range=None):
+
+    """
+
+     Histogram the times of the selected events, as ExtractLightCurve.cxx does for mimrec.
+
+     input definitions:
+
+     times: event times [s]
+
+     numbins: number of time bins
+
+     time_range: Optional input. (min, max) of the light curve in seconds. Default is the range of the event times.
+
+     Note: returns a dataframe with LC_COLUMNS. Like the mimrec + ROOT extraction, numbins+1 linear bins
+       are made over the time range and the last bin is not written.
+
+    """
+
+    times = np.asarray(times,dtype=float)
+    if time_range is None:
+        time_range = (0.0,1.0)
+        if len(times) > 0:
+            time_range = (times.min(),times.max())
+
+    edges = np.linspace(time_range[0],time_range[1],numbins+2)
+    this_bin = _bin_index(times, edges[:-1])
+    counts = np.bincount(this_bin[this_bin >= 0],minlength=numbins)
+
+    t_low = edges[:-2]
+    t_high = edges[1:-1]
+    t_width = t_high - t_low
+    d = {"t_center[s]":t_low + t_width/2.0, "t_low[s]":t_low, "t_high[s]":t_high, "t_width[s]":t_width, "ct/s":counts/t_width}
+
+    return pd.DataFrame(data=d,columns=LC_COLUMNS)
+
+def radius_scan(events, radii, numbins, energy_range, source_positions=[(0,0)], block_size=ARM_BLOCK, arm=None):
+
+    """
+
+     Count the events inside the extraction region for many ARM cuts (and source positions) in one pass.
+
+     input definitions:
+
+     events: structured array from Tra_Reader_module.read_tra
+
+     radii: list of ARM cuts (radius of extraction region) in degrees
+
+     numbins: number of log energy bins (see log_energy_bins)
+
+     energy_range: (min, max) of the spectrum in keV
+
+     source_positions: Optional input. List of (theta, phi) of point sources in degrees.
+
+     block_size: Optional input. Number of events handled at once (limits the memory).
+
+     arm: Optional input. ARM of the events from arm_batch (same source_positions), if already calculated.
+
+     Note: returns counts with shape (source positions, radii, numbins), for the radii in the given order.
+       The ARM of each event is only calculated once: events are histogrammed by the smallest radius
+       containing them and energy bin, and the cumulative sum over radii gives the counts of each cut.
+       Pair events are included (see arm_batch).
+
+    """
+
+    radii = np.asarray(radii,dtype=float)
+    order = np.argsort(radii)
+    sorted_radii = radii[order]
+    n_pos = len(source_directions(source_positions))
+    n_rad = len(radii)
+
+    EL, EH = log_energy_bins(numbins, energy_range)
+    edges = np.append(EL,EH[-1])
+
+    #histogram over (source position, radius index, energy bin); radius index n_rad is outside of all cuts:
+    hist = np.zeros(n_pos*(n_rad+1)*numbins,dtype=np.int64)
+    for start in range(0,len(events),block_size):
+        block = events[start:start+block_size]
+        this_bin = _bin_index(block["energy"], edges)
+        in_range = this_bin >= 0
+        block = block[in_range]
+        this_bin = this_bin[in_range]
+
+        if arm is None:
+            block_arm = np.abs(arm_batch(block, source_positions))
+        else:
+            block_arm = np.abs(arm[:,start:start+block_size][:,in_range])
+        block_arm[np.isnan(block_arm)] = np.inf
+        radius_index = np.searchsorted(sorted_radii, block_arm, side="left")
+        index = (np.arange(n_pos)[:,None]*(n_rad+1) + radius_index)*numbins + this_bin[None,:]
+        hist += np.bincount(index.ravel(),minlength=len(hist))
+
+    counts = np.cumsum(hist.reshape(n_pos,n_rad+1,numbins)[:,:n_rad,:],axis=1)
+
+    #back to the given order of radii:
+    result = np.empty_like(counts)
+    result[:,order,:] = counts
+
+    return result
+
+def radius_scan_spectra(src_events, bg_events, numbins, radii, energy_range, source_position=(0,0), src_arm=None, bg_arm=None):
+
+    """
+
+     Extract the source and background spectra for many ARM cuts at once.
+
+     input definitions:
+
+     src_events, bg_events: structured arrays from Tra_Reader_module.read_tra
+
+     numbins: number of log energy bins
+
+     radii: list of ARM cuts in degrees
+
+     energy_range: (min, max) of the spectrum in keV
+
+     source_position: Optional input. (theta, phi) of the point source in degrees.
+
+     src_arm, bg_arm: Optional input. ARM of the source and background events from arm_batch, if already calculated.
+
+     Note: returns a dictionary with a spectrum (dataframe with SPECTRUM_COLUMNS) for each radius.
+
+    """
+
+    EL, EH = log_energy_bins(numbins, energy_range)
+    src_counts = radius_scan(src_events, radii, numbins, energy_range, [source_position], arm=src_arm)[0]
+    bg_counts = radius_scan(bg_events, radii, numbins, energy_range, [source_position], arm=bg_arm)[0]
+
+    spectra = {}
+    for i,rad in enumerate(radii):
+        spectra[rad] = _spectrum_frame(EL, EH, src_counts[i], bg_counts[i])
+
+    return spectra
+
+def bin_significance(spectrum, bg_scale=1.0):
+
+    """
+
+     Source counts, background counts, and significance of each bin of a spectrum, as in Process_MEGAlib.Make_SED.
+
+     input definitions:
+
+     spectrum: dataframe with SPECTRUM_COLUMNS (e.g. from extracted_spectrum.dat)
+
+     bg_scale: Optional input. Factor scaling the background to the observation time (observation time / background exposure).
+
+     Note: returns source counts, background counts, and sigma = src/sqrt(src + bg) for each bin.
+
+    """
+
+    src_counts = spectrum["src_ct/keV"]*spectrum["BW[keV]"]
+    bg_counts = spectrum["bg_ct/keV"]*spectrum["BW[keV]"]*bg_scale
+    with np.errstate(divide="ignore",invalid="ignore"):
+        sigma = src_counts/np.sqrt(src_counts + bg_counts)
+
+    return np.asarray(src_counts), np.asarray(bg_counts), np.nan_to_num(np.asarray(sigma))
@@ -0,0 +1,159 @@
+##########################################################
+#
+# Purpose: Quick-look forward folding of source models through the performance tables of the mission (*_Performance),
+#   for triaging many candidate sources before running the full MEGAlib chain.
+#   - Effective area tables (MeV, cm^2) are read once and interpolated in log-log (0 outside of each table);
+#     the effective area is the sum of the event types (untracked Compton, tracked Compton, pair).
+#   - Expected source counts per energy bin are the integral of flux x effective area over the bin (trapezoid rule
+#     on a log grid), times the observation time and the fraction of source events inside the extraction region.
+#     The energy resolution is neglected (measured energy = true energy).
+#   - All models are folded at once (arrays of shape (models, bins)); the light curve shape of the source
+#     gives the expected counts per time bin.
+#
+# Index of functions:
+#
+#   read_performance_table(this_file)
+#   loglog_interp(x, table_x, table_y)
+#   effective_area_function(performance_dir, mission, event_types=EFFECTIVE_AREA_TYPES)
+#   fold(models, EL, EH, aeff_func, observation_time, containment=1.0, points=32)
+#   read_light_curve(lc_file)
+#   light_curve_fraction(lc_time, lc_flux, edges, points=16)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import numpy as np
+##########################################################
+
+#event types summed for the effective area:
+EFFECTIVE_AREA_TYPES = ["untracked_compton","tracked_compton","pair"]
+
+#performance tables read so far (file: (energy [keV], value)):
+_tables = {}
+
+def read_performance_table(this_file):
+
+    """
+
+     Read a performance table (one header line, energy in MeV, value); returns energy [keV] and value, sorted by energy.
+
+     Note: each file is only read once.
+
+    """
+
+    if this_file not in _tables:
+        data = np.loadtxt(this_file, skiprows=1, ndmin=2)
+        data = data[np.argsort(data[:,0])]
+        _tables[this_file] = (data[:,0]*1000.0, data[:,1]) #convert MeV to keV
+
+    return _tables[this_file]
+
+def loglog_interp(x, table_x, table_y):
+
+    """Log-log interpolation of a table at x; 0 outside of the table and where the table is 0."""
+
+    x = np.asarray(x,dtype=float)
+    log_y = np.log(np.maximum(np.asarray(table_y,dtype=float), 1e-300))
+    y = np.exp(np.interp(np.log(np.maximum(x,1e-300)), np.log(table_x), log_y))
+
+    return np.where((x >= table_x[0]) & (x <= table_x[-1]) & (y > 1e-290), y, 0.0)
+
+def effective_area_function(performance_dir, mission, event_types=EFFECTIVE_AREA_TYPES):
+
+    """
+
+     Returns a function giving the effective area [cm^2] as a function of energy [keV].
+
+     input definitions:
+
+     performance_dir: directory containing the mission performance files
+
+     mission: either AMEGO or AMEGO-X
+
+     event_types: Optional input. Event types of the effective area files (<mission>_effective_area_<type>.txt) that are summed.
+
+    """
+
+    tables = [read_performance_table(os.path.join(performance_dir, "%s_effective_area_%s.txt" %(mission,each))) for each in event_types]
+
+    def aeff_func(energy):
+        return np.sum([loglog_interp(energy, table[0], table[1]) for table in tables], axis=0)
+
+    return aeff_func
+
+def fold(models, EL, EH, aeff_func, observation_time, containment=1.0, points=32):
+
+    """
+
+     Expected source counts of each model in each energy bin.
+
+     input definitions:
+
+     models: list of (energy [keV], diff_flux [ph/cm^2/s/keV]) of the models (see Reweight_module.read_spectrum)
+
+     EL, EH: lower and upper edges of the energy bins [keV]
+
+     aeff_func: effective area [cm^2] as a function of energy [keV] (see effective_area_function)
+
+     observation_time: observation time in seconds
+
+     containment: Optional input. Fraction of the source events inside the extraction region;
+       a number, or an array with one value per energy bin.
+
+     points: Optional input. Number of log-spaced points per bin for the integration.
+
+     Note: returns an array of shape (models, bins).
+
+    """
+
+    EL = np.asarray(EL,dtype=float)
+    EH = np.asarray(EH,dtype=float)
+
+    #integration grid (bins, points) and trapezoid weights:
+    grid = np.exp(np.linspace(np.log(EL), np.log(EH), points, axis=1))
+    dE = np.diff(grid,axis=1)
+    trapezoid = np.zeros(grid.shape)
+    trapezoid[:,:-1] += dE/2.0
+    trapezoid[:,1:] += dE/2.0
+    area = aeff_func(grid) * trapezoid
+
+    flux = np.array([loglog_interp(grid, np.asarray(energy,dtype=float), flux) for energy,flux in models])
+
+    return np.einsum("mbp,bp->mb", flux, area) * observation_time * np.asarray(containment,dtype=float)
+
+def read_light_curve(lc_file):
+
+    """Read a Cosima light curve file (rows "DP time[s] flux"); returns time and flux, sorted by time (repeated times are removed)."""
+
+    with open(lc_file,"r") as f:
+        data = np.array([each.split()[1:3] for each in f.read().splitlines() if each.startswith("DP")],dtype=float)
+    time, first = np.unique(data[:,0], return_index=True)
+
+    return time, data[first,1]
+
+def light_curve_fraction(lc_time, lc_flux, edges, points=16):
+
+    """
+
+     Fraction of the source counts in each time bin, from the light curve shape of the source.
+
+     input definitions:
+
+     lc_time, lc_flux: light curve of the source (linear interpolation, as LinLin in Cosima); 0 outside of lc_time
+
+     edges: edges of the time bins in seconds
+
+     points: Optional input. Number of points per bin for the integration.
+
+     Note: the fractions are normalized to the integral of the light curve over the bins.
+
+    """
+
+    edges = np.asarray(edges,dtype=float)
+    grid = np.linspace(edges[:-1], edges[1:], points, axis=1)
+    values = np.interp(grid, lc_time, lc_flux, left=0.0, right=0.0)
+    integral = np.sum((values[:,1:] + values[:,:-1])/2.0 * np.diff(grid,axis=1), axis=1)
+
+    return integral/np.sum(integral) if np.sum(integral) > 0 else integral
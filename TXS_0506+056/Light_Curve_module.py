@@ -0,0 +1,211 @@
+##########################################################
+#
+# Purpose: Rebinning of light curves for Make_LC, with the new bins given as edges in the original (extracted) bins.
+#   - Counts, widths, and background of the new bins are summed with np.add.reduceat, for any edges.
+#   - Edges can be uniform (all original bins are used; bins differ by at most one original bin),
+#     arbitrary times (snapped to the nearest original bin edge), or constant significance (each new bin >= min_sigma).
+#   - Bayesian blocks (Scargle et al. 2013, event fitness) by O(N^2) dynamic programming, on the extracted bins
+#     or on the raw event times (TI) of a tra file. For binned data, runs of empty bins are combined into one cell
+#     (block edges inside an empty run are never optimal), which makes sparse, finely binned light curves fast.
+#
+# Index of functions:
+#
+#   uniform_edges(n_bins, numbins)
+#   time_edges(bin_edges, edges)
+#   rebin(values, edges)
+#   significance_edges(counts, bg_counts, min_sigma=3.0, window=64)
+#   bayesian_blocks(counts, widths, p0=0.05, ncp_prior=None)
+#   event_blocks(times, p0=0.05, ncp_prior=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import numpy as np
+##########################################################
+
+def uniform_edges(n_bins, numbins):
+
+    """
+
+     Edges of numbins new bins covering all n_bins original bins.
+
+     Note: the sizes of the new bins differ by at most one original bin, so no bins are dropped;
+       if numbins > n_bins, the original bins are kept.
+
+    """
+
+    return np.unique(np.round(np.linspace(0,n_bins,min(numbins,n_bins)+1)).astype(int))
+
+def time_edges(bin_edges, edges):
+
+    """
+
+     Edges of new bins given in time.
+
+     input definitions:
+
+     bin_edges: edges of the original bins in seconds (length n_bins+1)
+
+     edges: edges of the new bins in seconds; each is snapped to the nearest original bin edge
+
+     Note: original bins outside of the new edges are not used; new bins that are empty after snapping are removed.
+
+    """
+
+    bin_edges = np.asarray(bin_edges,dtype=float)
+    edges = np.asarray(edges,dtype=float)
+
+    i = np.clip(np.searchsorted(bin_edges,edges),1,len(bin_edges)-1)
+    i = np.where(edges - bin_edges[i-1] < bin_edges[i] - edges, i-1, i)
+
+    return np.unique(i)
+
+def rebin(values, edges):
+
+    """
+
+     Sum the values of the original bins in each new bin.
+
+     input definitions:
+
+     values: values of the original bins (e.g. counts, widths, background counts)
+
+     edges: strictly increasing edges of the new bins, as indices of the original bins
+
+    """
+
+    edges = np.asarray(edges,dtype=int)
+
+    return np.add.reduceat(np.asarray(values,dtype=float)[:edges[-1]],edges[:-1])
+
+def significance_edges(counts, bg_counts, min_sigma=3.0, window=64):
+
+    """
+
+     Edges of new bins with a significance of at least min_sigma each, counts/sqrt(counts+bg) as in Make_LC.
+
+     input definitions:
+
+     counts: source counts of the original bins
+
+     bg_counts: background counts of the original bins
+
+     min_sigma: Optional input. Minimum significance of each new bin.
+
+     window: Optional input. Number of original bins searched at once for the end of a new bin (doubled until found).
+
+     Note: bins are made in time order, each ending at the first original bin where the significance is reached;
+       the remaining bins at the end (below min_sigma) are added to the last new bin.
+
+    """
+
+    cum_counts = np.concatenate([[0.0],np.cumsum(counts)])
+    cum_bg = np.concatenate([[0.0],np.cumsum(bg_counts)])
+    n_bins = len(cum_counts) - 1
+
+    edges = [0]
+    while edges[-1] < n_bins:
+        low = edges[-1]
+        this_window = window
+        while True:
+            high = min(low + this_window, n_bins)
+            src = cum_counts[low+1:high+1] - cum_counts[low]
+            total = src + cum_bg[low+1:high+1] - cum_bg[low]
+            above = np.flatnonzero((total > 0) & (src >= min_sigma*np.sqrt(np.maximum(total,0.0))))
+            if len(above) > 0 or high == n_bins:
+                break
+            this_window *= 2
+        if len(above) == 0:
+            break
+        edges.append(low + above[0] + 1)
+
+    if edges[-1] < n_bins:
+        if len(edges) > 1:
+            edges[-1] = n_bins
+        else:
+            edges.append(n_bins)
+
+    return np.array(edges)
+
+def bayesian_blocks(counts, widths, p0=0.05, ncp_prior=None):
+
+    """
+
+     Edges of the Bayesian blocks of binned counts (Scargle et al. 2013, event fitness).
+
+     input definitions:
+
+     counts: counts of the original bins (source + background)
+
+     widths: widths of the original bins in seconds (> 0)
+
+     p0: Optional input. False-alarm probability of a block edge, used for the prior on the number of blocks.
+
+     ncp_prior: Optional input. Prior on the number of blocks (overrides p0): 4 - ln(73.53 p0 N^-0.478), N = number of cells.
+
+     Note: returns the block edges as indices of the original bins.
+       The optimal partition is found by dynamic programming over the cells, O(N^2);
+       a run of empty bins is one cell, since the best block edge in an empty run is always at one of its ends.
+
+    """
+
+    counts = np.asarray(counts,dtype=float)
+    widths = np.asarray(widths,dtype=float)
+    n_bins = len(counts)
+
+    #cells: a bin starts a new cell unless it and the previous bin are both empty:
+    filled = counts > 0
+    starts = np.flatnonzero(np.concatenate([[True],filled[1:] | filled[:-1]]))
+    cell_edges = np.append(starts,n_bins)
+    cum_counts = np.concatenate([[0.0],np.cumsum(rebin(counts,cell_edges))])
+    cum_widths = np.concatenate([[0.0],np.cumsum(rebin(widths,cell_edges))])
+    n_cells = len(starts)
+
+    if ncp_prior is None:
+        ncp_prior = 4 - np.log(73.53*p0*n_cells**-0.478)
+
+    best = np.zeros(n_cells)
+    last = np.zeros(n_cells,dtype=int)
+    for r in range(n_cells):
+        #fitness of the last block from each cell k to r:
+        N_k = cum_counts[r+1] - cum_counts[:r+1]
+        T_k = cum_widths[r+1] - cum_widths[:r+1]
+        fit = N_k*(np.log(np.where(N_k > 0, N_k, 1.0)) - np.log(T_k)) - ncp_prior
+        fit[1:] += best[:r]
+        last[r] = np.argmax(fit)
+        best[r] = fit[last[r]]
+
+    #edges of the optimal partition, from the last cell back:
+    change_points = [n_cells]
+    while change_points[-1] > 0:
+        change_points.append(last[change_points[-1]-1])
+
+    return cell_edges[change_points[::-1]]
+
+def event_blocks(times, p0=0.05, ncp_prior=None):
+
+    """
+
+     Edges of the Bayesian blocks of event times, e.g. the TI times of a tra file.
+
+     input definitions:
+
+     times: event times in seconds
+
+     p0: Optional input. False-alarm probability of a block edge (see bayesian_blocks).
+
+     ncp_prior: Optional input. Prior on the number of blocks (see bayesian_blocks).
+
+     Note: returns the block edges in seconds. Each distinct time is a cell, with edges halfway
+       to its neighbours, and the first and last time as the outer edges.
+
+    """
+
+    times, counts = np.unique(np.asarray(times,dtype=float), return_counts=True)
+    if len(times) < 2:
+        raise ValueError("need at least two distinct event times")
+
+    cell_edges = np.concatenate([times[:1], (times[1:] + times[:-1])/2.0, times[-1:]])
+
+    return cell_edges[bayesian_blocks(counts, np.diff(cell_edges), p0, ncp_prior)]
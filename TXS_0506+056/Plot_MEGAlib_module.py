@@ -0,0 +1,213 @@
+##########################################################
+#
+# Purpose: Render the figures of Process_MEGAlib from its numeric results, separately from the calculations.
+#   - Process_MEGAlib methods return their results as dictionaries; each has the kind of plot ("plot")
+#     and the name of the figure file ("plot_file"), together with the data needed for the figure.
+#   - matplotlib is only imported when a figure is rendered, so runs without plots never pay for it.
+#   - Figures can be rendered right away, later from saved results, or for many runs at once in worker processes (Agg backend).
+#
+# Index of functions:
+#
+#   plot_cosima_input(results, plt)
+#   plot_effective_area(results, plt)
+#   plot_sed(results, plt)
+#   plot_lc(results, plt)
+#   render(results, show=False)
+#   render_all(results_list, workers=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+from concurrent.futures import ProcessPoolExecutor
+##########################################################
+
+def _pyplot():
+
+    """Import matplotlib.pyplot on first use."""
+
+    import matplotlib.pyplot as plt
+
+    return plt
+
+def plot_cosima_input(results, plt):
+
+    """Differential photon flux of the Cosima input spectrum (results of Make_Cosima_input)."""
+
+    fig = plt.figure(figsize=(9,6))
+    ax = plt.subplot()
+
+    plt.loglog(results["energy"],results["diff_flux"],color="black",lw=3,label="SED")
+    plt.fill_between(results["energy"],results["diff_flux"],0,hatch="//",alpha=0.5,color="gray")
+
+    plt.xlabel("Energy [keV]", fontsize=16)
+    plt.ylabel(r"Flux [$\mathrm{ph \ cm^{-2} \ s^{-1} \ \mathrm{keV^{-1}}}$]",fontsize=16)
+
+    plt.xticks(fontsize=14)
+    plt.yticks(fontsize=14)
+    ax.tick_params(axis='both',which='major',length=8)
+    ax.tick_params(axis='both',which='minor',length=5)
+
+    #plt.grid(color="grey",alpha=0.4,ls=":")
+    plt.xlim(10,1e7)
+    plt.legend(loc=1)
+
+    return fig
+
+def plot_effective_area(results, plt):
+
+    """Effective area of the run compared to the performance files of the mission (results of Effective_Area)."""
+
+    fig = plt.figure(figsize=(9,6))
+    plt.rc('axes',linewidth=1.5)
+    ax = plt.subplot()
+
+    #plot my results:
+    plt.loglog(results["energy"],results["A_eff"], color="black",marker="",ls="-",lw=3,label="Effective Area (TXS 0506+056 all events)")
+
+    #Plot True (Carolyn's) results for comparison:
+    for each in results["performance"]:
+        plt.loglog(each["energy"],each["area"], color=each["color"],marker="",ls=each["ls"],lw=3,label=each["label"])
+
+    plt.title("%s" %results["mission"],fontsize=16,y=1.04)
+    plt.xlabel("Energy [keV]", fontsize=16)
+    plt.ylabel(r"Effective Area [$\mathrm{cm^{2}}$]",fontsize=16)
+
+    plt.xticks(fontsize=14)
+    plt.yticks(fontsize=14)
+    ax.tick_params(axis='both',which='major',length=8)
+    ax.tick_params(axis='both',which='minor',length=5)
+
+    plt.legend(loc=2,ncol=1,frameon=False)
+    plt.ylim(1,1e5)
+    #plt.xlim(10,1e8)
+    plt.grid(color="grey",alpha=0.4,ls=":")
+
+    return fig
+
+def plot_sed(results, plt):
+
+    """SED with data points (>= 3 sigma) and upper limits, input model, and sensitivity (results of Make_SED)."""
+
+    fig = plt.figure(figsize=(9,6))
+    plt.rc('axes',linewidth=1.5)
+    ax = plt.subplot()
+
+    #plot original model:
+    plt.loglog(results["model_energy"],results["model_flux"],color="black",alpha=0.8,lw=3,label="input model")
+
+    #plot AMEGO sensitivity:
+    plt.loglog(results["sensitivity_energy"],results["sensitivity_flux"],color="purple",ls="--",lw=3,label="%s 3$\sigma$ Continuum Sensitivity" %results["mission"])
+
+    #plot simulated data:
+    energy = results["energy"]
+    flux = results["flux"]
+    error = results["flux_error"]
+    good_index = results["sigma"] >= 3
+    ul_index = results["sigma"] < 3
+    xerr_good = [results["xerr_low"][good_index],results["xerr_high"][good_index]]
+    xerr_ul = [results["xerr_low"][ul_index],results["xerr_high"][ul_index]]
+
+    plt.loglog(energy[good_index],flux[good_index],zorder=10,color="red",ms=6,marker="o",ls="",lw=6,label="_nolabel_")
+    plt.errorbar(energy[good_index],flux[good_index],zorder=10,xerr=xerr_good,yerr=error[good_index],ms=6,color="red",marker="o",ls="",lw=2,uplims=False,label="%s data (MEGAlib)" %results["mission"])
+    plt.errorbar(energy[ul_index],flux[ul_index]+error[ul_index],zorder=10,xerr=xerr_ul,yerr=error[ul_index]/2.0,ms=6,color="red",marker="",ls="",lw=2,uplims=True,label="_nolable_")
+    plt.title("TXS 0506+056 (IceCube-170922A flaring state)",fontsize=16,y=1.04)
+    plt.xlabel("Energy [keV]", fontsize=16)
+    plt.ylabel(r"$\mathrm{E^2}$ dN/dE [$\mathrm{erg \ cm^{-2} \ s^{-1}}$]",fontsize=16)
+
+    plt.xticks(fontsize=14)
+    plt.yticks(fontsize=14)
+    ax.tick_params(axis='both',which='major',length=8)
+    ax.tick_params(axis='both',which='minor',length=5)
+
+    plt.legend(loc=1,ncol=1,fontsize=11,frameon=False)
+    plt.ylim(1e-13,1e-9)
+    plt.xlim(1e1,1e7)
+    plt.grid(color="grey",alpha=0.2,ls="-")
+
+    return fig
+
+def plot_lc(results, plt):
+
+    """Rebinned light curve in photon flux (results of Make_LC)."""
+
+    fig = plt.figure()
+
+    #for reproducing Mimrec output:
+    #plt.plot(results["time"],results["ct/s"],color="black",ls="",marker="o",ms=0.2)
+    #plt.errorbar(results["time"],results["ct/s"],yerr=results["ct/s_error"],color="black",ls="",marker="o",ms=0.1,elinewidth=0.55)
+
+    plt.plot(results["time"],results["flux"],color="black",ls="",marker="o",ms=0.2)
+    plt.errorbar(results["time"],results["flux"],yerr=results["flux_error"],color="black",ls="",marker="o",ms=0.1,elinewidth=0.55)
+
+    plt.xlabel("Time [s]")
+    plt.ylabel("Flux [$\mathrm{ph \ cm^{-2} \ sec^{-1}}$]")
+
+    plt.xlim(min(results["time"]),max(results["time"]))
+    #plt.ylim(0.015,0.0445)
+
+    return fig
+
+#plot function of each kind of results:
+PLOT_FUNCTIONS = {"cosima_input":plot_cosima_input, "effective_area":plot_effective_area, "sed":plot_sed, "lc":plot_lc}
+
+def render(results, show=False):
+
+    """
+
+     Render the figure of the results of a Process_MEGAlib method and save it to results["plot_file"].
+
+     input definitions:
+
+     results: dictionary returned by a Process_MEGAlib method (e.g. Make_SED)
+
+     show: Optional input. Show the figure after saving it.
+
+    """
+
+    plt = _pyplot()
+    fig = PLOT_FUNCTIONS[results["plot"]](results, plt)
+    fig.savefig(results["plot_file"])
+
+    if show == True:
+        plt.show()
+    plt.close(fig)
+
+    return results["plot_file"]
+
+def _init_worker():
+
+    """Render without a display in worker processes."""
+
+    import matplotlib
+    matplotlib.use("Agg")
+
+    return
+
+def render_all(results_list, workers=None):
+
+    """
+
+     Render the figures of many results (e.g. from Batch_Process_module) in worker processes with the Agg backend.
+
+     input definitions:
+
+     results_list: list of dictionaries returned by Process_MEGAlib methods
+
+     workers: Optional input. Number of worker processes; default is the number of cores (1 renders without a pool).
+
+     Note: returns the list of figure files.
+
+    """
+
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(int(workers), len(results_list)))
+
+    if workers == 1:
+        _init_worker()
+        return [render(each) for each in results_list]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(render, results_list))
@@ -6,36 +6,56 @@
 #   1) Make input model file for Cosima.
 #   2) Calculate effective area resulting from MEGAlib simulation.
 #   3) Convert Mimrec output to SED and light curve; incorporate backgrounds; caluclate corresponding error and statistical significance.
+#   Each method returns its results as a dictionary; figures are rendered from these by Plot_MEGAlib_module.
 #
 # Index of functions:
 #
 #   MEGAlib(superclass)
-#       -Make_Cosima_input(starting_model)
-#       -Effective_Area(wdir)
-#       -Make_SED(wdir,plot_model="default")
-#       -Make_LC(wdir,numbins)
+#       -Make_Cosima_input(starting_model,plot=True)
+#       -Make_Cosima_inputs(models,output_dir="default",energy_range=[1e2,1e6],interpolation="LIN",tolerance=0.01,source_template="default")
+#       -Effective_Area(wdir,plot=True)
+#       -Make_SED(wdir,plot_model="default",plot=True)
+#       -Make_LC(wdir,numbins=None,plot=True,binning="uniform",edges=None,min_sigma=3.0,p0=0.05,event_file=None)
+#       -MC_Significance(wdir,kind="SED",numbins=None,n_realizations=10000,thresholds=[3.0,5.0],chunk_size=None,seed=None)
+#       -load_tables()
 #
 ##########################################################
 
 ##########################################################
 #imports:
-import pandas as pd
-from scipy.interpolate import interp1d
-import matplotlib.pyplot as plt
-from scipy import integrate
 import numpy as np
 import math
-from astropy.stats import poisson_conf_interval as pci
 import yaml
 import os
+from Run_Context_module import Run_Context
+from Event_Index_module import background_scale
+from Significance_module import significance, monte_carlo_significance
+from Light_Curve_module import uniform_edges, time_edges, rebin, significance_edges, bayesian_blocks, event_blocks
+from Tra_Reader_module import load_tra
+from Reweight_module import MODEL_FILE, read_spectrum, write_spectrum
+from Cosima_Input_module import read_sed_table, powerlaw_integral, spectrum_grid, write_source_file
+from Plot_MEGAlib_module import render
+#Note: pandas and scipy are imported in the methods that use them, and astropy and matplotlib only when needed
+#  (see Significance_module and Plot_MEGAlib_module), so that loading this module stays fast.
 ##########################################################
 
 #superclass:
 class Process_MEGAlib:
 
-    def __init__(self,input_yaml):
+    def __init__(self,input_yaml,home=None):
 
-        """Main inputs are specified in inputs.yaml file"""
+        """
+        
+         Main inputs are specified in inputs.yaml file
+
+         home: Optional input. Main working directory of the run. Default is the current working directory.
+           - relative paths (e.g. wdir) are taken relative to this directory.
+
+        """
+
+        #get home directory:
+        if home is None:
+            home = os.getcwd()
 
         #load main inputs from yaml file:
         with open(input_yaml,"r") as file:
@@ -43,11 +63,24 @@ class Process_MEGAlib:
         
         self.time = inputs["observation_time"]
         self.area =  inputs["area"]
-        self.input_model = "Inputs/" + inputs["spectrum_file"]
         self.mission = inputs["mission"]
         self.plots = inputs["plots"]
 
-    def Make_Cosima_input(self,starting_model):
+        #all paths are resolved explicitly (the working directory is never changed):
+        self.context = Run_Context(home, inputs["name"], self.mission)
+        self.input_model = self.context.input_file(inputs["spectrum_file"])
+        self.source_file = self.context.input_file(inputs.get("source_file","none"))
+
+        #background tra file and its exposure (default 2 hrs; "auto" takes it from the time range of the file):
+        self.bg_tra_file = self.context.input_file(inputs["background_tra_file"])
+        self.background_exposure = inputs.get("background_exposure",7200.0)
+        self.cache_dir = inputs.get("cache_dir",None)
+
+        #tables shared by all runs (input model, performance files), read once per instance:
+        self._tables = {}
+        self._bg_scale = None
+
+    def Make_Cosima_input(self,starting_model,plot=True):
 
         """
         
@@ -55,6 +88,8 @@ class Process_MEGAlib:
         
          starting_model: model spectrum to be used for Cosima
          Note: energy should be given in eV, and flux in erg/cm^2/2
+
+         plot: Optional input. If False the figure (diff_flux.png) is not made; it can be rendered later from the results.
         
         """
        
@@ -63,10 +98,14 @@ class Process_MEGAlib:
         print("********** MEGAlib Module ************")
         print("Running Make_Cosima_input...")
         print()
+
+        import pandas as pd
+        from scipy.interpolate import interp1d
+        from scipy import integrate
         
         #load original model:
         erg_to_keV = 6.242e8
-        df = pd.read_csv(starting_model,delim_whitespace=True)
+        df = pd.read_csv(self.context.resolve(starting_model),delim_whitespace=True)
         energy = df["energy[eV]"]*(1e-3) #keV
         energy_erg = energy*(1/erg_to_keV)
         flux = df["flux[erg/cm^2/s]"]
@@ -93,31 +132,100 @@ class Process_MEGAlib:
         #write results
         data = {"energy":plot_range,"diff_flux":ph_flux_func(plot_range),"rows":["DP"]*len(plot_range)}
         new_df = pd.DataFrame(data=data)
-        new_df.to_csv("Cosima_input_spectrum.dat",sep="\t",index=False,columns=["rows","energy","diff_flux"])
+        new_df.to_csv(self.context.resolve("Cosima_input_spectrum.dat"),sep="\t",index=False,columns=["rows","energy","diff_flux"])
+
+        results = {"plot":"cosima_input", "plot_file":self.context.resolve("diff_flux.png"),
+            "energy":plot_range, "diff_flux":ph_flux_func(plot_range), "int_flux":int_flux[0]}
 
         #plot differential flux:
-        fig = plt.figure(figsize=(9,6))
-        ax = plt.subplot()
-        
-        plt.loglog(plot_range,ph_flux_func(plot_range),color="black",lw=3,label="SED")
-        plt.fill_between(plot_range,ph_flux_func(plot_range),0,hatch="//",alpha=0.5,color="gray")
+        if plot == True:
+            render(results, show=self.plots)
+
+        return results
+
+    def Make_Cosima_inputs(self,models,output_dir="default",energy_range=[1e2,1e6],interpolation="LIN",tolerance=0.01,source_template="default"):
+
+        """
 
-        plt.xlabel("Energy [keV]", fontsize=16)
-        plt.ylabel(r"Flux [$\mathrm{ph \ cm^{-2} \ s^{-1} \ \mathrm{keV^{-1}}}$]",fontsize=16)
+         Convert many model SEDs to Cosima inputs (spectrum file and source file of each model), without plots.
 
-        plt.xticks(fontsize=14)
-        plt.yticks(fontsize=14)
-        ax.tick_params(axis='both',which='major',length=8)
-        ax.tick_params(axis='both',which='minor',length=5)
+         input definitions:
+
+         models: model SEDs, with energy in eV and flux (E^2 dN/dE) in erg/cm^2/s, given as:
+           - a directory: every file in it is a model (same format as starting_model of Make_Cosima_input), named after the file
+           - a list of such files
+           - a table: a column energy[eV] and one column per model (see Cosima_Input_module.read_sed_table)
+
+         output_dir: Optional input. Directory of the new files; default is the Inputs directory.
+
+         energy_range: Optional input. Energy range of the spectra in keV (default is 100 keV - 1 GeV, as Make_Cosima_input).
+
+         interpolation: Optional input. Interpolation of the spectra in Cosima, "LIN" or "LOGLOG" (see Cosima_Input_module.spectrum_grid).
+
+         tolerance: Optional input. Maximum relative error of linear interpolation between the points of a spectrum (LIN).
+
+         source_template: Optional input. Source file used for the new source files; default is source_file in inputs.yaml.
+           - If there is no source file, only the spectrum files are written.
+
+         Note: for each model <name>, <name>_spectrum.dat and <name>.source are written (with <run>.FileName <name>,
+           and the integral flux of the model over the energy range as <source>.Flux). The integral flux of the models
+           is calculated exactly for piecewise power laws. A summary of all models is written to cosima_inputs_summary.dat
+           in the output directory, and returned.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** MEGAlib Module ************")
+        print("Running Make_Cosima_inputs...")
+        print()
+
+        import pandas as pd
+
+        #load models:
+        if isinstance(models, str) and os.path.isdir(self.context.resolve(models)):
+            this_dir = self.context.resolve(models)
+            models = [os.path.join(this_dir,each) for each in sorted(os.listdir(this_dir)) if os.path.isfile(os.path.join(this_dir,each))]
+        if isinstance(models, str):
+            names, energy, ph_flux = read_sed_table(self.context.resolve(models))
+            model_list = [(name, energy, ph_flux[i]) for i,name in enumerate(names)]
+            flux_list = powerlaw_integral(energy, ph_flux, energy_range[0], energy_range[1])
+        else:
+            model_list = []
+            for each in models:
+                energy, ph_flux = read_spectrum(self.context.resolve(each))
+                order = np.argsort(energy)
+                model_list.append((os.path.splitext(os.path.basename(each))[0], energy[order], ph_flux[order]))
+            flux_list = [powerlaw_integral(energy, ph_flux, energy_range[0], energy_range[1])[0] for name,energy,ph_flux in model_list]
+
+        if output_dir == "default":
+            output_dir = self.context.inputs_dir
+        output_dir = self.context.make_dir(self.context.resolve(output_dir))
+        if source_template == "default":
+            source_template = self.source_file
+        template = None
+        if os.path.isfile(self.context.resolve(source_template)) == True:
+            with open(self.context.resolve(source_template),"r") as f:
+                template = f.read().splitlines()
+
+        #write spectrum and source file of each model:
+        summary = []
+        for (name,energy,ph_flux),int_flux in zip(model_list,flux_list):
+            grid, values = spectrum_grid(energy, ph_flux, energy_range[0], energy_range[1], interpolation, tolerance)
+            spectrum_file = name + "_spectrum.dat"
+            write_spectrum(grid, values, os.path.join(output_dir,spectrum_file), comment="total integrated flux: %s ph/cm^2/s" %int_flux, interpolation=interpolation)
+            if template is not None:
+                write_source_file(template, os.path.join(output_dir,name + ".source"), name, spectrum_file, int_flux)
+            summary.append([name, int_flux, len(grid)])
+
+        summary = pd.DataFrame(data=summary, columns=["name","flux[ph/cm^2/s]","points"])
+        summary.to_csv(os.path.join(output_dir,"cosima_inputs_summary.dat"),sep="\t",index=False)
+        print("wrote Cosima inputs of %s models to %s" %(len(summary),output_dir))
+        print()
 
-        #plt.grid(color="grey",alpha=0.4,ls=":")
-        plt.xlim(10,1e7)
-        plt.legend(loc=1)
-        plt.savefig("diff_flux.png")
-        plt.show()
-        plt.close()
+        return summary
 
-    def Effective_Area(self,wdir):
+    def Effective_Area(self,wdir,plot=True):
     
         """
          input definitions:
@@ -126,6 +234,10 @@ class Process_MEGAlib:
            - needs to be in main working directory
            - needs to contain extracted_spectrum.dat
            - all output is saved here
+
+         plot: Optional input. If False the figure (Aeff.pdf) is not made; it can be rendered later from the results.
+
+         Note: for runs made with reweight_mimrec, the model of the run (model_spectrum.dat in wdir) is used instead of spectrum_file.
         """
 
         #make print statement:
@@ -134,8 +246,14 @@ class Process_MEGAlib:
         print("Running Effective_Area...")
         print()
 
+        import pandas as pd
+        from scipy.interpolate import interp1d
+
+        #path to Mimrec run:
+        wdir = self.context.resolve(wdir)
+
         #input model:
-        df_model = pd.read_csv(self.input_model, delim_whitespace=True, skiprows=[0,1,2,3,4], names=["row","energy","flux"])
+        df_model = self._read_table(self._model_file(wdir), delim_whitespace=True, skiprows=[0,1,2,3,4], names=["row","energy","flux"])
         energy_model = df_model["energy"] #keV
         flux_model = df_model["flux"] #ph/cm^2/s/keV
 
@@ -149,7 +267,7 @@ class Process_MEGAlib:
         observed_data = os.path.join(wdir,"extracted_spectrum.dat")
         df_data = pd.read_csv(observed_data, delim_whitespace=True)
         flux_data = df_data["src_ct/keV"] #ph/keV
-        bg_data = df_data["bg_ct/keV"] * (self.time/(7200)) #2 hrs were simulated. Need to scale by the observation time.
+        bg_data = df_data["bg_ct/keV"] * self._background_scale() #scale by the observation time.
         bin_width = df_data["BW[keV]"] #keV
         bin_low_edge = df_data["EL[keV]"]
         bin_up_edge = df_data["EH[keV]"]
@@ -182,15 +300,7 @@ class Process_MEGAlib:
         df = pd.DataFrame(data = d,columns=["energy [keV]","A_eff [cm^2]"])
         df.to_csv(os.path.join(wdir,"Aeff.dat"),sep="\t",index=False)
 
-        #plot figure:
-        fig = plt.figure(figsize=(9,6))
-        plt.rc('axes',linewidth=1.5)
-        ax = plt.subplot()
-
-        #plot my results:
-        plt.loglog(energy_data,A_eff, color="black",marker="",ls="-",lw=3,label="Effective Area (TXS 0506+056 all events)")
-
-        #Plot True (Carolyn's) results for comparison:
+        #effective area files of the mission for comparison (Carolyn's results):
         if self.mission == "AMEGO":
             untracked_compton_silicon = {"file":"%s_effective_area_untracked_compton_silicon.txt" %self.mission,"label":"Untracked Compton in silicon","color":"navy","ls":"--"}
         untracked_compton = {"file":"%s_effective_area_untracked_compton.txt" %self.mission,"label":"Untracked Compton","color":"cornflowerblue","ls":"--"}
@@ -201,40 +311,23 @@ class Process_MEGAlib:
         if self.mission == "AMEGO":
             plot_list += [untracked_compton_silicon]
     
+        performance = []
         for each in plot_list:
+            this_df  = self._read_table(os.path.join(self.context.performance_dir, each["file"]), delim_whitespace=True, skiprows=[0],names=["energy","effective_area"])
+            performance.append({"label":each["label"], "color":each["color"], "ls":each["ls"],
+                "energy":np.array(this_df["energy"] * 1e3), "area":np.array(this_df["effective_area"])}) #convert MeV to keV
 
-            this_file = "%s_Performance/" %self.mission + each["file"] 
-            this_label = each["label"]
-            this_color = each["color"]
-            this_ls = each["ls"]
-    
-            this_df  = pd.read_csv(this_file, delim_whitespace=True, skiprows=[0],names=["energy","effective_area"])
-            energy = this_df["energy"] * 1e3 #convert MeV to keV
-            area = this_df["effective_area"]
-
-            plt.loglog(energy,area, color=this_color,marker="",ls=this_ls,lw=3,label=this_label)
+        results = {"plot":"effective_area", "plot_file":os.path.join(wdir,"Aeff.pdf"), "mission":self.mission,
+            "energy":np.array(energy_data), "A_eff":np.array(A_eff), "Aeff_total":A_eff_full, "BG_total":np.sum(bg_data*bin_width),
+            "performance":performance}
 
-        plt.title("%s" %self.mission,fontsize=16,y=1.04)
-        plt.xlabel("Energy [keV]", fontsize=16)
-        plt.ylabel(r"Effective Area [$\mathrm{cm^{2}}$]",fontsize=16)
-
-        plt.xticks(fontsize=14)
-        plt.yticks(fontsize=14)
-        ax.tick_params(axis='both',which='major',length=8)
-        ax.tick_params(axis='both',which='minor',length=5)
-
-        plt.legend(loc=2,ncol=1,frameon=False)
-        plt.ylim(1,1e5)
-        #plt.xlim(10,1e8)
-        plt.grid(color="grey",alpha=0.4,ls=":")
-        plt.savefig(os.path.join(wdir,"Aeff.pdf"))
-
-        if self.plots == True:
-            plt.show()
+        #plot figure:
+        if plot == True:
+            render(results, show=self.plots)
 
-        return
+        return results
 
-    def Make_SED(self,wdir,plot_model="default"):
+    def Make_SED(self,wdir,plot_model="default",plot=True):
 
         """
         
@@ -248,6 +341,10 @@ class Process_MEGAlib:
          plot_model: Optional input for plotting model SED. Needs to be dictionary with keys "energy" and "flux".
            - energy needs to be in keV and flux in erg/cm^2/s
            - default is input spectrum used for cosima (which is limited to the simulated energy range) 
+
+         plot: Optional input. If False the figure (SED.pdf) is not made; it can be rendered later from the results.
+
+         Note: for runs made with reweight_mimrec, the model of the run (model_spectrum.dat in wdir) is used instead of spectrum_file.
     
         """
 
@@ -257,12 +354,18 @@ class Process_MEGAlib:
         print("Running Make_SED...")
         print()
 
+        import pandas as pd
+        from scipy.interpolate import interp1d
+
+        #path to Mimrec run:
+        wdir = self.context.resolve(wdir)
+
         #define energy conversion, ergs to keV:
         erg_keV = 1.60218e-9 
 
         #load sensitivity:
-        this_file = self.mission + "_Performance/" + self.mission + "_sensitivity.txt"
-        df_amego = pd.read_csv(this_file,skiprows=[0],delim_whitespace=True,names=["energy","flux"])
+        this_file = os.path.join(self.context.performance_dir, self.mission + "_sensitivity.txt")
+        df_amego = self._read_table(this_file,skiprows=[0],delim_whitespace=True,names=["energy","flux"])
         energy_amego = df_amego["energy"]*(1e3) #convert MeV energy to keV
         
         #convert flux to erg, scale by observing time, and convert for pointed observation:
@@ -275,27 +378,18 @@ class Process_MEGAlib:
         flux_amego = df_amego["flux"] * mev_to_erg * math.sqrt((calc_time*scan_mode)/self.time)
 
         #load input model:
-        df_model = pd.read_csv(self.input_model, delim_whitespace=True, skiprows=[0,1,2,3,4], names=["row","energy","flux"])
+        df_model = self._read_table(self._model_file(wdir), delim_whitespace=True, skiprows=[0,1,2,3,4], names=["row","energy","flux"])
         energy = df_model["energy"] #keV
         flux = df_model["flux"] #ph/cm^2/s/keV
         flux = (energy**2)*flux*erg_keV #convert to erg/cm^2/s
 
-        #plot figure:
-        fig = plt.figure(figsize=(9,6))
-        plt.rc('axes',linewidth=1.5)
-        ax = plt.subplot()
-
-        #plot original model:
+        #model for plotting:
         if plot_model != "default":
             energy = plot_model["energy"]
             flux = plot_model["flux"]
-        plt.loglog(energy,flux,color="black",alpha=0.8,lw=3,label="input model")
-
-        #plot AMEGO sensitivity:
-        plt.loglog(energy_amego,flux_amego,color="purple",ls="--",lw=3,label="%s 3$\sigma$ Continuum Sensitivity" %self.mission)
 
         #####################
-        #plot simulated data:
+        #simulated data:
 
         #load simulated data:
         observed_data = os.path.join(wdir,"extracted_spectrum.dat")
@@ -305,7 +399,8 @@ class Process_MEGAlib:
         bin_low_edge = amego_df["EL[keV]"]
         bin_up_edge = amego_df["EH[keV]"]
         amego_data_energy = np.sqrt(bin_low_edge*bin_up_edge).tolist() #geometric mean of energy bin in keV
-        bg_dNdE = amego_df["bg_ct/keV"] * (self.time/(7200)) #2 hrs were simulated. Need to scale by the observation time. 
+        bg_scale = self._background_scale()
+        bg_dNdE = amego_df["bg_ct/keV"] * bg_scale #scale by the observation time.
     
         bg_counts = bg_dNdE*bin_width
 
@@ -316,7 +411,7 @@ class Process_MEGAlib:
         print("Background counts list:")
         print(bg_counts)
         print()
-        print("time scaling factor [s]: " + str(self.time/(7200)))
+        print("time scaling factor [s]: " + str(bg_scale))
         print() 
 
         #load effective area:
@@ -342,10 +437,6 @@ class Process_MEGAlib:
         #calculate 1 sigma statistical error and significance:
         amego_error = np.sqrt(amego_counts + bg_counts)
         sigma = amego_counts / np.sqrt(amego_counts + bg_counts)
-        
-        #setting statistical significane for plotting data points; otherwise plot upper limits:
-        good_index = sigma >= 3 
-        ul_index = sigma < 3
 
         print()
         print("significance (sigma) of SED bins:")
@@ -358,8 +449,6 @@ class Process_MEGAlib:
         amego_error = ( (amego_error/bin_width) / (A_eff*self.time) ) * (amego_data_energy**2)*erg_keV
         xerr_low = amego_data_energy - bin_low_edge
         xerr_high = bin_up_edge - amego_data_energy
-        xerr_good = [xerr_low[good_index],xerr_high[good_index]]
-        xerr_ul = [xerr_low[ul_index],xerr_high[ul_index]]
 
         print()
         print("source counts:")
@@ -369,29 +458,6 @@ class Process_MEGAlib:
         print(bg_counts.tolist())
         print()
     
-        #plot 
-        plt.loglog(amego_data_energy[good_index],amego_data_flux[good_index],zorder=10,color="red",ms=6,marker="o",ls="",lw=6,label="_nolabel_")
-        plt.errorbar(amego_data_energy[good_index],amego_data_flux[good_index],zorder=10,xerr=xerr_good,yerr=amego_error[good_index],ms=6,color="red",marker="o",ls="",lw=2,uplims=False,label="%s data (MEGAlib)" %self.mission)
-        plt.errorbar(amego_data_energy[ul_index],amego_data_flux[ul_index]+amego_error[ul_index],zorder=10,xerr=xerr_ul,yerr=amego_error[ul_index]/2.0,ms=6,color="red",marker="",ls="",lw=2,uplims=True,label="_nolable_")
-        plt.title("TXS 0506+056 (IceCube-170922A flaring state)",fontsize=16,y=1.04)
-        plt.xlabel("Energy [keV]", fontsize=16)
-        plt.ylabel(r"$\mathrm{E^2}$ dN/dE [$\mathrm{erg \ cm^{-2} \ s^{-1}}$]",fontsize=16)
-
-        plt.xticks(fontsize=14)
-        plt.yticks(fontsize=14)
-        ax.tick_params(axis='both',which='major',length=8)
-        ax.tick_params(axis='both',which='minor',length=5)
-
-        plt.legend(loc=1,ncol=1,fontsize=11,frameon=False)
-        plt.ylim(1e-13,1e-9)
-        plt.xlim(1e1,1e7)
-        plt.grid(color="grey",alpha=0.2,ls="-")
-        plt.savefig(os.path.join(wdir,"SED.pdf"))
-        
-        if self.plots == True:
-            plt.show()
-            plt.close()
-
         #write output to file:
         f = open(os.path.join(wdir,"SED_summary.txt"),"w")
         f.write("Summary of SED calculation:")
@@ -405,10 +471,21 @@ class Process_MEGAlib:
         f.write(str(bg_counts.tolist()))
         f.close()
 
-        return
+        results = {"plot":"sed", "plot_file":os.path.join(wdir,"SED.pdf"), "mission":self.mission,
+            "model_energy":np.array(energy), "model_flux":np.array(flux),
+            "sensitivity_energy":np.array(energy_amego), "sensitivity_flux":np.array(flux_amego),
+            "energy":amego_data_energy, "flux":np.array(amego_data_flux), "flux_error":np.array(amego_error),
+            "xerr_low":np.array(xerr_low), "xerr_high":np.array(xerr_high),
+            "src_counts":np.array(amego_counts), "bg_counts":np.array(bg_counts), "sigma":np.array(sigma)}
+
+        #plot figure:
+        if plot == True:
+            render(results, show=self.plots)
+
+        return results
 
         
-    def Make_LC(self,wdir,numbins):
+    def Make_LC(self,wdir,numbins=None,plot=True,binning="uniform",edges=None,min_sigma=3.0,p0=0.05,event_file=None):
 
         """ 
          input definitions:
@@ -418,8 +495,28 @@ class Process_MEGAlib:
            - needs to contain extracted_spectrum.dat
            - all output is saved here
         
-         numbins: number of bins for light curve
-           - Note: the number of combined original bins per new binning is rounded down to the lowest integer: new = int(original_bins/numbins)
+         numbins: number of bins for light curve (needed for binning="uniform")
+           - Note: all original bins are used; the numbers of combined original bins per new bin differ by at most one.
+
+         plot: Optional input. If False the figure (LC.pdf) is not made; it can be rendered later from the results.
+
+         binning: Optional input. How the extracted light curve is rebinned (see Light_Curve_module):
+           - "uniform": numbins bins
+           - "edges": bins between the given edges (in seconds), snapped to the nearest original bin edge
+           - "significance": consecutive bins with a significance of at least min_sigma each
+           - "bayesian": Bayesian blocks of the extracted counts, or of the event times (TI) of event_file if given
+             (the background is constant, so it is not included in the blocks)
+
+         edges: Optional input. Edges of the new bins in seconds (binning="edges").
+
+         min_sigma: Optional input. Minimum significance of each bin (binning="significance").
+
+         p0: Optional input. False-alarm probability of a block edge (binning="bayesian").
+
+         event_file: Optional input. tra file (relative to the main working directory) with the event times for binning="bayesian".
+           - The block edges are snapped to the nearest edge of the extracted bins.
+
+         Note: the background (BG_total) is assumed constant over the exposure time, and is divided by the width of each bin.
 
         """
 
@@ -429,60 +526,64 @@ class Process_MEGAlib:
         print("Running Make_LC...")
         print()
 
+        if binning == "uniform" and numbins is None:
+            raise ValueError("numbins is needed for binning='uniform'")
+
+        import pandas as pd
+
+        #path to Mimrec run:
+        wdir = self.context.resolve(wdir)
 
         #load light curve data:
         lc_file = os.path.join(wdir,"extracted_lc.dat")
         df = pd.read_csv(lc_file,delim_whitespace=True)
-        t_center = df["t_center[s]"] #center of time bin in seconds
-        t_low = df["t_low[s]"] #low of time bin in seconds
-        t_high = df["t_high[s]"] #high of time bin in seconds
-        t_width = df["t_width[s]"] #width of time bin in seconds
-        ctps = df["ct/s"] #counts per second
+        t_center = np.array(df["t_center[s]"]) #center of time bin in seconds
+        t_low = np.array(df["t_low[s]"]) #low of time bin in seconds
+        t_high = np.array(df["t_high[s]"]) #high of time bin in seconds
+        t_width = np.array(df["t_width[s]"]) #width of time bin in seconds
+        ctps = np.array(df["ct/s"]) #counts per second
         counts = ctps * t_width #total counts per bin
         print("LC TOTAL COUNTS")
         print(np.sum(counts))
-        #make desired binning
-        tot_bins = len(t_center)
-        new = int(tot_bins/numbins)
     
         #upload total effective area and background counts:
         this_file = os.path.join(wdir,"total_Aeff_and_BG_for_LC.dat")
         df = pd.read_csv(this_file, delim_whitespace=True)
         Aeff_total = df["Aeff_total[cm^2]"][0]
         BG_total = df["BG_total[ph]"][0]
-        
-        #define background per bin:
+
+        #background of the original bins:
         #Note: background is assumed constant over exposure time:
-        BG_bin = BG_total / numbins
+        bg_counts = BG_total * t_width / np.sum(t_width)
+
+        #make desired binning:
+        if binning == "uniform":
+            new_edges = uniform_edges(len(counts),numbins)
+        elif binning == "edges":
+            new_edges = time_edges(np.append(t_low,t_high[-1]),edges)
+        elif binning == "significance":
+            new_edges = significance_edges(counts,bg_counts,min_sigma)
+        elif binning == "bayesian":
+            if event_file is None:
+                new_edges = bayesian_blocks(counts,t_width,p0)
+            else:
+                times = load_tra(self.context.resolve(event_file),cache_dir=self.cache_dir)["time"]
+                new_edges = time_edges(np.append(t_low,t_high[-1]),event_blocks(times,p0))
+        else:
+            raise ValueError("binning must be uniform, edges, significance, or bayesian, not %s" %binning)
+        print("rebinning %s bins into %s bins (%s)" %(len(counts),len(new_edges)-1,binning))
+
+        #sum counts, time, and background in new bins; calculate signficance of bins:
+        new_width = rebin(t_width,new_edges)
+        new_ct = rebin(counts,new_edges)
+        BG_bin = rebin(bg_counts,new_edges)
+        new_time_list = np.sqrt(t_center[new_edges[:-1]]*t_center[new_edges[1:]-1])
+        sig_list = significance(new_ct,BG_bin)
+        new_error_list = np.sqrt(new_ct + BG_bin)/new_width
+        new_ct_list = new_ct/new_width
         print()
         print("Background per bin: " + str(BG_bin))
-        print
-    
-        new_ct_list = []
-        new_time_list = []
-        new_error_list = []
-        sig_list = []
-        for i in range(0,numbins):
-            
-            #define new lower and upper limit of bin
-            ll = i*new
-            ul = ll+new
-            
-            #sum counts and time in new range; calculate signficance of bin:
-            new_time = np.sqrt(t_center[ll]*t_center[ul-1])
-            new_width = np.sum(t_width[ll:ul])
-            new_ct = np.sum(counts[ll:ul])
-            this_sig = new_ct / np.sqrt(new_ct + BG_bin) 
-            new_error = np.sqrt(new_ct + BG_bin)/new_width
-            new_ctps = new_ct/new_width
-
-            new_time_list.append(new_time)
-            new_ct_list.append(new_ctps)
-            new_error_list.append(new_error)
-            sig_list.append(this_sig)
-
-        new_ct_list = np.array(new_ct_list)
-        new_error_list = np.array(new_error_list)
+        print()
 
         #convert count rate to photon flux:
         ph_flux = new_ct_list / Aeff_total
@@ -490,34 +591,152 @@ class Process_MEGAlib:
         
         #write rebinned LC data:
         binrange = np.arange(0,len(sig_list))
-        d = {"bin": binrange, "sigma":sig_list, "flux[ph/cm^2/s]": ph_flux, "error[ph/cm^2/s]": ph_flux_error }
-        df = pd.DataFrame(data = d,columns=["bin", "sigma","flux[ph/cm^2/s]","error[ph/cm^2/s]"])
+        d = {"bin": binrange, "t_low[s]":t_low[new_edges[:-1]], "t_high[s]":t_high[new_edges[1:]-1], "sigma":sig_list, "flux[ph/cm^2/s]": ph_flux, "error[ph/cm^2/s]": ph_flux_error }
+        df = pd.DataFrame(data = d,columns=["bin","t_low[s]","t_high[s]","sigma","flux[ph/cm^2/s]","error[ph/cm^2/s]"])
         df.to_csv(os.path.join(wdir,"Rebinned_LC_summary.dat"),sep="\t",index=False)
         print()
         print("rebinning summary:")
         print(df)
         print()
 
+        results = {"plot":"lc", "plot_file":os.path.join(wdir,"LC.pdf"), "time":np.array(new_time_list),
+            "t_low":t_low[new_edges[:-1]], "t_high":t_high[new_edges[1:]-1],
+            "ct/s":new_ct_list, "ct/s_error":new_error_list, "flux":np.array(ph_flux), "flux_error":np.array(ph_flux_error),
+            "sigma":np.array(sig_list), "BG_bin":BG_bin}
+
         #plot LC:
+        if plot == True:
+            render(results, show=self.plots)
 
-        #for reproducing Mimrec output:
-        #plt.plot(new_time_list,new_ct_list,color="black",ls="",marker="o",ms=0.2)
-        #plt.errorbar(new_time_list,new_ct_list,yerr=new_error_list,color="black",ls="",marker="o",ms=0.1,elinewidth=0.55)
+        return results
 
-        plt.plot(new_time_list,ph_flux,color="black",ls="",marker="o",ms=0.2)
-        plt.errorbar(new_time_list,ph_flux,yerr=ph_flux_error,color="black",ls="",marker="o",ms=0.1,elinewidth=0.55)
-        
-        plt.xlabel("Time [s]")
-        plt.ylabel("Flux [$\mathrm{ph \ cm^{-2} \ sec^{-1}}$]")
-
-        tmin = min(new_time_list)
-        tmax = max(new_time_list)
-        plt.xlim(tmin,tmax)
-        #plt.ylim(0.015,0.0445)
-        plt.savefig(os.path.join("%s","LC.pdf") %wdir)
-        
-        if self.plots == True:
-            plt.show()
+    def MC_Significance(self,wdir,kind="SED",numbins=None,n_realizations=10000,thresholds=[3.0,5.0],chunk_size=None,seed=None):
+
+        """
+
+         Calibrate the significance of the SED or light curve bins with Poisson realizations of the counts.
+
+         input definitions:
+
+         wdir: path to Mimrec run to process, i.e. Mimrec/name_of_run
+           - needs to contain extracted_spectrum.dat (SED), or extracted_lc.dat and total_Aeff_and_BG_for_LC.dat (LC)
+           - output is saved here as MC_significance_<kind>.dat
+
+         kind: Optional input. "SED" or "LC".
+
+         numbins: number of bins for light curve (same as Make_LC); only needed for kind="LC"
+
+         n_realizations: Optional input. Number of Poisson realizations.
+
+         thresholds: Optional input. List of significance thresholds for detection fractions and false-alarm rates.
+
+         chunk_size: Optional input. Maximum number of realizations held in memory at once; default is all at once.
+
+         seed: Optional input. Seed for reproducible realizations.
+
+         Note: the expected counts of each bin are the same as in Make_SED and Make_LC; see Significance_module.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Process_MEGAlib_Module ************")
+        print("Running MC_Significance...")
+        print()
+
+        if kind == "LC" and numbins is None:
+            raise ValueError("numbins is needed for kind='LC'")
+
+        import pandas as pd
+
+        #path to Mimrec run:
+        wdir = self.context.resolve(wdir)
+
+        if kind == "SED":
+            df = pd.read_csv(os.path.join(wdir,"extracted_spectrum.dat"),delim_whitespace=True)
+            bg_scale = self._background_scale()
+            src_counts = np.array(df["src_ct/keV"]*df["BW[keV]"])
+            bg_counts = np.array(df["bg_ct/keV"]*bg_scale*df["BW[keV]"])
+
+        elif kind == "LC":
+            df = pd.read_csv(os.path.join(wdir,"extracted_lc.dat"),delim_whitespace=True)
+            counts = np.array(df["ct/s"]*df["t_width[s]"])
+            new_edges = uniform_edges(len(counts),numbins)
+            src_counts = rebin(counts,new_edges)
+            BG_total = pd.read_csv(os.path.join(wdir,"total_Aeff_and_BG_for_LC.dat"),delim_whitespace=True)["BG_total[ph]"][0]
+            bg_counts = rebin(BG_total*df["t_width[s]"]/np.sum(df["t_width[s]"]),new_edges)
+
+        else:
+            raise ValueError("kind must be SED or LC, not %s" %kind)
+
+        result = monte_carlo_significance(src_counts, bg_counts, n_realizations, thresholds, chunk_size=chunk_size, seed=seed)
+
+        #write summary:
+        d = {"bin":np.arange(0,len(src_counts)), "src_counts":src_counts, "bg_counts":bg_counts, "sigma":result["sigma"],
+            "sigma_mean":result["sigma_mean"], "sigma_std":result["sigma_std"]}
+        for i,this_threshold in enumerate(thresholds):
+            d["detection_fraction_%gsigma" %this_threshold] = result["detection_fraction"][i]
+            d["false_alarm_%gsigma" %this_threshold] = result["false_alarm"][i]
+        d["ul_mean[counts]"] = result["ul_mean"]
+        df = pd.DataFrame(data=d)
+        df.to_csv(os.path.join(wdir,"MC_significance_%s.dat" %kind),sep="\t",index=False)
+
+        print("significance from %s realizations:" %n_realizations)
+        print(df)
+        print()
+        for this_threshold,this_rate in zip(thresholds,result["global_false_alarm"]):
+            print("false-alarm rate for any bin >= %s sigma: %s" %(this_threshold,this_rate))
+        print()
+
+        return df
+
+    def load_tables(self):
+
+        """
+
+         Read the tables shared by all runs (input model, sensitivity and effective area files) and the background scaling.
+
+         Note: these are read on first use anyway; call this before processing many runs (e.g. in Batch_Process_module),
+           so that they are read once and not by every run or worker process.
+
+        """
+
+        self._read_table(self.input_model, delim_whitespace=True, skiprows=[0,1,2,3,4], names=["row","energy","flux"])
+        self._read_table(os.path.join(self.context.performance_dir, self.mission + "_sensitivity.txt"),skiprows=[0],delim_whitespace=True,names=["energy","flux"])
+        for each in ["untracked_compton_silicon","untracked_compton","tracked_compton","pair"]:
+            this_file = os.path.join(self.context.performance_dir, "%s_effective_area_%s.txt" %(self.mission,each))
+            if os.path.isfile(this_file) == True:
+                self._read_table(this_file, delim_whitespace=True, skiprows=[0],names=["energy","effective_area"])
+        self._background_scale()
 
         return
-        
+
+    def _read_table(self, this_file, **kwargs):
+
+        """Read a table with pd.read_csv once per instance, and return a copy."""
+
+        key = (this_file, repr(sorted(kwargs.items())))
+        if key not in self._tables:
+            import pandas as pd
+            self._tables[key] = pd.read_csv(this_file, **kwargs)
+
+        return self._tables[key].copy()
+
+    def _model_file(self, wdir):
+
+        """Input model of a Mimrec run: the model of a reweighted run (see Reweight_module), otherwise spectrum_file."""
+
+        this_file = os.path.join(wdir,MODEL_FILE)
+        if os.path.isfile(this_file) == True:
+            return this_file
+
+        return self.input_model
+
+    def _background_scale(self):
+
+        """Factor scaling the background counts to the observation time (see Event_Index_module.background_scale), found once per instance."""
+
+        if self._bg_scale is None:
+            self._bg_scale = background_scale(self.time, self.bg_tra_file, self.background_exposure, self.cache_dir)
+
+        return self._bg_scale
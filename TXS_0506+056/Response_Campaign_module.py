@@ -0,0 +1,437 @@
+##########################################################
+#
+# Purpose: Instrument response (energy resolution, angular resolution, effective area) from monoenergetic
+#   far-field point sources, as in the Simulation_Challenge, for a grid of energies and incidence angles at once.
+#   - Each grid point is a Cosima source file like FarFieldPointSource_1MeV.source (see response_campaign in Run_MEGAlib).
+#   - The events of all grid points are analyzed together: histograms of all points are made with one np.bincount,
+#     and the photopeak and ARM fits of all points are solved at once.
+#   - Energy resolution: Gaussian fit of the photopeak of the Compton events (log-parabola fit of the bins around the peak).
+#   - Angular resolution: FWHM of the ARM distribution of the photopeak events (Compton), or the 68% containment angle (pair).
+#   - Effective area: events in the photopeak (+/- 3 sigma) and within one FWHM of the source (ARM),
+#     divided by the number of generated events, times the area of the surrounding sphere.
+#   - The results are written in the format of the mission performance files (*_Performance/*.txt).
+#
+# Index of functions:
+#
+#   campaign_points(energies, angles, phi=0.0)
+#   write_point_source(output, name, energy, theta, phi, n_triggers, geometry_file, physics_list="auto")
+#   generated_events(sim_file)
+#   event_classes(events)
+#   gaussian_peak_fit(centers, counts, fraction=0.25)
+#   photopeak_fit(relative_energy, group, n_groups, window=0.3, numbins=240)
+#   arm_fwhm(arm, group, n_groups, acceptance=15.0, numbins=100)
+#   containment_radius(angle, group, n_groups, fraction=0.68)
+#   analyze_points(points, events, generated, area, acceptance=15.0, photopeak_sigma=3.0)
+#   write_performance_tables(results, out_dir, mission)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import numpy as np
+from Tra_Reader_module import EVENT_TYPES
+from Extract_MEGAlib_module import arm_batch
+##########################################################
+
+#event classes of the performance files (index of event_classes):
+RESPONSE_CLASSES = ["untracked_compton","tracked_compton","pair"]
+
+#performance files written for each class: effective area, and angular resolution (same names as in *_Performance):
+AREA_FILES = {"untracked_compton":"%s_effective_area_untracked_compton.txt", "tracked_compton":"%s_effective_area_tracked_compton.txt", "pair":"%s_effective_area_pair.txt"}
+RESOLUTION_FILES = {"untracked_compton":"%s_untracked_compton_angular_resolution.txt", "tracked_compton":"%s_compton_angular_resolution.txt", "pair":"%s_pair_angular_resolution.txt"}
+
+#energy above which the Standard physics list is used instead of Livermore [keV]:
+LIVERMORE_MAX = 10000.0
+
+def campaign_points(energies, angles, phi=0.0):
+
+    """
+
+     Grid points of a response campaign.
+
+     input definitions:
+
+     energies: energies of the monoenergetic sources [keV]
+
+     angles: incidence angles theta [deg]
+
+     phi: Optional input. Azimuth of all sources [deg].
+
+     Note: returns a list of dictionaries with name, energy, theta, and phi, ordered by angle, then energy.
+
+    """
+
+    points = []
+    for theta in angles:
+        for energy in energies:
+            name = "E%gkeV_theta%g" %(energy,theta)
+            if phi != 0:
+                name += "_phi%g" %phi
+            points.append({"name":name.replace(".","p"), "energy":float(energy), "theta":float(theta), "phi":float(phi)})
+
+    return points
+
+def write_point_source(output, name, energy, theta, phi, n_triggers, geometry_file, physics_list="auto"):
+
+    """
+
+     Write the Cosima source file of a monoenergetic far-field point source (same as FarFieldPointSource_1MeV.source).
+
+     input definitions:
+
+     output: path of the source file
+
+     name: name of the run (FFPS.FileName); the .sim file is <name>.inc1.id1.sim
+
+     energy: energy of the photons [keV]
+
+     theta, phi: position of the source [deg]
+
+     n_triggers: number of triggered events before the run stops
+
+     geometry_file: full path to the geometry file
+
+     physics_list: Optional input. EM physics list; default is Livermore up to LIVERMORE_MAX and Standard above.
+
+    """
+
+    if physics_list == "auto":
+        physics_list = "Livermore" if energy <= LIVERMORE_MAX else "Standard"
+
+    f = open(output,"w")
+    f.write("# Monoenergetic far-field point source for the response campaign\n\n\n")
+    f.write("Version          1\n")
+    f.write("Geometry         %s\n" %geometry_file)
+    f.write("CheckForOverlaps 1000 0.01\n")
+    f.write("PhysicsListEM    %s\n\n" %physics_list)
+    f.write("StoreCalibrate                 true\n")
+    f.write("StoreSimulationInfo            true\n")
+    f.write("StoreOnlyEventsWithEnergyLoss  true  // Only relevant if no trigger criteria is given!\n")
+    f.write("DiscretizeHits                 true\n\n")
+    f.write("Run FFPS\n")
+    f.write("FFPS.FileName              %s\n" %name)
+    f.write("FFPS.NTriggers             %s\n\n\n" %int(n_triggers))
+    f.write("FFPS.Source 			Pos\n")
+    f.write("Pos.ParticleType        1\n")
+    f.write("Pos.Beam                FarFieldPointSource  %r %r\n" %(float(theta),float(phi)))
+    f.write("Pos.Spectrum            Mono  %r\n" %float(energy))
+    f.write("Pos.Flux                1000.0\n")
+    f.close()
+
+    return output
+
+def generated_events(sim_file):
+
+    """Number of generated (started) events of a .sim file, from the TS line of its footer."""
+
+    with open(sim_file,"rb") as f:
+        f.seek(0,os.SEEK_END)
+        f.seek(max(0,f.tell()-4096))
+        lines = f.read().splitlines()
+
+    for line in lines[::-1]:
+        values = line.split()
+        if len(values) >= 2 and values[0] == b"TS":
+            return int(float(values[1]))
+
+    raise ValueError("no TS line (number of generated events) at the end of %s" %sim_file)
+
+def event_classes(events):
+
+    """
+
+     Class of each event: index of RESPONSE_CLASSES, or -1 for other events.
+
+     Note: Compton events with an electron track of more than one hit (TL > 1) are tracked, the others untracked.
+
+    """
+
+    classes = np.full(len(events), -1, dtype=int)
+    is_compton = events["type"] == EVENT_TYPES["CO"]
+    classes[is_compton & (events["track_length"] <= 1)] = 0
+    classes[is_compton & (events["track_length"] > 1)] = 1
+    classes[events["type"] == EVENT_TYPES["PA"]] = 2
+
+    return classes
+
+def _histograms(values, group, n_groups, edges):
+
+    """Histograms of values for each group, shape (n_groups, bins), with one np.bincount; values outside of the edges are dropped."""
+
+    n_bins = len(edges) - 1
+    this_bin = np.searchsorted(edges, values, side="right") - 1
+    inside = (this_bin >= 0) & (this_bin < n_bins) & (group >= 0)
+
+    return np.bincount(group[inside]*n_bins + this_bin[inside], minlength=n_groups*n_bins).reshape(n_groups,n_bins)
+
+def gaussian_peak_fit(centers, counts, fraction=0.25):
+
+    """
+
+     Fit a Gaussian to the peak of many histograms at once.
+
+     input definitions:
+
+     centers: bin centers (same for all histograms)
+
+     counts: histograms, shape (histograms, bins)
+
+     fraction: Optional input. Only the bins around the maximum with at least fraction x maximum counts are fitted.
+
+     Note: returns the mean and sigma of each histogram (nan if fewer than 3 bins are fitted or the peak is not concave).
+       ln(counts) is fitted with a parabola by weighted least squares (weights = counts, the inverse variance of ln(counts)),
+       with the 3x3 normal equations of all histograms solved in one np.linalg.solve.
+
+    """
+
+    counts = np.atleast_2d(np.asarray(counts,dtype=float))
+    x = np.asarray(centers,dtype=float)
+    peak = np.argmax(counts,axis=1)
+    maximum = counts[np.arange(len(counts)),peak]
+
+    #bins above the threshold that are connected to the maximum:
+    above = (counts >= fraction*maximum[:,None]) & (counts > 0)
+    runs = np.cumsum(above == False,axis=1)
+    fitted = above & (runs == runs[np.arange(len(counts)),peak][:,None])
+
+    weights = np.where(fitted, counts, 0.0)
+    log_counts = np.log(np.where(fitted, counts, 1.0))
+    powers = np.stack([np.ones_like(x), x, x**2])
+    normal = np.einsum("hb,ib,jb->hij", weights, powers, powers)
+    target = np.einsum("hb,ib,hb->hi", weights, powers, log_counts)
+
+    valid = np.sum(fitted,axis=1) >= 3
+    normal[valid == False] = np.eye(3)
+    coefficients = np.linalg.solve(normal, target[:,:,None])[:,:,0]
+    b, c = coefficients[:,1], coefficients[:,2]
+
+    valid &= c < 0
+    with np.errstate(divide="ignore",invalid="ignore"):
+        mean = np.where(valid, -b/(2*c), np.nan)
+        sigma = np.where(valid, np.sqrt(-1/(2*c)), np.nan)
+
+    return mean, sigma
+
+def photopeak_fit(relative_energy, group, n_groups, window=0.3, numbins=240):
+
+    """
+
+     Photopeak of each group of events (e.g. grid point), from the measured energy relative to the true energy.
+
+     input definitions:
+
+     relative_energy: measured energy / true energy - 1 of each event
+
+     group: group of each event (0 to n_groups-1; -1 is not used)
+
+     n_groups: number of groups
+
+     window: Optional input. Histogram range -window to window around the true energy.
+
+     numbins: Optional input. Number of histogram bins.
+
+     Note: returns the relative mean and sigma of the photopeak of each group (see gaussian_peak_fit).
+
+    """
+
+    edges = np.linspace(-window, window, numbins+1)
+    counts = _histograms(relative_energy, group, n_groups, edges)
+
+    return gaussian_peak_fit((edges[1:] + edges[:-1])/2.0, counts)
+
+def arm_fwhm(arm, group, n_groups, acceptance=15.0, numbins=100):
+
+    """
+
+     FWHM of the ARM distribution of each group of events.
+
+     input definitions:
+
+     arm: ARM of each event [deg]
+
+     group: group of each event (0 to n_groups-1; -1 is not used)
+
+     n_groups: number of groups
+
+     acceptance: Optional input. Histogram range -acceptance to acceptance [deg] (acceptance radius of mimrec).
+
+     numbins: Optional input. Number of histogram bins.
+
+     Note: the width is taken at half of the maximum of the histogram (smoothed over 3 bins), with linear interpolation
+       between the bins on either side of the peak; groups whose ARM distribution is wider than the histogram get nan.
+
+    """
+
+    edges = np.linspace(-acceptance, acceptance, numbins+1)
+    centers = (edges[1:] + edges[:-1])/2.0
+    counts = _histograms(arm, group, n_groups, edges).astype(float)
+    padded = np.pad(counts,((0,0),(1,1)))
+    smooth = (padded[:,:-2] + padded[:,1:-1] + padded[:,2:])/3.0
+
+    rows = np.arange(n_groups)
+    peak = np.argmax(smooth,axis=1)
+    half = smooth[rows,peak]/2.0
+    index = np.arange(numbins)[None,:]
+    below = smooth < half[:,None]
+
+    #last bin below half maximum left of the peak, and first one right of the peak:
+    left = np.max(np.where(below & (index < peak[:,None]), index, -1),axis=1)
+    right = np.min(np.where(below & (index > peak[:,None]), index, numbins),axis=1)
+    valid = (left >= 0) & (right < numbins) & (half > 0)
+    left = np.clip(left,0,numbins-2)
+    right = np.clip(right,1,numbins-1)
+
+    def crossing(i, j):
+        with np.errstate(divide="ignore",invalid="ignore"):
+            t = (half - smooth[rows,i])/(smooth[rows,j] - smooth[rows,i])
+        return centers[i] + t*(centers[j] - centers[i])
+
+    return np.where(valid, crossing(right,right-1) - crossing(left,left+1), np.nan)
+
+def containment_radius(angle, group, n_groups, fraction=0.68):
+
+    """
+
+     Angle containing fraction of the events of each group (e.g. the 68% containment of pair events).
+
+     Note: one sort of all events; groups without events get nan.
+
+    """
+
+    angle = np.asarray(angle,dtype=float)
+    keep = (group >= 0) & np.isfinite(angle)
+    angle = angle[keep]
+    group = group[keep]
+
+    order = np.lexsort((angle,group))
+    n = np.bincount(group,minlength=n_groups)
+    start = np.concatenate([[0],np.cumsum(n)[:-1]])
+    position = start + np.maximum(np.ceil(fraction*n).astype(int) - 1, 0)
+
+    radius = np.full(n_groups, np.nan)
+    radius[n > 0] = angle[order][position[n > 0]]
+
+    return radius
+
+def analyze_points(points, events, generated, area, acceptance=15.0, photopeak_sigma=3.0):
+
+    """
+
+     Energy resolution, angular resolution, and effective area of all grid points.
+
+     input definitions:
+
+     points: grid points (see campaign_points)
+
+     events: list with the structured array of the events of each point (Tra_Reader_module.read_tra)
+
+     generated: number of generated events of each point (see generated_events)
+
+     area: area of the surrounding sphere [cm^2]
+
+     acceptance: Optional input. Maximum ARM of the events used for the ARM fits [deg].
+
+     photopeak_sigma: Optional input. Half width of the photopeak selection in sigma.
+
+     Note: returns a dictionary of arrays: energy, theta, phi, generated, photopeak_mean [keV] and sigma [keV]
+       (of the Compton events), and for each class of RESPONSE_CLASSES the angular resolution [deg]
+       (<class>_resolution), the selected events (<class>_counts), and the effective area [cm^2] (<class>_area).
+
+    """
+
+    n_points = len(points)
+    n_classes = len(RESPONSE_CLASSES)
+    energy = np.array([each["energy"] for each in points])
+    generated = np.asarray(generated,dtype=float)
+
+    #all events of all points, with the point, class, and ARM (angle to the source for pair events) of each event:
+    point = np.concatenate([np.full(len(each),i) for i,each in enumerate(events)]).astype(int)
+    classes = np.concatenate([event_classes(each) for each in events]).astype(int)
+    measured = np.concatenate([each["energy"] for each in events]).astype(float)
+    arm = np.concatenate([arm_batch(each, [(this["theta"],this["phi"])])[0] for each,this in zip(events,points)]).astype(float)
+    relative_energy = measured/energy[point] - 1
+    is_compton = (classes == 0) | (classes == 1)
+    group = np.where(classes >= 0, point*n_classes + classes, -1)
+
+    #photopeak of the Compton events of each point:
+    mean, sigma = photopeak_fit(relative_energy, np.where(is_compton, point, -1), n_points)
+    in_photopeak = np.abs(relative_energy - mean[point]) <= photopeak_sigma*sigma[point]
+
+    #angular resolution of each point and class:
+    compton_group = np.where(is_compton & in_photopeak, group, -1)
+    resolution = arm_fwhm(arm, compton_group, n_points*n_classes, acceptance)
+    pair_group = np.where(classes == 2, group, -1)
+    resolution = np.where(np.arange(n_points*n_classes) % n_classes == 2, containment_radius(arm, pair_group, n_points*n_classes), resolution)
+
+    #effective area: photopeak events within one FWHM (Compton), and pair events within the 68% containment:
+    with np.errstate(invalid="ignore"):
+        selected = np.where(is_compton, in_photopeak & (np.abs(arm) <= resolution[np.maximum(group,0)]), (classes == 2) & (arm <= resolution[np.maximum(group,0)]))
+    counts = np.bincount(group[selected & (group >= 0)], minlength=n_points*n_classes).reshape(n_points,n_classes)
+    resolution = resolution.reshape(n_points,n_classes)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        effective_area = counts/generated[:,None]*area
+
+    results = {"energy":energy, "theta":np.array([each["theta"] for each in points]), "phi":np.array([each["phi"] for each in points]),
+        "generated":generated, "photopeak_mean":energy*(1 + mean), "sigma":energy*sigma}
+    for k,name in enumerate(RESPONSE_CLASSES):
+        results[name + "_resolution"] = resolution[:,k]
+        results[name + "_counts"] = counts[:,k]
+        results[name + "_area"] = effective_area[:,k]
+
+    return results
+
+def _table_value(value):
+
+    """Number in the format of the performance files, e.g. 1.37165e+0."""
+
+    mantissa, exponent = ("%.5e" %value).split("e")
+
+    return "%se%+d" %(mantissa,int(exponent))
+
+def _write_table(output, header, energy, values):
+
+    """Write a performance file: one header line, then energy [MeV] and value; rows without a finite value are left out."""
+
+    keep = np.isfinite(values)
+    f = open(output,"w")
+    f.write(header + "\n")
+    for this_energy,this_value in zip(energy[keep],values[keep]):
+        f.write("%s\t%s\n" %(_table_value(this_energy/1000.0),_table_value(this_value)))
+    f.close()
+
+    return output
+
+def write_performance_tables(results, out_dir, mission):
+
+    """
+
+     Write the results of one incidence angle (see analyze_points) as mission performance files.
+
+     input definitions:
+
+     results: dictionary from analyze_points, for the points of one incidence angle
+
+     out_dir: output directory (created if needed), e.g. used as <mission>_Performance
+
+     mission: either AMEGO or AMEGO-X
+
+     Note: writes the effective area and angular resolution files of each class of RESPONSE_CLASSES
+       (same names and columns as in *_Performance, read by energy_dependent_mimrec, Effective_Area, and forward_fold),
+       and <mission>_energy_resolution.txt with the sigma of the photopeak. Returns the list of files.
+
+    """
+
+    if os.path.isdir(out_dir) == False:
+        os.makedirs(out_dir)
+
+    order = np.argsort(results["energy"])
+    energy = results["energy"][order]
+
+    files = []
+    for name in RESPONSE_CLASSES:
+        files.append(_write_table(os.path.join(out_dir, AREA_FILES[name] %mission), "energy [MeV]\teffective_area [cm^2]", energy, results[name + "_area"][order]))
+        files.append(_write_table(os.path.join(out_dir, RESOLUTION_FILES[name] %mission), "Energy[MeV]\tResolution[deg]", energy, results[name + "_resolution"][order]))
+    files.append(_write_table(os.path.join(out_dir, "%s_energy_resolution.txt" %mission), "Energy[MeV]\tSigma[MeV]", energy, results["sigma"][order]/1000.0))
+
+    return files
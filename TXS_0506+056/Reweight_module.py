@@ -0,0 +1,160 @@
+##########################################################
+#
+# Purpose: Reweight an existing simulation to new source models, so that a new model needs no new Cosima and Revan run.
+#   - The true (simulated) energy of each reconstructed event is taken from the IA INIT record of the .sim file,
+#     matched by event ID with the event index of the .sim file (see Event_Index_module).
+#   - The weight of an event for a model is new_model(E_true)/generating_model(E_true), with both spectra in ph/cm^2/s/keV
+#     (linear interpolation, as in Effective_Area); events outside of the generated energy range get weight 0.
+#   - Weighted spectra and light curves of all models are histogrammed at once (one np.bincount for all models).
+#   - Each model is written as a Mimrec run directory (extracted_spectrum.dat, extracted_lc.dat, and the model as MODEL_FILE),
+#     which Effective_Area, Make_SED, Make_LC, and Batch_Process_module process like any other run.
+#
+# Index of functions:
+#
+#   read_spectrum(spectrum_file)
+#   write_spectrum(energy, diff_flux, spectrum_file, comment="", interpolation="LIN")
+#   true_energy(sim_file, event_ids, index_dir=None)
+#   model_weights(energy, generating_model, models)
+#   weighted_histograms(values, weights, edges)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import numpy as np
+from Event_Index_module import load_index
+##########################################################
+
+#model spectrum of a reweighted Mimrec run (used instead of spectrum_file by Process_MEGAlib):
+MODEL_FILE = "model_spectrum.dat"
+
+def read_spectrum(spectrum_file):
+
+    """
+
+     Read a model spectrum; returns energy [keV] and differential photon flux [ph/cm^2/s/keV].
+
+     input definitions:
+
+     spectrum_file: model spectrum in one of two formats:
+       - Cosima spectrum file (as spectrum_file in inputs.yaml): rows "DP energy[keV] flux[ph/cm^2/s/keV]"
+       - SED file (as the starting model of Make_Cosima_input): columns energy[eV] and flux[erg/cm^2/s]
+
+    """
+
+    with open(spectrum_file,"r") as f:
+        lines = f.read().splitlines()
+
+    if len(lines) > 0 and lines[0].split()[:2] == ["energy[eV]","flux[erg/cm^2/s]"]:
+        data = np.loadtxt(lines[1:],ndmin=2)
+        erg_to_keV = 6.242e8
+        energy = data[:,0]*(1e-3) #keV
+        return energy, data[:,1]/(energy**2)*erg_to_keV #ph/cm^2/s/keV
+
+    data = np.array([each.split()[1:3] for each in lines if each.startswith("DP")],dtype=float)
+    if len(data) == 0:
+        raise ValueError("no spectrum found in %s" %spectrum_file)
+
+    return data[:,0], data[:,1]
+
+def write_spectrum(energy, diff_flux, spectrum_file, comment="", interpolation="LIN"):
+
+    """Write a model spectrum in the format of the Cosima spectrum file (5 header lines, then DP rows); interpolation is the IP of Cosima."""
+
+    with open(spectrum_file,"w") as f:
+        f.write("#rows\tenergy [keV]\tdiff_flux [ph/cm^2/s/keV]\n")
+        f.write("#%s\n\nIP \t%s\t\n\n" %(comment,interpolation))
+        f.write("".join(["DP\t%r\t\t\t%r\n" %(this_energy,this_flux) for this_energy,this_flux in zip(np.asarray(energy,dtype=float).tolist(),np.asarray(diff_flux,dtype=float).tolist())]))
+
+    return spectrum_file
+
+def true_energy(sim_file, event_ids, index_dir=None):
+
+    """
+
+     True (simulated) energy of events, from the IA INIT records of the .sim file.
+
+     input definitions:
+
+     sim_file: .sim file of the simulation (Cosima output)
+
+     event_ids: IDs of the reconstructed events (e.g. the id column of Tra_Reader_module.read_tra)
+
+     index_dir: Optional input. Directory of the event index of the .sim file (see Event_Index_module).
+
+     Note: returns the energies [keV]; events whose ID is not in the .sim file get nan.
+
+    """
+
+    index, meta = load_index(sim_file, index_dir)
+    sim_ids = meta["sorted_id"]
+
+    event_ids = np.asarray(event_ids)
+    energy = np.full(len(event_ids), np.nan)
+    if len(sim_ids) == 0:
+        return energy
+
+    position = np.minimum(np.searchsorted(sim_ids, event_ids), len(sim_ids)-1)
+    found = sim_ids[position] == event_ids
+    energy[found] = index["energy"][meta["by_id"][position[found]]]
+
+    return energy
+
+def model_weights(energy, generating_model, models):
+
+    """
+
+     Weights of the events for each model, new_model(E)/generating_model(E).
+
+     input definitions:
+
+     energy: true energies of the events [keV]
+
+     generating_model: (energy [keV], diff_flux [ph/cm^2/s/keV]) of the simulated spectrum (spectrum_file)
+
+     models: list of (energy [keV], diff_flux [ph/cm^2/s/keV]) of the new models
+
+     Note: returns an array of shape (models, events). Weights are 0 outside of the energy range
+       of the generating model or of the new model, where the generating model is 0, and for events without a true energy (nan).
+
+    """
+
+    energy = np.asarray(energy,dtype=float)
+    generated = np.interp(energy, generating_model[0], generating_model[1], left=0.0, right=0.0)
+    valid = np.isfinite(energy) & (generated > 0)
+    generated = np.where(valid, generated, 1.0)
+
+    weights = np.zeros((len(models),len(energy)))
+    for i,(model_energy,model_flux) in enumerate(models):
+        weights[i] = np.where(valid, np.interp(energy, model_energy, model_flux, left=0.0, right=0.0)/generated, 0.0)
+
+    return weights
+
+def weighted_histograms(values, weights, edges):
+
+    """
+
+     Weighted histograms of the same values for many sets of weights.
+
+     input definitions:
+
+     values: values of the events (e.g. measured energy or time)
+
+     weights: array of shape (models, events)
+
+     edges: edges of the bins [edges[i], edges[i+1]) as in ROOT
+
+     Note: returns an array of shape (models, bins); all models are histogrammed with one np.bincount.
+
+    """
+
+    values = np.asarray(values,dtype=float)
+    weights = np.atleast_2d(weights)
+    n_bins = len(edges) - 1
+
+    this_bin = np.searchsorted(edges, values, side="right") - 1
+    inside = (this_bin >= 0) & (this_bin < n_bins)
+    flat_bin = (np.arange(len(weights))[:,None]*n_bins + this_bin[inside][None,:]).ravel()
+
+    return np.bincount(flat_bin, weights=weights[:,inside].ravel(), minlength=len(weights)*n_bins).reshape(len(weights),n_bins)
@@ -0,0 +1,157 @@
+##########################################################
+#
+# Purpose: Resolve all input and output paths of a run explicitly.
+#   - Nothing depends on the current working directory, so the code never needs to change it (os.chdir).
+#   - This allows several runs (e.g. mimrec extractions with different radii) to run at the same time in one python process.
+#   - Large files (.sim, .tra) are referenced in the next stage directory by a link instead of a full copy.
+#
+# Index of functions:
+#
+#   Run_Context(superclass)
+#       -input_file(file_name)
+#       -resolve(path)
+#       -save_path(save_dir)
+#       -make_dir(path, clean=False)
+#       -copy_file(source, destination)
+#       -link_file(source, destination, mode="symlink")
+#       -remove_files(pattern)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import glob
+import shutil
+import tempfile
+import threading
+import uuid
+##########################################################
+
+#superclass:
+class Run_Context:
+
+    """Paths of the main working directory (home) of a run."""
+
+    def __init__(self, home, name, mission):
+
+        """
+
+         input definitions:
+
+         home: main working directory
+
+         name: name of run (SpaceSim.FileName in source file)
+
+         mission: either AMEGO or AMEGO-X
+
+        """
+
+        self.home = os.path.abspath(home)
+        self.name = name
+        self.mission = mission
+
+        #stage directories:
+        self.inputs_dir = os.path.join(self.home,"Inputs")
+        self.cosima_dir = os.path.join(self.home,"Cosima")
+        self.revan_dir = os.path.join(self.home,"Revan")
+        self.mimrec_dir = os.path.join(self.home,"Mimrec")
+        self.performance_dir = os.path.join(self.home,mission + "_Performance")
+
+        #main outputs of cosima and revan:
+        self.sim_file = os.path.join(self.cosima_dir,name + ".inc1.id1.sim")
+        self.tra_file = os.path.join(self.revan_dir,name + ".inc1.id1.tra")
+
+    def input_file(self, file_name):
+
+        """Full path of a file in the Inputs directory (full paths are returned unchanged)."""
+
+        return os.path.join(self.inputs_dir,file_name)
+
+    def resolve(self, path):
+
+        """Full path of a path given relative to the main working directory."""
+
+        return os.path.join(self.home,path)
+
+    def save_path(self, save_dir):
+
+        """Full path of a save directory of a mimrec run."""
+
+        return os.path.join(self.mimrec_dir,save_dir)
+
+    def make_dir(self, path, clean=False):
+
+        """Make a directory (and its parents); if clean=True an existing directory is removed first."""
+
+        if clean == True and os.path.isdir(path) == True:
+            shutil.rmtree(path)
+        if os.path.isdir(path) == False:
+            os.makedirs(path,exist_ok=True)
+
+        return path
+
+    def copy_file(self, source, destination):
+
+        """Copy a file through a temporary file, so that concurrent runs never see a partial copy."""
+
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(destination),delete=False) as f:
+            temp_file = f.name
+        shutil.copy2(source,temp_file)
+        os.replace(temp_file,destination)
+
+        return destination
+
+    def link_file(self, source, destination, mode="symlink"):
+
+        """
+
+         Make a file of an earlier stage available in a later stage directory, without copying it by default.
+
+         input definitions:
+
+         source: full path of the file
+
+         destination: full path in the stage directory
+
+         mode: Optional input. Either "symlink" (default), "hardlink", or "copy".
+            - hardlink falls back to symlink if source and destination are on different file systems.
+            - The destination is replaced atomically, so concurrent runs never see a partial file.
+
+        """
+
+        if mode not in ["symlink","hardlink","copy"]:
+            raise ValueError("link_mode must be symlink, hardlink, or copy, not %s" %mode)
+
+        source = os.path.abspath(source)
+        if os.path.isfile(source) == False:
+            raise FileNotFoundError(source)
+
+        if mode == "copy":
+            return self.copy_file(source, destination)
+
+        #temporary name unique to this call (threads of one process can link the same destination):
+        temp_file = "%s.tmp%s_%s_%s" %(destination, os.getpid(), threading.get_ident(), uuid.uuid4().hex)
+
+        if mode == "hardlink":
+            try:
+                os.link(source, temp_file)
+            except OSError:
+                print("hardlink not possible for %s; using a symlink..." %source)
+                mode = "symlink"
+
+        if mode == "symlink":
+            os.symlink(source, temp_file)
+
+        os.replace(temp_file, destination)
+
+        return destination
+
+    def remove_files(self, pattern):
+
+        """Remove old output files matching a glob pattern (full path), e.g. before a tool writes new ones."""
+
+        for each in glob.glob(pattern):
+            os.remove(each)
+
+        return
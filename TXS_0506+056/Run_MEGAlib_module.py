@@ -7,19 +7,36 @@
 # Index of functions:
 #
 #   Run_MEGAlib(superclass)
-#       -run_cosima(seed="none")
-#       -run_revan(config_file="none")
-#       -run_mimrec(save_dir, numbins, rad, config_file="none")
-#       -energy_dependent_mimrec(save_dir, numbins, config_file="none")
+#       -run_cosima(seed="none", shards=1, mode="local", workers=None)
+#       -merge_cosima_shards()
+#       -run_revan(config_file="none", chunks=1, workers=None)
+#       -run_mimrec(save_dir, numbins, rad, config_file="none", workers=None, engine="mimrec", lc_numbins=1000)
+#       -energy_dependent_mimrec(save_dir, numbins, config_file="none", engine="mimrec", workers=None)
+#       -sweep_mimrec(numbins, rad, energy_ranges="default", lc_numbins=1000, prefix="sweep")
+#       -extract_background(t0, t1, output="default")
+#       -merge_events(background_files="default", output="default", time_offsets=None, time_scales=None)
+#       -reweight_mimrec(save_dir, models, numbins, rad, lc_numbins=1000, sim_file="default")
+#       -forward_fold(save_dir, models, numbins, rad="default", containment=1.0, lc_numbins=100, write_runs=True)
+#       -response_campaign(save_dir, energies, angles=[0.0], n_triggers=20000, shards=1, seed="none", config_file="none", acceptance=15.0, workers=None)
+#       -run_cosima_async, run_revan_async, run_mimrec_async, energy_dependent_mimrec_async, response_campaign_async
+#           (same inputs; for code running in an event loop, e.g. several save_dir extractions at the same time)
 #
 ###########################################################
 
 ######################
 #imports:
-import os,sys,shutil 
+import os,sys,shutil,glob 
+import asyncio
 import yaml
-import pandas as pd
-from scipy.interpolate import interp1d
+import numpy as np
+from Tra_Reader_module import load_tra
+from Executor_module import make_command, run_command, make_job, run_job, run_jobs
+from Run_Context_module import Run_Context
+from Sim_Files_module import shard_seeds, write_shard_sources, merge_sim_files, split_sim_file, merge_tra_files
+from Event_Index_module import extract_time_window, merge_event_files, exposure, background_scale
+from Stage_Cache_module import MANIFEST, file_digests, stage_key, upstream_key, is_cached, write_manifest, clear_manifest
+#Note: pandas and the python extraction engine (Extract_MEGAlib_module, which needs pandas and scipy)
+#  are imported in the methods that use them, so that running cosima or revan does not load them.
 ######################
 
 #superclass:
@@ -27,10 +44,22 @@ class Run_MEGAlib:
     
     """Main inputs are specified in inputs.yaml file"""
 
-    def __init__(self,input_yaml):
+    def __init__(self,input_yaml,home=None):
+
+        """
+
+         input definitions:
+
+         input_yaml: inputs file
+
+         home: Optional input. Main working directory of the run. Default is the current working directory.
+
+        """
 
         #get home directory:
-        self.home = os.getcwd()
+        if home is None:
+            home = os.getcwd()
+        self.home = os.path.abspath(home)
         
         #load main inputs from yaml file:
         with open(input_yaml,"r") as file:
@@ -44,14 +73,59 @@ class Run_MEGAlib:
         self.bg_tra_file = inputs["background_tra_file"]
         self.mission = inputs["mission"]
 
-    def run_cosima(self,seed="none"):
+        #area of the surrounding sphere in cm^2 (for the effective area of response campaigns):
+        self.area = inputs.get("area",None)
+
+        #observation time, and exposure of the background tra file (for scaling the background counts; default 2 hrs):
+        self.time = float(inputs["observation_time"])
+        self.background_exposure = inputs.get("background_exposure",7200.0)
+        
+        #optional inputs for the python extraction engine:
+        self.energy_range = [float(each) for each in inputs.get("energy_range",[100.0,1.0e6])]
+        self.source_position = [float(each) for each in inputs.get("source_position",[0.0,0.0])]
+        self.cache_dir = inputs.get("cache_dir",None)
+
+        #number of parallel jobs (default is number of cores):
+        self.workers = inputs.get("workers",os.cpu_count())
+
+        #optional timeouts in seconds for each MEGAlib tool, e.g. {"cosima":360000, "mimrec":3600}:
+        self.timeouts = inputs.get("timeouts",{})
+
+        #how .sim and .tra files are made available in the next stage directory (symlink, hardlink, or copy):
+        self.link_mode = inputs.get("link_mode","symlink")
+
+        #skip stages whose inputs did not change (see Stage_Cache_module):
+        self.stage_cache = inputs.get("stage_cache",True)
+
+        #optional settings for PBS job arrays (sharded cosima runs):
+        self.pbs = {"setup":"cd /zfs/astrohe/Software\nsource MEGAlibX.sh", "resources":"select=1:ncpus=1:mem=15gb,walltime=92:00:00"}
+        self.pbs.update(inputs.get("pbs",{}))
+
+        #optional function called as progress_callback(name, line) for each line of output of the MEGAlib tools:
+        self.progress_callback = None
+
+        #all paths of the run are resolved explicitly (the working directory is never changed):
+        self.context = Run_Context(self.home, self.name, self.mission)
+
+    def run_cosima(self,seed="none",shards=1,mode="local",workers=None):
 
         """
 
          input definitions:
         
          seed: Optional input. Specify seed to be used in simulations for reproducing results.
+
+         shards: Optional input. Number of sub-runs the observation time is split into (default is 1, a single run).
+            - Each shard gets its own source file (<name>_shard<k>.source) and a seed derived from seed.
+            - Light curves are cut to the time window of each shard.
+            - The shard .sim files are merged into <name>.inc1.id1.sim, as expected by run_revan.
         
+         mode: Optional input for shards > 1. Either "local" or "pbs".
+            - local: shards run in parallel on this machine, and are merged when done.
+            - pbs: shards are submitted as a PBS job array; run merge_cosima_shards() when all jobs are done.
+
+         workers: Optional input. Number of shards to run in parallel with mode="local". Default is workers in inputs.yaml.
+
         """
 
         #make print statement:
@@ -60,30 +134,128 @@ class Run_MEGAlib:
         print("Running run_cosima...")
         print()
 
-        #make Cosima directory:
-        if os.path.isdir("Cosima") == True:
-            shutil.rmtree("Cosima")
-        os.system("mkdir Cosima")
-        os.chdir("Cosima")
+        if shards > 1 and mode not in ["local","pbs"]:
+            raise ValueError("mode must be 'local' or 'pbs', not %s" %repr(mode))
+
+        #key of this stage (runs with a random seed are never reused):
+        parameters = {"seed":seed, "shards":shards, "geometry":self.geo_file}
+        if seed == "none":
+            parameters["seed"] = "none-" + os.urandom(8).hex()
+        files = [self.context.input_file(each) for each in [self.source_file, self.spectrum_file, self.lc_file]]
+        digests = file_digests(files)
+        stage = {"key":stage_key("cosima", parameters, files, digests=digests), "parameters":parameters, "files":files, "digests":digests}
+        if self._cached(self.context.cosima_dir, stage["key"]) == True:
+            return
+
+        #make Cosima directory and remove old output (cosima does not overwrite existing .sim files):
+        cosima_dir = self.context.make_dir(self.context.cosima_dir)
+        self.context.remove_files(os.path.join(cosima_dir,self.name + ".inc*.sim"))
+        self.context.remove_files(os.path.join(cosima_dir,self.name + "_shard*.inc*.sim"))
    
-        shutil.copy2(self.home + "/Inputs/" + self.source_file,self.source_file)
-        shutil.copy2(self.home + "/Inputs/" + self.spectrum_file,self.spectrum_file)
-        shutil.copy2(self.home + "/Inputs/" + self.lc_file,self.lc_file)
+        for each in [self.source_file, self.spectrum_file, self.lc_file]:
+            self.context.copy_file(self.context.input_file(each), os.path.join(cosima_dir,each))
+
+        if shards > 1:
+            self._run_cosima_shards(seed, shards, mode, workers, stage)
+            return
 
         #run Cosima:
         if seed != "none":
             print("running with a seed...")
-            os.system("cosima -s %s %s | tee terminal_output_cosima.txt" %(seed,self.source_file))
+            self._run_tool(["cosima", "-s", seed, self.source_file], cosima_dir, "terminal_output_cosima.txt")
         if seed == "none":
             print("running with no seed...")
-            os.system("cosima %s | tee terminal_output_cosima.txt" %(self.source_file))
+            self._run_tool(["cosima", self.source_file], cosima_dir, "terminal_output_cosima.txt")
+
+        write_manifest(cosima_dir, "cosima", stage["key"], stage["parameters"], stage["files"], [self.context.sim_file], digests=stage["digests"])
+
+        return
+
+    def _run_cosima_shards(self, seed, shards, mode, workers, stage):
+
+        """Write the shard source files and run them locally or as a PBS job array."""
+
+        cosima_dir = self.context.cosima_dir
+
+        #write source files and seeds of each shard:
+        shard_list = write_shard_sources(os.path.join(cosima_dir,self.source_file), shards, cosima_dir, cosima_dir)
+        seeds = shard_seeds(seed, shards)
+        for this_shard,this_seed in zip(shard_list,seeds):
+            this_shard["seed"] = this_seed
+            if this_shard["active"] == False:
+                print("%s has no flux in its time window and is not simulated." %this_shard["file_name"])
+        with open(os.path.join(cosima_dir,"shards.yaml"),"w") as f:
+            yaml.dump({"stage":stage, "shards":shard_list},f)
+
+        active = [each for each in shard_list if each["active"] == True]
+
+        if mode == "local":
+            jobs = []
+            for each in active:
+                command = make_command(["cosima", "-s", each["seed"], os.path.basename(each["source_file"])],
+                    "terminal_output_cosima_%s.txt" %each["file_name"], self.timeouts.get("cosima"))
+                jobs.append(make_job(each["file_name"], [command], cosima_dir))
+            run_jobs(jobs, self._workers(workers), self.progress_callback)
+            self.merge_cosima_shards()
+
+        if mode == "pbs":
+
+            #job array over the active shards:
+            seeds = " ".join([str(each["seed"]) for each in active])
+            names = " ".join([each["file_name"] for each in active])
+            pbs_file = os.path.join(cosima_dir,"cosima_shards.pbs")
+            f = open(pbs_file,"w")
+            f.write("#PBS -N %s_cosima\n" %self.name)
+            f.write("#PBS -l %s\n" %self.pbs["resources"])
+            f.write("#PBS -J 0-%s\n\n" %(len(active)-1))
+            f.write("#the MEGAlib environment first needs to be sourced:\n")
+            f.write("%s\n\n" %self.pbs["setup"])
+            f.write("#change to Cosima directory and run shard of this array index:\n")
+            f.write("cd %s\n" %cosima_dir)
+            f.write("SEEDS=(%s)\n" %seeds)
+            f.write("NAMES=(%s)\n" %names)
+            f.write("cosima -s ${SEEDS[$PBS_ARRAY_INDEX]} ${NAMES[$PBS_ARRAY_INDEX]}.source > terminal_output_cosima_${NAMES[$PBS_ARRAY_INDEX]}.txt 2>&1\n")
+            f.close()
+
+            self._run_tool(["qsub", pbs_file], cosima_dir)
+            print("Submitted %s shards; run merge_cosima_shards() when all jobs are done." %len(active))
+
+        return
+
+    def merge_cosima_shards(self):
+
+        """
+
+         Merge the .sim files of a sharded cosima run (see run_cosima) into <name>.inc1.id1.sim.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running merge_cosima_shards...")
+        print()
+
+        with open(os.path.join(self.context.cosima_dir,"shards.yaml"),"r") as f:
+            shards = yaml.load(f,Loader=yaml.FullLoader)
+        shard_list = shards["shards"]
+        stage = shards["stage"]
+        active = [each for each in shard_list if each["active"] == True]
+
+        sim_files = [os.path.join(self.context.cosima_dir, each["file_name"] + ".inc1.id1.sim") for each in active]
+        missing = [each for each in sim_files if os.path.isfile(each) == False]
+        if len(missing) > 0:
+            raise FileNotFoundError("missing shard output: %s" %", ".join(missing))
 
-        #return home:
-        os.chdir(self.home)
+        total_time = shard_list[-1]["time_offset"] + shard_list[-1]["time"]
+        merge_sim_files(sim_files, [each["time_offset"] for each in active], self.context.sim_file, total_time)
+        print("Merged %s shards into %s" %(len(sim_files), self.context.sim_file))
+
+        write_manifest(self.context.cosima_dir, "cosima", stage["key"], stage["parameters"], stage["files"], [self.context.sim_file], digests=stage.get("digests"))
 
         return
 
-    def run_revan(self,config_file="none"):
+    def run_revan(self,config_file="none",chunks=1,workers=None):
 
         """
         
@@ -93,6 +265,13 @@ class Run_MEGAlib:
             - Configuration file specifying selections for event reconstruction.
             - Needs to be in "Inputs" directory
 
+         chunks: Optional input. Number of revan processes to run in parallel.
+            - The .sim file is split at event boundaries into chunks, each chunk is reconstructed
+              in its own scratch directory, and the .tra files are merged in event order into <name>.inc1.id1.tra.
+            - Default is 1 (one revan run over the whole .sim file).
+
+         workers: Optional input. Number of chunks to run at the same time. Default is workers in inputs.yaml.
+
         """
 
         #make print statement:
@@ -101,37 +280,78 @@ class Run_MEGAlib:
         print("Running run_revan...")
         print()
 
-        #make revan directory:
-        if os.path.isdir("Revan") == True:
-            shutil.rmtree("Revan")
-        os.system("mkdir Revan")
-        os.chdir("Revan")
-
-        #copy output sim file from cosima to revan directory:
-        cos_path = self.home + "/Cosima/"
-        sim_file = self.name + ".inc1.id1.sim"
-        shutil.copy2(cos_path+sim_file,sim_file)
-
-        #run revan:
+        #key of this stage (the number of chunks does not change the output):
+        parameters = {"geometry":self.geo_file}
+        files = []
         if config_file != "none":
-
-            #copy configuration file to revan directory:
-            this_config = self.home + "/Inputs/" + config_file
-            shutil.copy2(this_config,config_file)
-            
+            files = [self.context.input_file(config_file)]
+        upstream = upstream_key(self.context.cosima_dir, self.context.sim_file)
+        digests = file_digests(files)
+        key = stage_key("revan", parameters, files, upstream, digests)
+        if self._cached(self.context.revan_dir, key) == True:
+            return
+
+        #make revan directory and remove old output:
+        revan_dir = self.context.make_dir(self.context.revan_dir)
+        self.context.remove_files(self.context.tra_file)
+
+        #copy configuration file to revan directory:
+        options = []
+        if config_file != "none":
+            self.context.copy_file(self.context.input_file(config_file), os.path.join(revan_dir,config_file))
+            options = ["-c", os.path.join(revan_dir,config_file)]
             print("running with a configuration file...")
-            os.system("revan -g %s -c %s -f %s -n -a | tee revan_terminal_output.txt" %(self.geo_file, config_file, sim_file))
-
         if config_file == "none":
             print("running without a configuration file...")
-            os.system("revan -g %s -f %s -n -a | tee revan_terminal_output.txt" %(self.geo_file, sim_file))
 
-        #go home:
-        os.chdir(self.home)
+        if chunks > 1:
+            self._run_revan_chunks(options, chunks, workers)
+
+        if chunks <= 1:
+
+            #link output sim file from cosima to revan directory (see link_mode in inputs.yaml):
+            sim_file = os.path.basename(self.context.sim_file)
+            self.context.link_file(self.context.sim_file, os.path.join(revan_dir,sim_file), self.link_mode)
+
+            #run revan:
+            self._run_tool(["revan", "-g", self.geo_file] + options + ["-f", sim_file, "-n", "-a"], revan_dir, "revan_terminal_output.txt")
+
+        write_manifest(revan_dir, "revan", key, parameters, files, [self.context.tra_file], upstream, digests)
+
+        return
+
+    def _run_revan_chunks(self, options, chunks, workers):
+
+        """Split the .sim file into chunks, run revan on each chunk in parallel, and merge the .tra files."""
+
+        revan_dir = self.context.revan_dir
+        scratch_dirs = [self.context.make_dir(os.path.join(revan_dir,"scratch_chunk%s" %k), clean=True) for k in range(0,chunks)]
+
+        chunk_files = split_sim_file(self.context.sim_file, chunks, scratch_dirs, self.name)
+        print("split %s into %s chunks" %(self.context.sim_file, len(chunk_files)))
+
+        jobs = []
+        for k,chunk_file in enumerate(chunk_files):
+            command = make_command(["revan", "-g", self.geo_file] + options + ["-f", os.path.basename(chunk_file), "-n", "-a"],
+                "revan_terminal_output_chunk%s.txt" %k, self.timeouts.get("revan"))
+            jobs.append(make_job("revan_chunk%s" %k, [command], scratch_dirs[k]))
+        run_jobs(jobs, self._workers(workers), self.progress_callback)
+
+        #merge tra files in event order:
+        tra_files = [os.path.splitext(each)[0] + ".tra" for each in chunk_files]
+        merge_tra_files(tra_files, self.context.tra_file)
+        print("merged %s chunks into %s" %(len(tra_files), self.context.tra_file))
+
+        #keep the terminal output, remove the chunks:
+        for k,scratch_dir in enumerate(scratch_dirs):
+            log_file = os.path.join(scratch_dir,"revan_terminal_output_chunk%s.txt" %k)
+            if os.path.isfile(log_file) == True:
+                shutil.move(log_file, os.path.join(revan_dir,os.path.basename(log_file)))
+            shutil.rmtree(scratch_dir)
 
         return
 
-    def run_mimrec(self, save_dir, numbins, rad, config_file="none"):
+    def run_mimrec(self, save_dir, numbins, rad, config_file="none", workers=None, engine="mimrec", lc_numbins=1000):
 
         """
         
@@ -146,6 +366,18 @@ class Run_MEGAlib:
          config_file: Optional input. Configuration file specifying selections for image reconstruction.
             
             - Note: the configuration file overwrites numbins and rad when passed.
+            - Note: the configuration file can only be applied by mimrec, so engine="mimrec" is used when passed.
+
+         workers: Optional input. Number of mimrec jobs to run in parallel. Default is workers in inputs.yaml.
+
+         engine: Optional input. Either "mimrec" (default) or "python".
+            - python: the events are read from the tra files and histogrammed directly (no mimrec or ROOT runs).
+            - mimrec: mimrec, ExtractSpectrum.cxx, and ExtractLightCurve.cxx are ran.
+            - Both write extracted_spectrum.dat and extracted_lc.dat with the same columns.
+            - The energy range of the python engine is set by energy_range in inputs.yaml (mimrec uses its own binning),
+              and mimrec's event selections are not applied, so the spectra of the two engines can differ.
+
+         lc_numbins: Optional input. Number of time bins of the light curve with the python engine (default is 1000).
 
         """
 
@@ -155,88 +387,75 @@ class Run_MEGAlib:
         print("Running run_mimrec...")
         print()
 
-        #make mimrec directory:
-        if os.path.isdir("Mimrec") == False:
-            os.system("mkdir Mimrec")
-        os.chdir("Mimrec")
-
-        #make save directory:
-        if os.path.isdir(save_dir) == True:
-            shutil.rmtree(save_dir)
-        os.system("mkdir %s" %save_dir)
+        if config_file != "none" and engine == "python":
+            print("configuration file passed; running with mimrec engine...")
+            engine = "mimrec"
+
+        #key of this stage:
+        parameters = {"method":"run_mimrec", "numbins":numbins, "rad":rad, "engine":engine, "geometry":self.geo_file}
+        files = [self.context.input_file(self.bg_tra_file)]
+        if engine == "python":
+            parameters.update({"lc_numbins":lc_numbins, "energy_range":self.energy_range, "source_position":self.source_position})
+        if engine == "mimrec":
+            files += [os.path.join(self.home,"ExtractSpectrum.cxx"), os.path.join(self.home,"ExtractLightCurve.cxx")]
+        if config_file != "none":
+            files.append(self.context.input_file(config_file))
+        upstream = upstream_key(self.context.revan_dir, self.context.tra_file)
+        digests = file_digests(files)
+        key = stage_key("mimrec", parameters, files, upstream, digests)
+        if self._cached(self.context.save_path(save_dir), key) == True:
+            return
+
+        if engine == "python":
+            save_path = self._run_mimrec_python(save_dir, numbins, rad, lc_numbins)
+            outputs = self._stage_outputs(save_path, ["extracted_spectrum.dat","extracted_lc.dat"])
+            write_manifest(save_path, "mimrec", key, parameters, files, outputs, upstream, digests)
+            return
+
+        #make mimrec and save directory:
+        self.context.make_dir(self.context.mimrec_dir)
+        save_path = self.context.make_dir(self.context.save_path(save_dir))
     
-        #copy output tra file from revan to mimrec directory:
-        rev_path = self.home + "/Revan/"
-        tra_file = self.name + ".inc1.id1.tra"
-        shutil.copy2(rev_path+tra_file,tra_file)
-        
-        #define outputs:
-        src_output = save_dir + "/source_counts_spectrum.root"
-        lc_output = save_dir + "/source_LC.root"
-        bg_output = save_dir + "/background_counts_spectrum.root"
+        #link output tra file from revan to mimrec directory (see link_mode in inputs.yaml):
+        tra_file = os.path.join(self.context.mimrec_dir, os.path.basename(self.context.tra_file))
+        self.context.link_file(self.context.tra_file, tra_file, self.link_mode)
 
         #get bg file:
-        this_bg_file = self.home + "/Inputs/" + self.bg_tra_file
+        this_bg_file = self.context.input_file(self.bg_tra_file)
 
-        #run mimrec for both source and background:
+        #define selections for mimrec:
         if config_file != "none":
-            
-            config_file = self.home + "/Inputs/" + config_file
-            
+            config_file = self.context.input_file(config_file)
             print("running with a configuration file...")
-            
-            #source spectrum:
-            os.system("mimrec -g %s -c %s -f %s -s -o %s -n \
-                    | tee %s/source_mimrec_terminal_output.txt" %(self.geo_file, config_file, tra_file, src_output, save_dir))
-             
-            #background spectrum:
-            os.system("mimrec -g %s -c %s -f %s -s -n -o %s \
-                    | tee %s/background_mimrec_terminal_output.txt" %(self.geo_file, config_file, this_bg_file, bg_output, save_dir))
-            
-            #source ligh curve:
-            os.system("mimrec -g %s -c %s -f %s -l -o %s -n \
-                    | tee %s/lightcurve_mimrec_terminal_output.txt" %(self.geo_file, config_file, tra_file, lc_output, save_dir))
-            
-
+            spec_options = []
+            lc_options = []
         if config_file == "none":
-            
             print("running without a configuration file...")
-            
-            #source spectrum:
-            os.system("mimrec -g %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s \
-                     | tee %s/source_mimrec_terminal_output.txt" %(self.geo_file, tra_file, src_output, str(numbins+1), str(rad), save_dir))
-
-            #background spectrum:
-            os.system("mimrec -g %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s \
-                     | tee %s/background_mimrec_terminal_output.txt" %(self.geo_file, this_bg_file, bg_output, str(numbins+1), str(rad), save_dir))
-
-            #source light curve:
-            os.system("mimrec -g %s -f %s -l -o %s -n \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s \
-                     | tee %s/lightcurve_mimrec_terminal_output.txt" %(self.geo_file, tra_file, lc_output, str(rad), save_dir))
-                
-        #change to save directory:
-        os.chdir(save_dir)
+            spec_options = ["-C", "HistogramBins.Spectrum=%s" %str(numbins+1), "-C", "EventSelections.Source.UsePointSource=true", "-C", "EventSelections.Source.ARM.Max=%s" %str(rad)]
+            lc_options = ["-C", "EventSelections.Source.UsePointSource=true", "-C", "EventSelections.Source.ARM.Max=%s" %str(rad)]
+
+        #run mimrec for source spectrum, background spectrum, and source light curve in parallel:
+        #each job runs in its own scratch directory; the output is moved to the save directory.
+        jobs = []
+        for name, this_tra, mode, output, options in [("source", tra_file, "-s", "source_counts_spectrum.root", spec_options),
+                ("background", this_bg_file, "-s", "background_counts_spectrum.root", spec_options),
+                ("lightcurve", tra_file, "-l", "source_LC.root", lc_options)]:
+            command = self._mimrec_command(this_tra, mode, output, options, config_file, "%s_mimrec_terminal_output.txt" %name)
+            jobs.append(make_job(name, [command], os.path.join(save_path,"scratch_"+name), save_dir=save_path))
+        run_jobs(jobs, self._workers(workers), self.progress_callback)
 
         #extract spectrum histogram:
-        os.system("root -q -b %s/ExtractSpectrum.cxx" %self.home)
+        self._run_tool(["root", "-q", "-b", os.path.join(self.home,"ExtractSpectrum.cxx")], save_path)
         
         #extract light curve  histogram:
-        os.system("root -q -b %s/ExtractLightCurve.cxx" %self.home)
+        self._run_tool(["root", "-q", "-b", os.path.join(self.home,"ExtractLightCurve.cxx")], save_path)
 
-        #go home:
-        os.chdir(self.home)
+        outputs = self._stage_outputs(save_path, ["source_counts_spectrum.root","background_counts_spectrum.root","source_LC.root","extracted_spectrum.dat","extracted_lc.dat"])
+        write_manifest(save_path, "mimrec", key, parameters, files, outputs, upstream, digests)
 
         return
 
-    def energy_dependent_mimrec(self, save_dir, numbins, config_file="none"):
+    def energy_dependent_mimrec(self, save_dir, numbins, config_file="none", engine="mimrec", workers=None):
 
         """
         
@@ -252,6 +471,15 @@ class Run_MEGAlib:
          config_file: Optional input. Configuration file specifying selections for image reconstruction.
             
             - Note: the configuration file overwrites numbins and rad when passed.
+            - Note: the configuration file can only be applied by mimrec, so engine="mimrec" is used when passed.
+
+         engine: Optional input. Either "mimrec" (default) or "python".
+            - python: each tra file is read once, and the ARM cut of every energy bin is applied in one step.
+            - mimrec: mimrec and ExtractSpectrum.cxx are ran for each energy bin.
+            - The energy range of the python engine is set by energy_range in inputs.yaml (mimrec uses its own binning),
+              and mimrec's event selections are not applied, so the spectra of the two engines can differ.
+
+         workers: Optional input. Number of energy bins to run in parallel with the mimrec engine. Default is workers in inputs.yaml.
 
         """
 
@@ -261,159 +489,98 @@ class Run_MEGAlib:
         print("Running energy_dependent_mimrec...")
         print()
 
-        #make mimrec directory:
-        if os.path.isdir("Mimrec") == False:
-            os.system("mkdir Mimrec")
-        os.chdir("Mimrec")
+        import pandas as pd
+        from Extract_MEGAlib_module import arm_resolution_function
 
-        #make save directory:
-        if os.path.isdir(save_dir) == True:
-            shutil.rmtree(save_dir)
-        os.system("mkdir %s" %save_dir)
+        #define angular resolution for energy-dependent extraction region:
+        arm_func = arm_resolution_function(self.context.performance_dir, self.mission)
+
+        if config_file != "none" and engine == "python":
+            print("configuration file passed; running with mimrec engine...")
+            engine = "mimrec"
+
+        #key of this stage:
+        parameters = {"method":"energy_dependent_mimrec", "numbins":numbins, "engine":engine, "geometry":self.geo_file}
+        files = [self.context.input_file(self.bg_tra_file)]
+        files += sorted(glob.glob(os.path.join(self.context.performance_dir,self.mission + "_*angular_resolution.txt")))
+        if engine == "python":
+            parameters.update({"energy_range":self.energy_range, "source_position":self.source_position})
+        if engine == "mimrec":
+            files.append(os.path.join(self.home,"ExtractSpectrum.cxx"))
+        if config_file != "none":
+            files.append(self.context.input_file(config_file))
+        upstream = upstream_key(self.context.revan_dir, self.context.tra_file)
+        digests = file_digests(files)
+        key = stage_key("mimrec", parameters, files, upstream, digests)
+        if self._cached(self.context.save_path(save_dir), key) == True:
+            return
+
+        if engine == "python":
+            save_path = self._energy_dependent_python(save_dir, numbins, arm_func)
+            outputs = self._stage_outputs(save_path, ["extraction_list.txt","extracted_spectrum.dat"])
+            write_manifest(save_path, "mimrec", key, parameters, files, outputs, upstream, digests)
+            return
+
+        #make mimrec and save directory:
+        self.context.make_dir(self.context.mimrec_dir)
+        save_path = self.context.make_dir(self.context.save_path(save_dir))
    
         #define path to configuration file:
         if config_file != "none":
-            config_file = self.home + "/Inputs/" + config_file
+            config_file = self.context.input_file(config_file)
 
-        #copy output tra file from revan to mimrec directory:
-        rev_path = self.home + "/Revan/"
-        tra_file = self.name + ".inc1.id1.tra"
-        shutil.copy2(rev_path+tra_file,tra_file)
+        #link output tra file from revan to mimrec directory (see link_mode in inputs.yaml):
+        tra_file = os.path.join(self.context.mimrec_dir, os.path.basename(self.context.tra_file))
+        self.context.link_file(self.context.tra_file, tra_file, self.link_mode)
         
-        #define outputs:
-        src_output = save_dir + "/source_counts_spectrum.root"
-        bg_output = save_dir + "/background_counts_spectrum.root"
-
-        #define angular resolution files for energy-dependent extraction region:
-        performance_dir = self.home + "/" + self.mission + "_Performance/"
-        tracked_compton = performance_dir + self.mission + "_compton_angular_resolution.txt"
-        untracked_compton = performance_dir + self.mission + "_untracked_compton_angular_resolution.txt"
-        pair = performance_dir + self.mission + "_pair_angular_resolution.txt"
-
-        #extract angular resolution data
-        tc_df = pd.read_csv(tracked_compton,delim_whitespace=True)
-        tc_energy = tc_df["Energy[MeV]"]*1000 #convert to keV
-        tc_res = tc_df["Resolution[deg]"]
-        tc_func = interp1d(tc_energy,tc_res,kind="linear",bounds_error=False,fill_value="extrapolate")
-
-        utc_df = pd.read_csv(untracked_compton,delim_whitespace=True)
-        utc_energy = utc_df["Energy[MeV]"]*1000 #convert to keV
-        utc_res = utc_df["Resolution[deg]"]
-        utc_func = interp1d(utc_energy,utc_res,kind="linear",bounds_error=False,fill_value="extrapolate")
-
-        pair_df = pd.read_csv(pair,delim_whitespace=True)
-        pair_energy = pair_df["Energy[MeV]"]*1000 #convert to keV
-        pair_res = pair_df["Resolution[deg]"]
-        pair_func = interp1d(pair_energy,pair_res,kind="linear",bounds_error=False,fill_value="2.5")
-
-        arm_list = [10] #initial value is used for determining energy-dependent list
+        #get bg file:
+        this_bg_file = self.context.input_file(self.bg_tra_file)
+
+        #each energy bin runs source and background mimrec and ExtractSpectrum.cxx in its own scratch directory:
+        def bin_job(i, this_cut):
+            options = ["-C", "HistogramBins.Spectrum=%s" %str(numbins+1), "-C", "EventSelections.Source.UsePointSource=true", "-C", "EventSelections.Source.ARM.Max=%s" %str(this_cut)]
+            commands = [self._mimrec_command(tra_file, "-s", "source_counts_spectrum.root", options, config_file, "source_mimrec_terminal_output.txt"),
+                self._mimrec_command(this_bg_file, "-s", "background_counts_spectrum.root", options, config_file, "background_mimrec_terminal_output.txt"),
+                make_command(["root", "-q", "-b", os.path.join(self.home,"ExtractSpectrum.cxx")], timeout=self.timeouts.get("root"))]
+            return make_job("energy bin %s" %i, commands, os.path.join(save_path,"energy_bin_%s" %i))
+
+        #first pass with initial cut of 10 deg is used for determining the energy-dependent list:
+        print("Working on energy bin 0...")
+        run_job(bin_job(0, 10), self.progress_callback)
+        df = pd.read_csv(os.path.join(save_path,"energy_bin_0","extracted_spectrum.dat"), delim_whitespace=True)
+        energy_bin = df["EC[keV]"]
+        shutil.rmtree(os.path.join(save_path,"energy_bin_0"))
+
+        #make energy-dependent arm_list:
+        arm_list = [float(each) for each in arm_func(energy_bin)]
+
+        #print and write the energy-dependent arm list:
+        print("Energy-dependent arm list:")
+        print(arm_list)
+        f = open(os.path.join(save_path,"extraction_list.txt"),"w")
+        f.write(str(arm_list))
+        f.close()
+
+        #run all energy bins in parallel:
+        jobs = [bin_job(i, arm_list[i-1]) for i in range(1,numbins+1)]
+        run_jobs(jobs, self._workers(workers), self.progress_callback)
+
+        #get counts for each energy bin:
         src_list = []
         bg_list = []
-        
-        #get bg file:
-        this_bg_file = self.home + "/Inputs/" + self.bg_tra_file
-
-        for i in range(0,numbins+1):
-            
-            print("Working on energy bin %s..." %i)
-
-            this_cut = arm_list[i]
-            
-            if config_file == "none":
-            
-                #source spectrum:
-                os.system("mimrec -g %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s" %(self.geo_file, tra_file, src_output, str(numbins+1), str(this_cut)))
-            
-                #background spectrum:
-                os.system("mimrec -g %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s" %(self.geo_file, this_bg_file, bg_output, str(numbins+1), str(this_cut)))
-
-            if config_file != "none":
-
-                #source spectrum:
-                os.system("mimrec -g %s -c %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s" %(self.geo_file, config_file, tra_file, src_output, str(numbins+1), str(this_cut)))
-            
-                #background spectrum:
-                os.system("mimrec -g %s -c %s -f %s -s -o %s -n \
-                    -C HistogramBins.Spectrum=%s \
-                    -C EventSelections.Source.UsePointSource=true \
-                    -C EventSelections.Source.ARM.Max=%s" %(self.geo_file, config_file, this_bg_file, bg_output, str(numbins+1), str(this_cut)))
-                
-
-            #change to save directory:
-            os.chdir(save_dir)
-
-            #extract spectrum histogram:
-            os.system("root -q -b %s/ExtractSpectrum.cxx" %self.home)
-            
-            if i == 0:
-                df = pd.read_csv("extracted_spectrum.dat", delim_whitespace=True)
-                energy_bin = df["EC[keV]"]
-
-                #make energy-dependent arm_list:
-                real_arm_list = []
-                for each in energy_bin:
-            
-                    if each <= max(utc_energy):
-                        this_res = utc_func(each)
-                        real_arm_list.append(float(this_res))
-            
-                    if max(utc_energy) < each <= max(tc_energy):
-                        this_res = tc_func(each) 
-                        real_arm_list.append(float(this_res))
-            
-                    if each > max(tc_energy):
-                        this_res = pair_func(each)
-                        real_arm_list.append(float(this_res))
-    
-                #define updated arm list
-                arm_list += real_arm_list
-
-                #print and write the updated arm list:
-                print("Energy-dependent arm list:")
-                print(arm_list[1:])
-                f = open("extraction_list.txt","w")
-                f.write(str(arm_list[1:]))
-                f.close()
-
-                #remove file:
-                os.system("rm extracted_spectrum.dat")
-    
-                #go back to working directory:
-                os.chdir(self.home+"/Mimrec")
-
-            if i > 0:
-            
-                #get counts for current energy bin:
-                df = pd.read_csv("extracted_spectrum.dat", delim_whitespace=True)
-                src_cts = df["src_ct/keV"]
-                bg_cts = df["bg_ct/keV"]
+        for i in range(1,numbins+1):
             
-                this_src = src_cts[i-1]
-                this_bg = bg_cts[i-1]
+            this_dir = os.path.join(save_path,"energy_bin_%s" %i)
+            df = pd.read_csv(os.path.join(this_dir,"extracted_spectrum.dat"), delim_whitespace=True)
+            src_list.append(df["src_ct/keV"][i-1])
+            bg_list.append(df["bg_ct/keV"][i-1])
             
-                src_list.append(this_src)
-                bg_list.append(this_bg)
-            
-                #rename file:
-                os.system("mv extracted_spectrum.dat extracted_spectrum_energy_bin_%s.dat" %i)
-    
-                #go back to working directory:
-                os.chdir(self.home+"/Mimrec")
+            #move file and remove scratch directory:
+            shutil.move(os.path.join(this_dir,"extracted_spectrum.dat"), os.path.join(save_path,"extracted_spectrum_energy_bin_%s.dat" %i))
+            shutil.rmtree(this_dir)
 
-        #change to save directory:
-        os.chdir(save_dir)
-        
         #write_final_file:
-        df = pd.read_csv("extracted_spectrum_energy_bin_1.dat", delim_whitespace=True)
+        df = pd.read_csv(os.path.join(save_path,"extracted_spectrum_energy_bin_1.dat"), delim_whitespace=True)
         EC = df["EC[keV]"]
         EL = df["EL[keV]"]
         EH = df["EH[keV]"]
@@ -421,9 +588,605 @@ class Run_MEGAlib:
         
         d = {"EC[keV]":EC, "EL[keV]":EL, "EH[keV]":EH, "BW[keV]":BW, "src_ct/keV":src_list, "bg_ct/keV":bg_list}
         new_df = pd.DataFrame(data=d)
-        new_df.to_csv("extracted_spectrum.dat", index=False, sep="\t", columns=["EC[keV]", "EL[keV]", "EH[keV]", "BW[keV]", "src_ct/keV", "bg_ct/keV"])
+        new_df.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t", columns=["EC[keV]", "EL[keV]", "EH[keV]", "BW[keV]", "src_ct/keV", "bg_ct/keV"])
 
-        #go home:
-        os.chdir(self.home)
+        outputs = self._stage_outputs(save_path, ["extraction_list.txt","extracted_spectrum.dat"] + ["extracted_spectrum_energy_bin_%s.dat" %i for i in range(1,numbins+1)])
+        write_manifest(save_path, "mimrec", key, parameters, files, outputs, upstream, digests)
 
         return
+
+    def sweep_mimrec(self, numbins, rad, energy_ranges="default", lc_numbins=1000, prefix="sweep"):
+
+        """
+
+         purpose: extract spectra and light curves for a grid of numbins, radii, and energy ranges,
+            e.g. for optimizing the sensitivity.
+            - The source and background events are loaded once, and the ARM of each event is only calculated once.
+            - All radii of a (numbins, energy range) grid point are histogrammed in one pass (see radius_scan).
+
+         input definitions:
+
+         numbins: list of numbers of log energy bins
+
+         rad: list of radii of the extraction region in degrees
+
+         energy_ranges: Optional input. List of (min, max) energy ranges in keV. Default is energy_range in inputs.yaml.
+
+         lc_numbins: Optional input. Number of time bins of the light curves (default is 1000).
+
+         prefix: Optional input. Prefix of the save directories.
+
+         Note: each grid point is saved in Mimrec/<prefix>_<numbins>bins_<rad>deg_<min>-<max>keV, with
+            extracted_spectrum.dat and extracted_lc.dat (same as run_mimrec).
+            The significance of each bin (same as Make_SED) is written to Mimrec/<prefix>_summary.dat, which is also returned.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running sweep_mimrec...")
+        print()
+
+        import pandas as pd
+        from Extract_MEGAlib_module import arm_batch, light_curve, radius_scan_spectra, bin_significance
+
+        numbins = np.atleast_1d(numbins).tolist()
+        rad = np.atleast_1d(rad).astype(float).tolist()
+        if energy_ranges == "default":
+            energy_ranges = [self.energy_range]
+        bg_scale = background_scale(self.time, self.context.input_file(self.bg_tra_file), self.background_exposure, self.cache_dir)
+
+        #load source and background events once, and calculate the ARM once:
+        src_events = load_tra(self.context.tra_file, cache_dir=self.cache_dir)
+        bg_events = load_tra(self.context.input_file(self.bg_tra_file), cache_dir=self.cache_dir)
+        src_arm = np.abs(arm_batch(src_events, [self.source_position]))
+        bg_arm = np.abs(arm_batch(bg_events, [self.source_position]))
+
+        #light curves only depend on the radius:
+        light_curves = {}
+        for this_rad in rad:
+            light_curves[this_rad] = light_curve(src_events["time"][src_arm[0] <= this_rad], lc_numbins)
+
+        self.context.make_dir(self.context.mimrec_dir)
+        summary = []
+        for energy_range in energy_ranges:
+            energy_range = [float(each) for each in energy_range]
+            for this_numbins in numbins:
+
+                spectra = radius_scan_spectra(src_events, bg_events, this_numbins, rad, energy_range, self.source_position, src_arm, bg_arm)
+
+                for this_rad in rad:
+
+                    save_dir = "%s_%sbins_%sdeg_%s-%skeV" %(prefix, this_numbins, "%g" %this_rad, "%g" %energy_range[0], "%g" %energy_range[1])
+                    save_path = self.context.make_dir(self.context.save_path(save_dir))
+
+                    #write spectrum and light curve:
+                    df = spectra[this_rad]
+                    df.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t")
+                    light_curves[this_rad].to_csv(os.path.join(save_path,"extracted_lc.dat"), index=False, sep="\t")
+
+                    #significance of each bin:
+                    src, bg, sigma = bin_significance(df, bg_scale)
+                    for j in range(0,this_numbins):
+                        summary.append([save_dir, this_numbins, this_rad, energy_range[0], energy_range[1], j, df["EC[keV]"][j], src[j], bg[j], sigma[j]])
+
+        columns = ["save_dir", "numbins", "rad[deg]", "Emin[keV]", "Emax[keV]", "bin", "EC[keV]", "src_counts", "bg_counts", "sigma"]
+        summary = pd.DataFrame(data=summary, columns=columns)
+        summary_file = os.path.join(self.context.mimrec_dir, "%s_summary.dat" %prefix)
+        summary.to_csv(summary_file, index=False, sep="\t")
+        print("wrote %s grid points; summary in %s" %(len(summary["save_dir"].unique()), summary_file))
+
+        return summary
+
+    def extract_background(self, t0, t1, output="default"):
+
+        """
+
+         Extract the background events of a time window, e.g. to match the duration of a transient.
+
+         input definitions:
+
+         t0, t1: time window [t0, t1) in seconds
+
+         output: Optional input. Name of the new background tra file (written to the Inputs directory).
+            - Default is <background_tra_file>_<t0>-<t1>s.tra
+
+         Note: the background tra file is indexed by time once (see Event_Index_module),
+            so later windows only read the bytes of the selected events.
+            Set background_tra_file in inputs.yaml to the new file to use it; its exposure is t1-t0
+            (within the time range of the background) and is found automatically with background_exposure: "auto".
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running extract_background...")
+        print()
+
+        this_bg_file = self.context.input_file(self.bg_tra_file)
+        if output == "default":
+            output = "%s_%s-%ss.tra" %(os.path.splitext(os.path.basename(self.bg_tra_file))[0], "%g" %t0, "%g" %t1)
+
+        extract_time_window(this_bg_file, t0, t1, self.context.input_file(output), self.cache_dir)
+        print("wrote %s with exposure %s s" %(self.context.input_file(output), exposure(self.context.input_file(output), index_dir=self.cache_dir)))
+
+        return output
+
+    def merge_events(self, background_files="default", output="default", time_offsets=None, time_scales=None):
+
+        """
+
+         Merge the source events with one or more background files into one time-ordered tra file
+         (replaces concatenation files with IN lines, e.g. for injecting the source into many background realizations).
+
+         input definitions:
+
+         background_files: Optional input. List of background tra files (in the Inputs directory, or full paths).
+            - Default is [background_tra_file].
+
+         output: Optional input. Name of the merged file (written to the Revan directory).
+            - Default is <name>_w_Background.tra. A name ending with .npy gives a binary event cache instead.
+
+         time_offsets: Optional input. List with the time [s] added to the source and each background file; default is 0.
+
+         time_scales: Optional input. List with the factor multiplying the times of the source and each background file; default is 1.
+
+         Note: see Event_Index_module.merge_event_files.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running merge_events...")
+        print()
+
+        if background_files == "default":
+            background_files = [self.bg_tra_file]
+        if output == "default":
+            output = "%s_w_Background.tra" %self.name
+
+        event_files = [self.context.tra_file] + [self.context.input_file(each) for each in background_files]
+        output = os.path.join(self.context.revan_dir, output)
+        merge_event_files(event_files, output, time_offsets, time_scales, self.cache_dir)
+
+        return output
+
+    def reweight_mimrec(self, save_dir, models, numbins, rad, lc_numbins=1000, sim_file="default"):
+
+        """
+
+         purpose: extract spectra and light curves for new source models by reweighting the existing simulation,
+            instead of running cosima and revan again for each model.
+
+         input definitions:
+
+         save_dir: name of directory to save the output (this will be a subdirectory in Mimrec directory)
+
+         models: list of model spectrum files (in the Inputs directory, or full paths), or dictionary of name: file.
+            - Cosima spectrum files (like spectrum_file) or SED files (like the starting model of Make_Cosima_input); see Reweight_module.read_spectrum.
+
+         numbins: number of log energy bins
+
+         rad: radius of extraction region in degrees
+
+         lc_numbins: Optional input. Number of time bins of the light curves (default is 1000).
+
+         sim_file: Optional input. .sim file with the true energies of the events; default is the cosima output.
+
+         Note: each model is saved in Mimrec/<save_dir>/<name>, with extracted_spectrum.dat and extracted_lc.dat
+            (same as run_mimrec), and the model spectrum as model_spectrum.dat, which Effective_Area and Make_SED
+            use instead of spectrum_file. All models can then be processed with Batch_Process_module, e.g. wdirs="Mimrec/<save_dir>/*".
+            The events are weighted by new_model/spectrum_file at their true energy; the background is the same for all models.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running reweight_mimrec...")
+        print()
+
+        from Extract_MEGAlib_module import arm_batch, energy_spectrum, light_curve
+        from Reweight_module import MODEL_FILE, read_spectrum, write_spectrum, true_energy, model_weights, weighted_histograms
+
+        if isinstance(models, dict) == False:
+            models = {os.path.splitext(os.path.basename(each))[0]:each for each in models}
+        model_files = {name:self.context.input_file(each) for name,each in models.items()}
+        if sim_file == "default":
+            sim_file = self.context.sim_file
+        generating_file = self.context.input_file(self.spectrum_file)
+
+        #key of this stage:
+        parameters = {"method":"reweight_mimrec", "models":sorted(model_files), "numbins":numbins, "rad":rad, "lc_numbins":lc_numbins,
+            "energy_range":self.energy_range, "source_position":self.source_position}
+        files = [self.context.input_file(self.bg_tra_file), generating_file, sim_file] + [model_files[name] for name in sorted(model_files)]
+        upstream = upstream_key(self.context.revan_dir, self.context.tra_file)
+        digests = file_digests(files)
+        key = stage_key("mimrec", parameters, files, upstream, digests)
+        top_path = self.context.save_path(save_dir)
+        if self._cached(top_path, key) == True:
+            return [os.path.join(top_path,name) for name in model_files]
+
+        #load source and background events; select events inside the extraction region:
+        src_events = load_tra(self.context.tra_file, cache_dir=self.cache_dir)
+        bg_events = load_tra(self.context.input_file(self.bg_tra_file), cache_dir=self.cache_dir)
+        src_selected = src_events[np.abs(arm_batch(src_events, [self.source_position])[0]) <= rad]
+        bg_selected = bg_events[np.abs(arm_batch(bg_events, [self.source_position])[0]) <= rad]
+
+        #weights of the selected source events for all models:
+        energy = true_energy(sim_file, src_selected["id"], self.cache_dir)
+        missing = int(np.sum(np.isnan(energy)))
+        if missing > 0:
+            print("Warning: %s of %s selected events are not in %s and get weight 0" %(missing, len(energy), sim_file))
+        names = list(model_files)
+        weights = model_weights(energy, read_spectrum(generating_file), [read_spectrum(model_files[name]) for name in names])
+
+        #histograms of all models at once; the binning is the same as run_mimrec:
+        spectrum = energy_spectrum(src_selected["energy"], bg_selected["energy"], numbins, self.energy_range)
+        spectra = weighted_histograms(src_selected["energy"], weights, np.append(spectrum["EL[keV]"],spectrum["EH[keV]"].iloc[-1]))
+        lc = light_curve(src_selected["time"], lc_numbins)
+        light_curves = weighted_histograms(src_selected["time"], weights, np.append(lc["t_low[s]"],lc["t_high[s]"].iloc[-1]))
+
+        save_paths = []
+        for i,name in enumerate(names):
+            save_path = self.context.make_dir(os.path.join(top_path,name))
+            spectrum["src_ct/keV"] = spectra[i]/spectrum["BW[keV]"]
+            spectrum.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t")
+            lc["ct/s"] = light_curves[i]/lc["t_width[s]"]
+            lc.to_csv(os.path.join(save_path,"extracted_lc.dat"), index=False, sep="\t")
+            write_spectrum(*read_spectrum(model_files[name]), os.path.join(save_path,MODEL_FILE), comment="reweighted model: %s" %model_files[name])
+            save_paths.append(save_path)
+
+            #effective number of simulated events behind the weighted counts:
+            n_eff = np.sum(weights[i])**2/np.sum(weights[i]**2) if np.sum(weights[i]**2) > 0 else 0.0
+            print("%s: %s weighted source counts (effective number of simulated events: %s)" %(name, np.sum(spectra[i]), "%.1f" %n_eff))
+
+        outputs = [os.path.join(each,this_file) for each in save_paths for this_file in ["extracted_spectrum.dat","extracted_lc.dat",MODEL_FILE]]
+        write_manifest(top_path, "mimrec", key, parameters, files, outputs, upstream, digests)
+
+        return save_paths
+
+    def forward_fold(self, save_dir, models, numbins, rad="default", containment=1.0, lc_numbins=100, write_runs=True):
+
+        """
+
+         purpose: quick-look expected spectra and light curves of many candidate source models, from the performance
+            tables of the mission (effective area, angular resolution) instead of the MEGAlib chain.
+
+         input definitions:
+
+         save_dir: name of directory to save the output (this will be a subdirectory in Mimrec directory)
+
+         models: list of model spectrum files (in the Inputs directory, or full paths), or dictionary of name: file.
+            - Cosima spectrum files (like spectrum_file) or SED files (like the starting model of Make_Cosima_input); see Reweight_module.read_spectrum.
+
+         numbins: number of log energy bins
+
+         rad: Optional input. Radius of the extraction region in degrees.
+            - Default is the energy-dependent angular resolution of the mission (same as energy_dependent_mimrec).
+
+         containment: Optional input. Fraction of the source events inside the extraction region.
+
+         lc_numbins: Optional input. Number of time bins of the light curves (default is 100), over the observation time.
+
+         write_runs: Optional input. If True, each model is saved in Mimrec/<save_dir>/<name>, with extracted_spectrum.dat,
+            extracted_lc.dat (same as run_mimrec) and model_spectrum.dat, so that it can be processed like a MEGAlib run.
+
+         Note: the source counts are folded through the effective area tables (see Forward_Fold_module), with the light curve
+            shape of lightcurve_file. The background is extracted from background_tra_file with the same extraction region.
+            The summary of all models (counts, significance of the energy and light curve bins, same as Make_SED and Make_LC)
+            is written to Mimrec/<save_dir>/forward_fold_summary.dat, which is also returned.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running forward_fold...")
+        print()
+
+        import pandas as pd
+        from Extract_MEGAlib_module import arm_batch, arm_resolution_function, energy_dependent_spectrum, energy_spectrum, bin_significance
+        from Forward_Fold_module import effective_area_function, fold, read_light_curve, light_curve_fraction
+        from Reweight_module import MODEL_FILE, read_spectrum, write_spectrum
+        from Significance_module import significance
+
+        if isinstance(models, dict) == False:
+            models = {os.path.splitext(os.path.basename(each))[0]:each for each in models}
+        model_files = {name:self.context.input_file(each) for name,each in models.items()}
+        names = list(model_files)
+        spectra = [read_spectrum(model_files[name]) for name in names]
+
+        #background in the extraction region (same as run_mimrec and energy_dependent_mimrec):
+        bg_events = load_tra(self.context.input_file(self.bg_tra_file), cache_dir=self.cache_dir)
+        if rad == "default":
+            spectrum = energy_dependent_spectrum(bg_events[:0], bg_events, numbins, arm_resolution_function(self.context.performance_dir, self.mission), self.energy_range, self.source_position)[0]
+        else:
+            bg_selected = bg_events[np.abs(arm_batch(bg_events, [self.source_position])[0]) <= rad]
+            spectrum = energy_spectrum([], bg_selected["energy"], numbins, self.energy_range)
+        bg_scale = background_scale(self.time, self.context.input_file(self.bg_tra_file), self.background_exposure, self.cache_dir)
+        bg_counts = np.array(spectrum["bg_ct/keV"]*spectrum["BW[keV]"])*bg_scale
+
+        #expected source counts of all models:
+        src_counts = fold(spectra, spectrum["EL[keV]"], spectrum["EH[keV]"], effective_area_function(self.context.performance_dir, self.mission), self.time, containment)
+
+        #light curves: the source counts follow the light curve shape, and the background is constant:
+        lc_edges = np.linspace(0.0, self.time, lc_numbins+1)
+        lc_file = self.context.input_file(self.lc_file)
+        if os.path.isfile(lc_file) == True:
+            lc_fraction = light_curve_fraction(*read_light_curve(lc_file), lc_edges)
+        else:
+            lc_fraction = np.full(lc_numbins, 1.0/lc_numbins)
+        lc_counts = np.sum(src_counts,axis=1)[:,None]*lc_fraction[None,:]
+        lc_sigma = significance(lc_counts, np.sum(bg_counts)/lc_numbins)
+
+        top_path = self.context.make_dir(self.context.save_path(save_dir))
+        summary = []
+        for i,name in enumerate(names):
+            spectrum["src_ct/keV"] = src_counts[i]/spectrum["BW[keV]"]
+            sigma = bin_significance(spectrum, bg_scale)[2]
+            summary.append([name, np.sum(src_counts[i]), np.sum(bg_counts), np.max(sigma), int(np.sum(sigma >= 3)), np.max(lc_sigma[i]), int(np.sum(lc_sigma[i] >= 3))])
+
+            if write_runs == True:
+                save_path = self.context.make_dir(os.path.join(top_path,name))
+                spectrum.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t")
+                d = {"t_center[s]":(lc_edges[1:]+lc_edges[:-1])/2.0, "t_low[s]":lc_edges[:-1], "t_high[s]":lc_edges[1:], "t_width[s]":np.diff(lc_edges), "ct/s":lc_counts[i]/np.diff(lc_edges)}
+                pd.DataFrame(data=d).to_csv(os.path.join(save_path,"extracted_lc.dat"), index=False, sep="\t")
+                write_spectrum(*spectra[i], os.path.join(save_path,MODEL_FILE), comment="forward-folded model: %s" %model_files[name])
+
+        columns = ["name", "src_counts", "bg_counts", "max_sigma", "bins_3sigma", "LC_max_sigma", "LC_bins_3sigma"]
+        summary = pd.DataFrame(data=summary, columns=columns)
+        summary_file = os.path.join(top_path, "forward_fold_summary.dat")
+        summary.to_csv(summary_file, index=False, sep="\t")
+        print(summary)
+        print()
+        print("folded %s models; summary in %s" %(len(names), summary_file))
+
+        return summary
+
+    def response_campaign(self, save_dir, energies, angles=[0.0], n_triggers=20000, shards=1, seed="none", config_file="none", acceptance=15.0, workers=None):
+
+        """
+
+         purpose: instrument response of the mission (energy resolution, angular resolution, effective area) from monoenergetic
+            far-field point sources over a grid of energies and incidence angles, as done by hand in the Simulation_Challenge.
+
+         input definitions:
+
+         save_dir: name of directory of the campaign (this will be a subdirectory in the Response directory)
+
+         energies: list of energies of the sources in keV
+
+         angles: Optional input. List of incidence angles (theta) in degrees. Default is on-axis only.
+
+         n_triggers: Optional input. Number of triggered events of each grid point (split over the shards).
+
+         shards: Optional input. Number of cosima + revan runs of each grid point, each with its own seed.
+
+         seed: Optional input. Seed from which the seeds of all runs are derived, for reproducing results.
+
+         config_file: Optional input. Revan configuration file in the Inputs directory (e.g. revan_AMEGO_X.cfg).
+
+         acceptance: Optional input. Acceptance radius of the ARM histograms in degrees (15 deg in the Simulation_Challenge).
+
+         workers: Optional input. Number of runs at the same time. Default is workers in inputs.yaml.
+
+         Note: all runs (grid points x shards) are independent jobs, each running cosima and then revan in
+            Response/<save_dir>/<point>/shard<k>. The events are analyzed in python (see Response_Campaign_module),
+            and the performance files of each incidence angle are written to Response/<save_dir>/<mission>_Performance_theta<angle>,
+            in the same format as <mission>_Performance. The results of all grid points are written to
+            Response/<save_dir>/response_summary.dat, which is also returned. The simulations are reused if their inputs did not change.
+
+        """
+
+        #make print statement:
+        print()
+        print("********** Run_MEGAlib_Module ************")
+        print("Running response_campaign...")
+        print()
+
+        import pandas as pd
+        from Response_Campaign_module import campaign_points, write_point_source, generated_events, analyze_points, write_performance_tables
+
+        if self.area is None:
+            raise ValueError("area (area of the surrounding sphere) is needed in inputs.yaml for the effective area")
+
+        points = campaign_points(energies, angles)
+        campaign_dir = self.context.resolve(os.path.join("Response",save_dir))
+        run_dirs = [[os.path.join(campaign_dir,point["name"],"shard%s" %k) for k in range(0,shards)] for point in points]
+        run_names = [["%s_shard%s" %(point["name"],k) for k in range(0,shards)] for point in points]
+
+        #key of the simulations:
+        parameters = {"method":"response_campaign", "points":points, "n_triggers":n_triggers, "shards":shards, "seed":seed, "geometry":self.geo_file}
+        if seed == "none":
+            parameters["seed"] = "none-" + os.urandom(8).hex()
+        files = []
+        if config_file != "none":
+            files = [self.context.input_file(config_file)]
+        digests = file_digests(files)
+        key = stage_key("response", parameters, files, digests=digests)
+
+        if self._cached(campaign_dir, key) == False:
+
+            #one job per grid point and shard: cosima, then revan on its .sim file:
+            options = []
+            if config_file != "none":
+                options = ["-c", self.context.input_file(config_file)]
+            seeds = shard_seeds(seed, len(points)*shards)
+            jobs = []
+            for i,point in enumerate(points):
+                for k in range(0,shards):
+                    run_dir = self.context.make_dir(run_dirs[i][k], clean=True)
+                    source_file = write_point_source(os.path.join(run_dir,run_names[i][k] + ".source"), run_names[i][k],
+                        point["energy"], point["theta"], point["phi"], int(np.ceil(n_triggers/float(shards))), self.geo_file)
+                    commands = [make_command(["cosima", "-s", seeds[i*shards+k], os.path.basename(source_file)], "terminal_output_cosima.txt", self.timeouts.get("cosima")),
+                        make_command(["revan", "-g", self.geo_file] + options + ["-f", run_names[i][k] + ".inc1.id1.sim", "-n", "-a"], "revan_terminal_output.txt", self.timeouts.get("revan"))]
+                    jobs.append(make_job(run_names[i][k], commands, run_dir))
+            run_jobs(jobs, self._workers(workers), self.progress_callback)
+
+            outputs = [os.path.join(run_dirs[i][k], run_names[i][k] + each) for i in range(0,len(points)) for k in range(0,shards) for each in [".inc1.id1.sim",".inc1.id1.tra"]]
+            write_manifest(campaign_dir, "response", key, parameters, files, outputs, digests=digests)
+
+        #events and number of generated events of each grid point (all shards):
+        events = []
+        generated = []
+        for i,point in enumerate(points):
+            events.append(np.concatenate([load_tra(os.path.join(run_dirs[i][k], run_names[i][k] + ".inc1.id1.tra"), cache_dir=self.cache_dir) for k in range(0,shards)]))
+            generated.append(sum([generated_events(os.path.join(run_dirs[i][k], run_names[i][k] + ".inc1.id1.sim")) for k in range(0,shards)]))
+
+        results = analyze_points(points, events, generated, float(self.area), acceptance)
+
+        #performance files of each incidence angle:
+        for theta in angles:
+            this_angle = results["theta"] == float(theta)
+            out_dir = os.path.join(campaign_dir, "%s_Performance_theta%s" %(self.mission, ("%g" %theta).replace(".","p")))
+            write_performance_tables(dict([(name,values[this_angle]) for name,values in results.items()]), out_dir, self.mission)
+            print("wrote performance files of theta = %s deg to %s" %(theta, out_dir))
+
+        summary = pd.DataFrame(data=results)
+        summary.insert(0, "name", [each["name"] for each in points])
+        summary_file = os.path.join(campaign_dir, "response_summary.dat")
+        summary.to_csv(summary_file, index=False, sep="\t")
+        print(summary)
+        print()
+        print("response of %s grid points; summary in %s" %(len(points), summary_file))
+
+        return summary
+
+    #stages for code running in an event loop: each stage runs in a worker thread (asyncio.to_thread),
+    #since the stages wait for their jobs with asyncio.run (see Executor_module); the paths of a stage are explicit,
+    #so stages with different save_dir can run at the same time.
+
+    async def run_cosima_async(self, *args, **kwargs):
+
+        """run_cosima for code running in an event loop."""
+
+        return await asyncio.to_thread(self.run_cosima, *args, **kwargs)
+
+    async def run_revan_async(self, *args, **kwargs):
+
+        """run_revan for code running in an event loop."""
+
+        return await asyncio.to_thread(self.run_revan, *args, **kwargs)
+
+    async def run_mimrec_async(self, *args, **kwargs):
+
+        """run_mimrec for code running in an event loop."""
+
+        return await asyncio.to_thread(self.run_mimrec, *args, **kwargs)
+
+    async def energy_dependent_mimrec_async(self, *args, **kwargs):
+
+        """energy_dependent_mimrec for code running in an event loop."""
+
+        return await asyncio.to_thread(self.energy_dependent_mimrec, *args, **kwargs)
+
+    async def response_campaign_async(self, *args, **kwargs):
+
+        """response_campaign for code running in an event loop."""
+
+        return await asyncio.to_thread(self.response_campaign, *args, **kwargs)
+
+    def _energy_dependent_python(self, save_dir, numbins, arm_func):
+
+        """Python engine for energy_dependent_mimrec: reads each tra file once."""
+
+        from Extract_MEGAlib_module import energy_dependent_spectrum
+
+        #make save directory:
+        save_path = self.context.make_dir(self.context.save_path(save_dir))
+
+        #load source and background events:
+        this_bg_file = self.context.input_file(self.bg_tra_file)
+        src_events = load_tra(self.context.tra_file, cache_dir=self.cache_dir)
+        bg_events = load_tra(this_bg_file, cache_dir=self.cache_dir)
+
+        #apply energy-dependent ARM cut:
+        df, arm_list = energy_dependent_spectrum(src_events, bg_events, numbins, arm_func, self.energy_range, self.source_position)
+
+        #print and write the energy-dependent arm list:
+        print("Energy-dependent arm list:")
+        print(arm_list)
+        f = open(os.path.join(save_path,"extraction_list.txt"),"w")
+        f.write(str(arm_list))
+        f.close()
+
+        #write final file:
+        df.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t")
+
+        return save_path
+
+    def _run_mimrec_python(self, save_dir, numbins, rad, lc_numbins):
+
+        """Python engine for run_mimrec: ARM cut and histograms of the source and background events."""
+
+        from Extract_MEGAlib_module import arm_batch, energy_spectrum, light_curve
+
+        #make save directory:
+        save_path = self.context.make_dir(self.context.save_path(save_dir))
+
+        #load source and background events:
+        this_bg_file = self.context.input_file(self.bg_tra_file)
+        src_events = load_tra(self.context.tra_file, cache_dir=self.cache_dir)
+        bg_events = load_tra(this_bg_file, cache_dir=self.cache_dir)
+
+        #select events inside the extraction region:
+        src_selected = src_events[np.abs(arm_batch(src_events, [self.source_position])[0]) <= rad]
+        bg_selected = bg_events[np.abs(arm_batch(bg_events, [self.source_position])[0]) <= rad]
+
+        #write spectrum and light curve:
+        df = energy_spectrum(src_selected["energy"], bg_selected["energy"], numbins, self.energy_range)
+        df.to_csv(os.path.join(save_path,"extracted_spectrum.dat"), index=False, sep="\t")
+        df = light_curve(src_selected["time"], lc_numbins)
+        df.to_csv(os.path.join(save_path,"extracted_lc.dat"), index=False, sep="\t")
+
+        return save_path
+
+    def _mimrec_command(self, tra_file, mode, output, options, config_file="none", log_file=None):
+
+        """Command for running mimrec in batch mode; mode is -s (spectrum) or -l (light curve)."""
+
+        args = ["mimrec", "-g", self.geo_file]
+        if config_file != "none":
+            args += ["-c", config_file]
+        args += ["-f", tra_file, mode, "-o", output, "-n"] + options
+
+        return make_command(args, log_file, self.timeouts.get("mimrec"))
+
+    def _run_tool(self, args, cwd, log_file=None):
+
+        """Run a MEGAlib tool (args[0]) with its timeout from inputs.yaml; raises MEGAlibError if it fails."""
+
+        return run_command(args, cwd, log_file, self.timeouts.get(args[0]), self.progress_callback)
+
+    def _cached(self, stage_dir, key):
+
+        """True if the stage with this key already ran in stage_dir (and stage_cache is on); otherwise the old manifest is removed."""
+
+        if self.stage_cache == True and is_cached(stage_dir, key) == True:
+            print("inputs unchanged; using existing output in %s (see %s)" %(stage_dir, MANIFEST))
+            return True
+
+        clear_manifest(stage_dir)
+
+        return False
+
+    def _stage_outputs(self, stage_dir, names):
+
+        """List of the output files written by a stage (names in the stage directory); other files in the directory are left out."""
+
+        outputs = [os.path.join(stage_dir,each) for each in names]
+
+        return [each for each in outputs if os.path.isfile(each) == True]
+
+    def _workers(self, workers):
+
+        """Number of parallel jobs: the method input if given, otherwise workers in inputs.yaml."""
+
+        if workers is None:
+            return self.workers
+
+        return workers
@@ -0,0 +1,157 @@
+##########################################################
+#
+# Purpose: Monte-Carlo Poisson realizations of the SED and light curve counts, for calibrating significances.
+#   - The counts of every bin are drawn for all realizations at once (one numpy call per chunk of realizations);
+#     a chunk size keeps the memory bounded for many realizations or many bins.
+#   - Source + background realizations give the distribution of the significance and the detection fraction of each bin,
+#     background-only realizations give the false-alarm rate (per bin, and for any bin of a light curve).
+#   - Upper limits on the source counts of each realization are calculated with astropy's poisson_conf_interval.
+#   - Only the counts written by Run_MEGAlib are needed; no MEGAlib tool is run again.
+#
+# Index of functions:
+#
+#   significance(counts, bg_counts)
+#   poisson_realizations(expected, n_realizations, chunk_size=None, seed=None)
+#   upper_limits(counts, bg_counts, ul_sigma=2.0)
+#   monte_carlo_significance(src_counts, bg_counts, n_realizations=10000, thresholds=[3.0,5.0], ul_sigma=2.0, chunk_size=None, seed=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import numpy as np
+#Note: astropy is imported in upper_limits, so that loading this module stays fast.
+##########################################################
+
+def significance(counts, bg_counts):
+
+    """
+
+     Significance of source counts over a known background, counts/sqrt(counts+bg), as in Make_SED and Make_LC.
+
+     Note: bins without any counts (counts+bg = 0) have significance 0.
+
+    """
+
+    counts = np.asarray(counts,dtype=float)
+    total = counts + np.asarray(bg_counts,dtype=float)
+
+    return np.where(total > 0, counts/np.sqrt(np.where(total > 0, total, 1.0)), 0.0)
+
+def poisson_realizations(expected, n_realizations, chunk_size=None, seed=None):
+
+    """
+
+     Yield Poisson realizations of the expected counts of each bin, as arrays of shape (realizations, bins).
+
+     input definitions:
+
+     expected: expected counts of each bin
+
+     n_realizations: total number of realizations
+
+     chunk_size: Optional input. Maximum number of realizations per array; default is all at once.
+
+     seed: Optional input. Seed (or numpy Generator) for reproducible realizations.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    expected = np.asarray(expected,dtype=float)
+    if chunk_size is None:
+        chunk_size = n_realizations
+
+    for low in range(0,n_realizations,chunk_size):
+        yield rng.poisson(expected, size=(min(chunk_size,n_realizations-low),len(expected)))
+
+def upper_limits(counts, bg_counts, ul_sigma=2.0):
+
+    """
+
+     Upper limits on the source counts, for observed (total) counts over a known background.
+
+     input definitions:
+
+     counts: observed counts (source + background), any shape
+
+     bg_counts: expected background counts (broadcast against counts)
+
+     ul_sigma: Optional input. Width of the confidence interval in Gaussian sigma (poisson_conf_interval, frequentist-confidence).
+
+     Note: the upper limit is the upper end of the interval of the total counts minus the background, and at least 0.
+
+    """
+
+    from astropy.stats import poisson_conf_interval as pci
+
+    upper = pci(np.asarray(counts), interval="frequentist-confidence", sigma=ul_sigma)[1]
+
+    return np.maximum(upper - bg_counts, 0.0)
+
+def monte_carlo_significance(src_counts, bg_counts, n_realizations=10000, thresholds=[3.0,5.0], ul_sigma=2.0, chunk_size=None, seed=None):
+
+    """
+
+     Significance distribution, detection fractions, false-alarm rates, and upper limits of every bin from Poisson realizations.
+
+     input definitions:
+
+     src_counts: expected source counts of each bin
+
+     bg_counts: expected background counts of each bin
+
+     n_realizations: Optional input. Number of realizations.
+
+     thresholds: Optional input. List of significance thresholds for the detection and false-alarm fractions.
+
+     ul_sigma: Optional input. Width of the upper limit interval in Gaussian sigma (see upper_limits).
+
+     chunk_size: Optional input. Maximum number of realizations held in memory at once; default is all at once.
+
+     seed: Optional input. Seed for reproducible realizations.
+
+     Note: returns a dictionary of arrays:
+       - sigma: significance of the expected counts (same as Make_SED/Make_LC), shape (bins,)
+       - sigma_mean, sigma_std: mean and standard deviation of the significance of the realizations, shape (bins,)
+       - detection_fraction: fraction of source + background realizations with significance >= threshold, shape (thresholds, bins)
+       - false_alarm: fraction of background-only realizations with significance >= threshold, shape (thresholds, bins)
+       - global_false_alarm: fraction of background-only realizations with any bin >= threshold, shape (thresholds,)
+       - ul_mean: mean upper limit on the source counts of the background-only realizations (expected upper limit), shape (bins,)
+       In each realization the background is known, so the source counts are estimated as total - background,
+       and the significance is (total - background)/sqrt(total).
+
+    """
+
+    src_counts = np.asarray(src_counts,dtype=float)
+    bg_counts = np.asarray(bg_counts,dtype=float)
+    thresholds = np.asarray(thresholds,dtype=float)
+    n_bins = len(src_counts)
+
+    #seeds of the source + background and the background-only realizations:
+    seeds = np.random.SeedSequence(seed).spawn(2)
+
+    sigma_sum = np.zeros(n_bins)
+    sigma_sum2 = np.zeros(n_bins)
+    detections = np.zeros((len(thresholds),n_bins))
+    false_alarms = np.zeros((len(thresholds),n_bins))
+    global_false_alarms = np.zeros(len(thresholds))
+    ul_sum = np.zeros(n_bins)
+
+    for counts in poisson_realizations(src_counts + bg_counts, n_realizations, chunk_size, seeds[0]):
+        this_sigma = significance(counts - bg_counts, bg_counts)
+        sigma_sum += np.sum(this_sigma,axis=0)
+        sigma_sum2 += np.sum(this_sigma**2,axis=0)
+        detections += np.sum(this_sigma[None,:,:] >= thresholds[:,None,None],axis=1)
+
+    for counts in poisson_realizations(bg_counts, n_realizations, chunk_size, seeds[1]):
+        above = significance(counts - bg_counts, bg_counts)[None,:,:] >= thresholds[:,None,None]
+        false_alarms += np.sum(above,axis=1)
+        global_false_alarms += np.sum(np.any(above,axis=2),axis=1)
+        ul_sum += np.sum(upper_limits(counts, bg_counts, ul_sigma),axis=0)
+
+    sigma_mean = sigma_sum/n_realizations
+
+    return {"sigma":significance(src_counts, bg_counts), "sigma_mean":sigma_mean,
+        "sigma_std":np.sqrt(np.maximum(sigma_sum2/n_realizations - sigma_mean**2, 0.0)),
+        "detection_fraction":detections/n_realizations, "false_alarm":false_alarms/n_realizations,
+        "global_false_alarm":global_false_alarms/n_realizations, "ul_mean":ul_sum/n_realizations}
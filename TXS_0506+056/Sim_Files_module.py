@@ -0,0 +1,427 @@
+##########################################################
+#
+# Purpose: Split Cosima runs into shards and merge the resulting .sim files.
+#   - The observation time (SpaceSim.Time) is split into N sub-runs, each with its own source file and seed.
+#   - Light curves are cut to the time window of each shard, and the flux of each source is scaled to match.
+#   - The shard .sim files are merged into one .sim file with continuous event IDs and times.
+#   - A .sim file can be split at event boundaries into chunks for parallel revan runs,
+#     and the .tra files of the chunks are merged back in event order.
+#
+# Index of functions:
+#
+#   read_light_curve(lc_file)
+#   write_light_curve(lc_file, time, flux, header)
+#   shard_seeds(seed, shards)
+#   write_shard_sources(source_file, shards, out_dir, inputs_dir)
+#   merge_sim_files(sim_files, time_offsets, output, total_time=None)
+#   split_sim_file(sim_file, chunks, out_dirs, name)
+#   merge_tra_files(tra_files, output)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import numpy as np
+##########################################################
+
+def read_light_curve(lc_file):
+
+    """
+
+     Read a Cosima light curve file (DP lines with time [s] and flux).
+
+     Note: returns time, flux, and the other (non-DP) lines of the file, e.g. IP LinLin.
+
+    """
+
+    time = []
+    flux = []
+    header = []
+    with open(lc_file,"r") as f:
+        for line in f:
+            values = line.split()
+            if len(values) >= 3 and values[0] == "DP":
+                time.append(float(values[1]))
+                flux.append(float(values[2]))
+            elif len(values) > 0 and values[0] != "EN":
+                header.append(line.rstrip("\n"))
+
+    return np.array(time), np.array(flux), header
+
+def write_light_curve(lc_file, time, flux, header):
+
+    """Write a Cosima light curve file."""
+
+    f = open(lc_file,"w")
+    for line in header:
+        f.write(line + "\n")
+    f.write("\n")
+    for t,this_flux in zip(time,flux):
+        f.write("DP\t%s\t%s\n" %(repr(float(t)),repr(float(this_flux))))
+    f.write("EN\n")
+    f.close()
+
+    return
+
+def _cut_light_curve(time, flux, t_low, t_high):
+
+    """Light curve between t_low and t_high (linear interpolation at the edges), shifted to start at 0, and its mean flux."""
+
+    inside = (time > t_low) & (time < t_high)
+    new_time = np.concatenate(([t_low], time[inside], [t_high]))
+    new_flux = np.interp(new_time, time, flux)
+    mean = np.sum((new_flux[1:]+new_flux[:-1])/2.0*np.diff(new_time))/(t_high-t_low)
+
+    return new_time - t_low, new_flux, mean
+
+def shard_seeds(seed, shards):
+
+    """
+
+     Derive independent Cosima seeds for each shard from one seed.
+
+     input definitions:
+
+     seed: seed of the run; if "none" a random seed is drawn (and printed for reproducibility)
+
+     shards: number of shards
+
+    """
+
+    if seed == "none":
+        seed = int(np.random.SeedSequence().generate_state(1)[0] % (2**31-1))
+        print("random seed used for deriving shard seeds: %s" %seed)
+
+    children = np.random.SeedSequence(int(seed)).spawn(shards)
+
+    return [int(each.generate_state(1)[0] % (2**31-1)) + 1 for each in children]
+
+def write_shard_sources(source_file, shards, out_dir, inputs_dir):
+
+    """
+
+     Write one Cosima source file per shard, each covering 1/shards of the observation time.
+
+     input definitions:
+
+     source_file: full path of the Cosima source file of the run
+
+     shards: number of shards
+
+     out_dir: directory for the shard source files (and light curves)
+
+     inputs_dir: directory containing the light curve files of the source file
+
+     Note: returns a list of dictionaries with keys source_file, file_name, time_offset, time, and active.
+       - Each shard has <run>.FileName <name>_shard<k> and <run>.Time T/shards.
+       - A light curve (LightCurve File) is cut to the time window of the shard and shifted to start at 0.
+         The light curve only sets the shape in Cosima, so the flux of the source is scaled by the ratio of
+         the mean light curve in the shard to the mean over the full observation.
+       - Shards where all sources have zero flux are not active (there is nothing to simulate).
+
+    """
+
+    with open(source_file,"r") as f:
+        lines = f.read().splitlines()
+
+    #find observation time, file name, and light curves:
+    total_time = None
+    name = None
+    light_curves = {}
+    for line in lines:
+        values = line.split()
+        if len(values) < 2:
+            continue
+        if values[0].endswith(".Time"):
+            total_time = float(values[1])
+        if values[0].endswith(".FileName"):
+            name = values[1]
+        if values[0].endswith(".LightCurve") and values[1] == "File":
+            light_curves[values[0].split(".")[0]] = values[-1]
+
+    if total_time is None or name is None:
+        raise ValueError("%s needs <run>.FileName and <run>.Time for sharding" %source_file)
+
+    lc_data = {}
+    for source,lc_file in light_curves.items():
+        time, flux, header = read_light_curve(os.path.join(inputs_dir,lc_file))
+        lc_data[source] = (time, flux, header, _cut_light_curve(time, flux, 0, total_time)[2])
+
+    shard_time = total_time/shards
+    shard_list = []
+    for k in range(0,shards):
+
+        t_low = k*shard_time
+        t_high = (k+1)*shard_time
+        this_name = "%s_shard%s" %(name,k)
+
+        #light curves and flux scaling of this shard:
+        scaling = {}
+        for source,(time, flux, header, total_mean) in lc_data.items():
+            new_time, new_flux, mean = _cut_light_curve(time, flux, t_low, t_high)
+            scaling[source] = float(mean/total_mean) if total_mean > 0 else 0.0
+            lc_name = os.path.splitext(light_curves[source])[0] + "_shard%s.dat" %k
+            write_light_curve(os.path.join(out_dir,lc_name), new_time, new_flux, header)
+
+        new_lines = []
+        active = False
+        for line in lines:
+            values = line.split()
+            if len(values) >= 2 and values[0].endswith(".FileName"):
+                line = "%s %s" %(values[0],this_name)
+            elif len(values) >= 2 and values[0].endswith(".Time"):
+                line = "%s %s" %(values[0],repr(shard_time))
+            elif len(values) >= 2 and values[0].endswith(".LightCurve") and values[1] == "File":
+                lc_name = os.path.splitext(values[-1])[0] + "_shard%s.dat" %k
+                line = " ".join(values[:-1] + [lc_name])
+            elif len(values) >= 2 and values[0].endswith(".Flux"):
+                this_flux = float(values[1])*scaling.get(values[0].split(".")[0],1.0)
+                active = active or bool(this_flux > 0)
+                line = "%s %s" %(values[0],repr(this_flux))
+            new_lines.append(line)
+
+        this_source = os.path.join(out_dir,this_name + ".source")
+        f = open(this_source,"w")
+        f.write("\n".join(new_lines) + "\n")
+        f.close()
+
+        shard_list.append({"source_file":this_source, "file_name":this_name, "time_offset":t_low, "time":shard_time, "active":active})
+
+    return shard_list
+
+def merge_sim_files(sim_files, time_offsets, output, total_time=None):
+
+    """
+
+     Merge .sim files into one .sim file, without holding them in memory.
+
+     input definitions:
+
+     sim_files: list of .sim files (in time order)
+
+     time_offsets: time [s] added to the event times (TI) of each file
+
+     output: name of merged .sim file
+
+     total_time: Optional input. Observation time [s] written in the footer (TE).
+       - Default is the end time of the last file (its time offset plus its TE).
+
+     Note: the header is taken from the first file; event IDs are renumbered to stay unique and increasing,
+       and the started-event counters (second value of ID) are offset by the started events of the previous files.
+       The footer has the total observation time (TE) and the total number of started events (TS, summed over the files).
+
+    """
+
+    id_offset = 0
+    total_started = 0
+    end_time = 0.0
+
+    with open(output,"wb") as out:
+        for i,(sim_file,offset) in enumerate(zip(sim_files,time_offsets)):
+
+            in_events = False
+            in_footer = False
+            last_id = 0
+            last_started = 0
+            started = None
+            with open(sim_file,"rb") as f:
+                for line in f:
+
+                    if in_footer == True:
+                        values = line.split()
+                        if len(values) >= 2 and values[0] == b"TS":
+                            started = int(float(values[1]))
+                        if len(values) >= 2 and values[0] == b"TE":
+                            end_time = max(end_time, offset + float(values[1]))
+                        continue
+
+                    if line[:2] == b"SE":
+                        in_events = True
+                    elif line[:2] == b"EN" and line[2:].strip() == b"":
+                        in_footer = True
+                        continue
+
+                    #header only from the first file:
+                    if in_events == False:
+                        if i == 0:
+                            out.write(line)
+                        continue
+
+                    if line[:3] == b"ID ":
+                        values = line.split()
+                        last_id = int(values[1])
+                        values[1] = str(last_id + id_offset).encode()
+                        if len(values) >= 3:
+                            last_started = int(values[2])
+                            values[2] = str(last_started + total_started).encode()
+                        line = b" ".join(values) + b"\n"
+                    elif line[:3] == b"TI " and offset != 0:
+                        line = ("TI %.9f\n" %(float(line.split()[1]) + offset)).encode()
+
+                    out.write(line)
+
+            #without a TS footer, the started events are taken from the last event:
+            id_offset += last_id
+            total_started += started if started is not None else last_started
+
+        if total_time is None:
+            total_time = end_time
+
+        out.write(b"EN\n\n")
+        out.write(("TE %s\n" %repr(total_time)).encode())
+        out.write(("TS %s\n" %total_started).encode())
+
+    return
+
+def _event_files(event_file):
+
+    """Header lines of an event file (without IN lines), and the list of files with its events (IN includes or the file itself)."""
+
+    header = []
+    includes = []
+    parent_dir = os.path.dirname(os.path.abspath(event_file))
+    with open(event_file,"rb") as f:
+        for line in f:
+            if line[:2] == b"SE" or (line[:2] == b"EN" and line[2:].strip() == b""):
+                break
+            if line[:3] == b"IN ":
+                include = line[3:].strip().decode()
+                if os.path.isabs(include) == False:
+                    include = os.path.join(parent_dir,include)
+                includes.append(include)
+                continue
+            header.append(line)
+
+    if len(includes) == 0:
+        includes = [event_file]
+
+    return header, includes
+
+def split_sim_file(sim_file, chunks, out_dirs, name):
+
+    """
+
+     Split a .sim file at event boundaries (SE) into chunks of about equal size, without holding it in memory.
+
+     input definitions:
+
+     sim_file: full path of .sim file (IN includes of concatenation files are followed)
+
+     chunks: number of chunks
+
+     out_dirs: list of directories for the chunks (one per chunk)
+
+     name: name of the chunks; chunk k is <out_dirs[k]>/<name>.chunk<k>.sim
+
+     Note: returns the list of chunk files that were written (fewer than chunks if there are fewer events).
+       - Every chunk has the header of the .sim file and ends with EN.
+       - The footer of the .sim file (TE, TS) is only written to the last chunk,
+         with TS summed over the IN includes.
+       - Event IDs and times are not changed, so the chunks stay in event order.
+
+    """
+
+    header, event_files = _event_files(sim_file)
+    target = sum([os.path.getsize(each) for each in event_files])/float(chunks)
+
+    chunk_files = []
+    out = None
+    written = 0
+    footer = []
+    total_started = None
+
+    def new_chunk():
+        k = len(chunk_files)
+        chunk_files.append(os.path.join(out_dirs[k], "%s.chunk%s.sim" %(name,k)))
+        this_out = open(chunk_files[-1],"wb")
+        this_out.writelines(header)
+        return this_out
+
+    for event_file in event_files:
+
+        in_events = False
+        in_footer = False
+        footer = []
+        with open(event_file,"rb") as f:
+            for line in f:
+
+                if in_footer == True:
+                    values = line.split()
+                    if len(values) >= 2 and values[0] == b"TS":
+                        total_started = (total_started or 0) + int(float(values[1]))
+                    footer.append(line)
+                    continue
+
+                if line[:2] == b"SE":
+                    in_events = True
+                    #start next chunk at an event boundary:
+                    if out is None:
+                        out = new_chunk()
+                    elif written >= len(chunk_files)*target and len(chunk_files) < chunks:
+                        out.write(b"EN\n")
+                        out.close()
+                        out = new_chunk()
+                elif line[:2] == b"EN" and line[2:].strip() == b"":
+                    in_footer = True
+                    continue
+
+                if in_events == True:
+                    out.write(line)
+                    written += len(line)
+
+    if out is not None:
+        out.write(b"EN\n")
+        for line in footer:
+            if line[:3] == b"TS " and total_started is not None:
+                line = ("TS %s\n" %total_started).encode()
+                total_started = None
+            out.write(line)
+        if total_started is not None:
+            out.write(("TS %s\n" %total_started).encode())
+        out.close()
+
+    return chunk_files
+
+def merge_tra_files(tra_files, output):
+
+    """
+
+     Merge the .tra files of the chunks of a .sim file (see split_sim_file) into one .tra file.
+
+     input definitions:
+
+     tra_files: list of .tra files (in event order)
+
+     output: name of merged .tra file
+
+     Note: the header is taken from the first file and the footer from the last file; the events are copied unchanged.
+
+    """
+
+    with open(output,"wb") as out:
+        for i,tra_file in enumerate(tra_files):
+
+            in_events = False
+            with open(tra_file,"rb") as f:
+                for line in f:
+
+                    if line[:2] == b"SE":
+                        in_events = True
+                    elif line[:2] == b"EN" and line[2:].strip() == b"":
+                        #footer only from the last file:
+                        if i == len(tra_files)-1:
+                            out.write(line)
+                            out.writelines(f)
+                        break
+
+                    #header only from the first file:
+                    if in_events == False and i != 0:
+                        continue
+
+                    out.write(line)
+
+        if len(tra_files) == 0:
+            out.write(b"EN\n")
+
+    return
@@ -0,0 +1,186 @@
+##########################################################
+#
+# Purpose: Skip cosima, revan, and mimrec stages whose inputs did not change.
+#   - Each stage gets a key: a hash of everything its output depends on (input file contents, geometry,
+#     configuration file, seed, numbins, rad, ...) and of the key of the stage before it.
+#   - When a stage is done, a manifest (stage_manifest.json) with the key, the inputs, and the outputs
+#     is written to its directory; it also records the provenance of the outputs.
+#   - A stage with the same key as its manifest, whose outputs are unchanged, does not need to run again.
+#   - The input files are hashed once per stage (file_digests); the digests are passed to stage_key and write_manifest.
+#
+# Index of functions:
+#
+#   file_digest(this_file)
+#   file_digests(files)
+#   stage_key(stage, parameters, files=[], upstream=None, digests=None)
+#   read_manifest(stage_dir)
+#   upstream_key(stage_dir, output_file)
+#   is_cached(stage_dir, key)
+#   write_manifest(stage_dir, stage, key, parameters, files, outputs, upstream=None, digests=None)
+#   clear_manifest(stage_dir)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import json
+import time
+import hashlib
+##########################################################
+
+#name of the manifest file in each stage directory:
+MANIFEST = "stage_manifest.json"
+
+#size of the blocks read when hashing a file:
+HASH_BLOCK = 1024**2
+
+def file_digest(this_file):
+
+    """
+
+     sha1 hash of the full content of a file.
+
+     Note: large files (e.g. background tra and sim files) are read completely too,
+       so that a changed input is never taken for a cached one.
+
+    """
+
+    sha = hashlib.sha1()
+
+    with open(this_file,"rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def file_digests(files):
+
+    """Dictionary with the digest of each file (see file_digest)."""
+
+    return dict([(each,file_digest(each)) for each in files])
+
+def _inputs(parameters, files, upstream, digests=None):
+
+    """Dictionary of all inputs of a stage, with the digest of each file."""
+
+    if digests is None:
+        digests = file_digests(files)
+
+    return {"parameters":parameters, "files":digests, "upstream":upstream}
+
+def stage_key(stage, parameters, files=[], upstream=None, digests=None):
+
+    """
+
+     input definitions:
+
+     stage: name of stage (cosima, revan, mimrec, ...)
+
+     parameters: dictionary of the settings of the stage (must be json serializable)
+
+     files: Optional input. List of input files; their content is part of the key.
+
+     upstream: Optional input. Key of the stage that made the input of this stage.
+
+     digests: Optional input. Digests of the files from file_digests, so that they are not hashed again.
+
+    """
+
+    inputs = _inputs(parameters, files, upstream, digests)
+    inputs["stage"] = stage
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def read_manifest(stage_dir):
+
+    """Manifest of a stage directory, or None if there is none."""
+
+    manifest_file = os.path.join(stage_dir,MANIFEST)
+    if os.path.isfile(manifest_file) == False:
+        return None
+
+    with open(manifest_file,"r") as f:
+        return json.load(f)
+
+def _outputs_unchanged(manifest):
+
+    """Check that all outputs recorded in a manifest still exist with the same size and modification time."""
+
+    for each in manifest["outputs"]:
+        if os.path.isfile(each["file"]) == False:
+            return False
+        stat = os.stat(each["file"])
+        if stat.st_size != each["size"] or stat.st_mtime != each["mtime"]:
+            return False
+
+    return True
+
+def upstream_key(stage_dir, output_file):
+
+    """
+
+     Key of the stage that made output_file, to be used as upstream key of the next stage.
+
+     Note: if the file was not made by a stage with a valid manifest (e.g. a tra file from elsewhere),
+       the digest of the file itself is used.
+
+    """
+
+    manifest = read_manifest(stage_dir)
+    if manifest is not None and _outputs_unchanged(manifest) == True:
+        if os.path.abspath(output_file) in [each["file"] for each in manifest["outputs"]]:
+            return manifest["key"]
+
+    return file_digest(output_file)
+
+def is_cached(stage_dir, key):
+
+    """True if the manifest of the stage directory has the same key and its outputs are unchanged."""
+
+    manifest = read_manifest(stage_dir)
+    if manifest is None or manifest["key"] != key:
+        return False
+
+    return _outputs_unchanged(manifest)
+
+def write_manifest(stage_dir, stage, key, parameters, files, outputs, upstream=None, digests=None):
+
+    """
+
+     Write the manifest of a stage after it finished.
+
+     input definitions:
+
+     stage_dir: full path of the stage directory
+
+     stage, key, parameters, files, upstream, digests: same as for stage_key
+
+     outputs: list of output files (full paths)
+
+    """
+
+    manifest = {"stage":stage, "key":key, "created":time.strftime("%Y-%m-%d %H:%M:%S")}
+    manifest.update(_inputs(parameters, files, upstream, digests))
+    manifest["outputs"] = []
+    for each in outputs:
+        stat = os.stat(each)
+        manifest["outputs"].append({"file":os.path.abspath(each), "size":stat.st_size, "mtime":stat.st_mtime})
+
+    #write through a temporary file, so that a crash never leaves a partial manifest:
+    manifest_file = os.path.join(stage_dir,MANIFEST)
+    with open(manifest_file + ".tmp","w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+    return
+
+def clear_manifest(stage_dir):
+
+    """Remove the manifest of a stage directory (before the stage runs, so a failed run is never cached)."""
+
+    manifest_file = os.path.join(stage_dir,MANIFEST)
+    if os.path.isfile(manifest_file) == True:
+        os.remove(manifest_file)
+
+    return
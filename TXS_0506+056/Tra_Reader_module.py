@@ -0,0 +1,584 @@
+##########################################################
+#
+# Purpose: Read the events of a MEGAlib .tra file (revan output) directly into numpy,
+#   so that event selections and histograms can be made in python instead of mimrec.
+#   - Files are streamed in chunks of whole events, so memory stays bounded for large background files.
+#   - IN include directives (concatenation files) are followed.
+#   - The parsed events can be cached in a binary sidecar file, which is memory-mapped on later reads.
+#
+# Index of functions:
+#
+#   parse_events(block)
+#   iter_tra(tra_file, chunk_size=CHUNK_SIZE)
+#   read_tra(tra_file, chunk_size=CHUNK_SIZE)
+#   write_events(event_blocks, output)
+#   load_tra(tra_file, cache=True, cache_dir=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import io
+import gzip
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+##########################################################
+
+#event type codes (ET record):
+EVENT_TYPES = {"UN":0, "CO":1, "PA":2, "PH":3}
+
+#columns of the event arrays:
+TRA_DTYPE = np.dtype([("id","i8"), ("type","i1"), ("time","f8"), ("energy","f8"),
+    ("gamma_energy","f8"), ("electron_energy","f8"),
+    ("x1","f4"), ("y1","f4"), ("z1","f4"),
+    ("x2","f4"), ("y2","f4"), ("z2","f4"),
+    ("dx","f4"), ("dy","f4"), ("dz","f4"),
+    ("track_energy","f4"), ("lever_arm","f4"),
+    ("sequence_length","i4"), ("track_length","i4")])
+
+#default number of bytes read per chunk:
+CHUNK_SIZE = 16*1024**2
+
+def _key(record):
+
+    """Two-letter record key as an integer, e.g. b"SE"."""
+
+    return record[0]*256 + record[1]
+
+def _open(tra_file):
+
+    """Open a (possibly gzipped) tra file for binary reading."""
+
+    if tra_file.endswith(".gz"):
+        return gzip.open(tra_file,"rb")
+
+    return open(tra_file,"rb")
+
+def _resolve_include(include, parent_dir):
+
+    """
+
+     Find the file of an IN directive.
+
+     Tried in order: the path as given, relative to the including file, and its
+     basename next to the including file (for concatenation files that were moved).
+
+    """
+
+    for this_path in [include, os.path.join(parent_dir,include), os.path.join(parent_dir,os.path.basename(include))]:
+        if os.path.isfile(this_path):
+            return this_path
+
+    raise FileNotFoundError("IN file %s not found (included from %s)" %(include,parent_dir))
+
+class _HashReader:
+
+    """File reader that updates a sha1 hash with every block it reads."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha1()
+
+    def read(self, size):
+        data = self.f.read(size)
+        self.sha.update(data)
+        return data
+
+    def finish(self, chunk_size):
+        """Read the rest of the file into the hash."""
+        while len(self.read(chunk_size)) > 0:
+            pass
+
+def _iter_chunks(tra_file, chunk_size, hashes=None):
+
+    """
+
+     Yield blocks of bytes containing only whole events (each block starts at an SE line).
+
+     Includes (IN) found in the header are streamed in place. Reading stops at EN.
+
+     hashes: Optional input. Dictionary that gets the sha1 hash of the full content of each file read
+       (the rest of the file after EN is read into the hash too), so that the parse also gives the content digest.
+
+    """
+
+    parent_dir = os.path.dirname(os.path.abspath(tra_file))
+    in_header = True
+    rest = b""
+
+    with _open(tra_file) as f:
+
+        if hashes is not None:
+            f = _HashReader(f)
+            hashes[os.path.abspath(tra_file)] = f.sha
+
+        try:
+            while True:
+
+                data = f.read(chunk_size)
+                done = len(data) == 0
+                block = rest + data
+
+                #handle header lines until the first event:
+                if in_header == True:
+                    first_event = block.find(b"SE")
+                    while first_event > 0 and block[first_event-1:first_event] != b"\n":
+                        first_event = block.find(b"SE",first_event+1)
+                    if first_event < 0 and done == False:
+                        rest = block
+                        continue
+                    header = block if first_event < 0 else block[:first_event]
+                    for line in header.splitlines():
+                        line = line.strip()
+                        if line[:3] == b"IN ":
+                            include = _resolve_include(line[3:].strip().decode(),parent_dir)
+                            yield from _iter_chunks(include, chunk_size, hashes)
+                        if line == b"EN":
+                            return
+                    if first_event < 0:
+                        return
+                    block = block[first_event:]
+                    in_header = False
+
+                #stop at end of file marker:
+                end = block.find(b"\nEN")
+                while end >= 0 and block[end+3:end+4] not in [b"\n",b"\r",b" ",b""]:
+                    end = block.find(b"\nEN",end+1)
+                if end >= 0:
+                    yield block[:end+1]
+                    return
+
+                if done == True:
+                    if len(block) > 0:
+                        yield block
+                    return
+
+                #split at last event boundary:
+                cut = block.rfind(b"\nSE")
+                if cut <= 0:
+                    rest = block
+                    continue
+                yield block[:cut+1]
+                rest = block[cut+1:]
+        finally:
+            if hashes is not None:
+                f.finish(chunk_size)
+
+def _values(block, starts, ends, ncol):
+
+    """Parse the numbers of the selected lines into an array of shape (len(starts), ncol)."""
+
+    if len(starts) == 0:
+        return np.zeros((0,ncol))
+
+    lines = [block[s+2:e] for s,e in zip(starts,ends)]
+    values = np.array(b" ".join(lines).split(),dtype=float)
+    if values.size == len(lines)*ncol:
+        return values.reshape(-1,ncol)
+
+    #lines with unexpected number of entries; parse one by one:
+    values = np.full((len(lines),ncol),np.nan)
+    for i,line in enumerate(lines):
+        this_line = np.array(line.split()[:ncol],dtype=float)
+        values[i,:len(this_line)] = this_line
+
+    return values
+
+def parse_events(block):
+
+    """Parse bytes holding whole events (each starting with an SE line) into a structured array with columns TRA_DTYPE (see iter_tra)."""
+
+    buf = np.frombuffer(block,dtype=np.uint8)
+    newlines = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0],newlines+1))
+    ends = np.concatenate((newlines,[len(buf)]))
+    long_enough = ends - starts >= 2
+    starts = starts[long_enough]
+    ends = ends[long_enough]
+    keys = buf[starts].astype(np.int32)*256 + buf[starts+1]
+
+    #event index of each line:
+    is_event = keys == _key(b"SE")
+    event = np.cumsum(is_event) - 1
+    n_events = int(np.sum(is_event))
+
+    events = np.zeros(n_events,dtype=TRA_DTYPE)
+    for name in TRA_DTYPE.names:
+        if TRA_DTYPE[name].kind == "f":
+            events[name] = np.nan
+    events["id"] = -1
+
+    def select(record):
+        sel = np.flatnonzero((keys == _key(record)) & (event >= 0))
+        return event[sel], starts[sel], ends[sel]
+
+    #event type:
+    ev, s, e = select(b"ET")
+    et = np.array([block[i+3:i+5] for i in s],dtype="S2")
+    for name,code in EVENT_TYPES.items():
+        events["type"][ev[et == name.encode()]] = code
+
+    #single value records:
+    for record,name in [(b"ID","id"),(b"TI","time"),(b"TE","track_energy"),(b"LA","lever_arm"),(b"SQ","sequence_length"),(b"TL","track_length")]:
+        ev, s, e = select(record)
+        events[name][ev] = _values(block,s,e,1)[:,0]
+
+    #Compton energies: gamma energy, error, electron energy, error:
+    ev, s, e = select(b"CE")
+    values = _values(block,s,e,4)
+    events["gamma_energy"][ev] = values[:,0]
+    events["electron_energy"][ev] = values[:,2]
+    events["energy"][ev] = values[:,0] + values[:,2]
+
+    #Compton positions: first interaction, error, second interaction, error, electron direction, error:
+    ev, s, e = select(b"CD")
+    values = _values(block,s,e,18)
+    for i,name in enumerate(["x1","y1","z1"]):
+        events[name][ev] = values[:,i]
+    for i,name in enumerate(["x2","y2","z2"]):
+        events[name][ev] = values[:,6+i]
+
+    #pair events: vertex, electron and positron energy + direction, initial deposit:
+    is_pair = events["type"] == EVENT_TYPES["PA"]
+    if np.any(is_pair):
+        ev, s, e = select(b"PC")
+        keep = is_pair[ev]
+        values = _values(block,s[keep],e[keep],3)
+        for i,name in enumerate(["x1","y1","z1"]):
+            events[name][ev[keep]] = values[:,i]
+
+        ev_e, s, e = select(b"PE")
+        keep_e = is_pair[ev_e]
+        electron = _values(block,s[keep_e],e[keep_e],5)
+        ev_p, s, e = select(b"PP")
+        keep_p = is_pair[ev_p]
+        positron = _values(block,s[keep_p],e[keep_p],5)
+        ev_i, s, e = select(b"PI")
+        keep_i = is_pair[ev_i]
+        deposit = np.zeros(n_events)
+        deposit[ev_i[keep_i]] = _values(block,s[keep_i],e[keep_i],1)[:,0]
+
+        #incoming direction is the energy-weighted sum of the electron and positron directions:
+        momentum = np.zeros((n_events,3))
+        energy = np.zeros(n_events)
+        momentum[ev_e[keep_e]] += electron[:,[0]]*electron[:,2:5]
+        energy[ev_e[keep_e]] += electron[:,0]
+        momentum[ev_p[keep_p]] += positron[:,[0]]*positron[:,2:5]
+        energy[ev_p[keep_p]] += positron[:,0]
+        norm = np.sqrt(np.sum(momentum**2,axis=1))
+        good = is_pair & (norm > 0)
+        for i,name in enumerate(["dx","dy","dz"]):
+            events[name][good] = momentum[good,i]/norm[good]
+        events["energy"][is_pair] = energy[is_pair] + deposit[is_pair]
+
+    #photo events: energy
+    is_photo = events["type"] == EVENT_TYPES["PH"]
+    if np.any(is_photo):
+        ev, s, e = select(b"PE")
+        keep = is_photo[ev]
+        events["energy"][ev[keep]] = _values(block,s[keep],e[keep],2)[:,0]
+
+    return events
+
+def iter_tra(tra_file, chunk_size=CHUNK_SIZE):
+
+    """
+
+     Stream the events of a tra file as structured arrays with columns TRA_DTYPE.
+
+     input definitions:
+
+     tra_file: path to tra file (can be gzipped, or a concatenation file with IN directives)
+
+     chunk_size: Optional input. Number of bytes read at a time; sets the memory used.
+
+     Note: records SE, ET, ID, TI, TE, CE, CD, LA, SQ, TL are parsed, and PC, PE, PP, PI for pair events.
+       energy is the total energy (gamma + electron for Compton, electron + positron + initial deposit for pair).
+       x1,y1,z1 and x2,y2,z2 are the first and second interaction positions of Compton events (CD record);
+       for pair events x1,y1,z1 is the vertex and dx,dy,dz the direction of the incoming gamma ray.
+       Columns not given for an event are nan (or -1 for id, 0 for integers).
+
+    """
+
+    for block in _iter_chunks(tra_file, chunk_size):
+        events = parse_events(block)
+        if len(events) > 0:
+            yield events
+
+def read_tra(tra_file, chunk_size=CHUNK_SIZE):
+
+    """
+
+     Read all events of a tra file into a structured array with columns TRA_DTYPE.
+
+     input definitions:
+
+     tra_file: path to tra file
+
+     chunk_size: Optional input. Number of bytes read at a time.
+
+     Note: see iter_tra for the columns.
+
+    """
+
+    chunks = list(iter_tra(tra_file, chunk_size))
+    if len(chunks) == 0:
+        return np.zeros(0,dtype=TRA_DTYPE)
+
+    return np.concatenate(chunks)
+
+def _include_files(tra_file):
+
+    """List of the tra file and all files it includes with IN directives."""
+
+    files = [os.path.abspath(tra_file)]
+    parent_dir = os.path.dirname(files[0])
+    with _open(tra_file) as f:
+        for line in f:
+            line = line.strip()
+            if line[:2] == b"SE" or line == b"EN":
+                break
+            if line[:3] == b"IN ":
+                files += _include_files(_resolve_include(line[3:].strip().decode(),parent_dir))
+
+    return files
+
+def _file_info(files):
+
+    """Size and modification time of each file."""
+
+    info = []
+    for this_file in files:
+        stat = os.stat(this_file)
+        this_info = {"file":this_file, "size":stat.st_size, "mtime":stat.st_mtime}
+        info.append(this_info)
+
+    return info
+
+def _combined_digest(files, hashes):
+
+    """Content digest of a tra file and its IN files, from the sha1 hash of each file."""
+
+    sha = hashlib.sha1()
+    for this_file in files:
+        sha.update(hashes[this_file].hexdigest().encode())
+
+    return sha.hexdigest()
+
+def _content_digest(files, chunk_size=CHUNK_SIZE):
+
+    """Content digest of a tra file and its IN files (the same digest as the parse in _write_cache gives)."""
+
+    hashes = {}
+    for this_file in files:
+        with _open(this_file) as f:
+            reader = _HashReader(f)
+            reader.finish(chunk_size)
+        hashes[this_file] = reader.sha
+
+    return _combined_digest(files, hashes)
+
+def _meta_path(tra_file, cache_dir):
+
+    """Path of the metadata (.json) of the binary sidecar of a tra file."""
+
+    tra_file = os.path.abspath(tra_file)
+    if cache_dir is None:
+        return tra_file + ".npy.json"
+
+    #keep metadata of files with the same name in different directories apart:
+    tag = hashlib.sha1(tra_file.encode()).hexdigest()[:10]
+
+    return os.path.join(cache_dir, os.path.basename(tra_file) + "." + tag + ".npy.json")
+
+def _cache_path(tra_file, cache_dir, digest):
+
+    """Path of the binary sidecar of a tra file, keyed by the content digest."""
+
+    tra_file = os.path.abspath(tra_file)
+    if cache_dir is None:
+        cache_dir = os.path.dirname(tra_file)
+
+    return os.path.join(cache_dir, os.path.basename(tra_file) + "." + digest + ".npy")
+
+def _read_meta(meta_file):
+
+    """Metadata of a sidecar, or None if there is none (or it is from another dtype)."""
+
+    if os.path.isfile(meta_file) == False:
+        return None
+
+    with open(meta_file,"r") as f:
+        meta = json.load(f)
+
+    if meta.get("dtype") != str(TRA_DTYPE.descr) or "digest" not in meta:
+        return None
+
+    return meta
+
+def _cache_valid(tra_file, meta, chunk_size=CHUNK_SIZE):
+
+    """
+
+     Check the sidecar metadata against the tra files: size and mtime first (cheap),
+     then the full content digest, so that a file rewritten with the same size and mtime is not missed.
+
+    """
+
+    if meta is None or os.path.isfile(meta["cache_file"]) == False:
+        return False
+
+    try:
+        files = _include_files(tra_file)
+    except FileNotFoundError:
+        return False
+    if [each["file"] for each in meta["files"]] != files:
+        return False
+
+    for cached,current in zip(meta["files"],_file_info(files)):
+        if cached["size"] != current["size"] or cached["mtime"] != current["mtime"]:
+            return False
+
+    return _content_digest(files, chunk_size) == meta["digest"]
+
+def _npy_header(n_events):
+
+    """Header of an npy file holding n_events events."""
+
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr":np.lib.format.dtype_to_descr(TRA_DTYPE), "fortran_order":False, "shape":(n_events,)})
+
+    return header.getvalue()
+
+def write_events(event_blocks, output):
+
+    """
+
+     Write blocks of events to an npy file (same format as the event cache), without holding all events in memory.
+
+     input definitions:
+
+     event_blocks: iterable of structured arrays with columns TRA_DTYPE (e.g. iter_tra)
+
+     output: name of npy file (load it with np.load(output, mmap_mode="r"))
+
+     Note: returns the number of events written.
+
+    """
+
+    out_dir = os.path.dirname(os.path.abspath(output))
+
+    #stream events to a raw file first, since the number of events is not known in advance:
+    n_events = 0
+    with tempfile.NamedTemporaryFile(dir=out_dir,delete=False) as raw:
+        for events in event_blocks:
+            np.ascontiguousarray(events,dtype=TRA_DTYPE).tofile(raw)
+            n_events += len(events)
+
+    #write the npy file (header + raw events) and move it in place, so that parallel jobs never see a partial file:
+    try:
+        with tempfile.NamedTemporaryFile(dir=out_dir,delete=False) as out:
+            out.write(_npy_header(n_events))
+            with open(raw.name,"rb") as f:
+                shutil.copyfileobj(f,out)
+        os.replace(out.name,output)
+    finally:
+        os.remove(raw.name)
+
+    return n_events
+
+def _write_cache(tra_file, meta_file, cache_dir, chunk_size):
+
+    """
+
+     Parse the tra file and write the events to the binary sidecar, without holding all events in memory.
+
+     Note: the content digest is computed in the same pass; the sidecar is named by it (see _cache_path)
+       and the metadata (.json, named by the path of the tra file) points to it. Returns the metadata.
+
+    """
+
+    files = _include_files(tra_file)
+    info = _file_info(files)
+    meta_dir = os.path.dirname(meta_file)
+
+    #parse into a temporary file, since the name of the sidecar is only known at the end:
+    hashes = {}
+    with tempfile.NamedTemporaryFile(dir=meta_dir,suffix=".npy",delete=False) as f:
+        temp_file = f.name
+    try:
+        blocks = (parse_events(block) for block in _iter_chunks(tra_file, chunk_size, hashes))
+        n_events = write_events(blocks, temp_file)
+        digest = _combined_digest(files, hashes)
+        cache_file = _cache_path(tra_file, cache_dir, digest)
+        os.replace(temp_file, cache_file)
+    finally:
+        if os.path.isfile(temp_file) == True:
+            os.remove(temp_file)
+
+    #remove the sidecar of the old content (or of the old layout, named by path):
+    old_meta = _read_meta(meta_file)
+    old_cache = meta_file[:-len(".json")] if old_meta is None else old_meta["cache_file"]
+    if old_cache != cache_file and os.path.isfile(old_cache) == True:
+        os.remove(old_cache)
+
+    meta = {"tra_file":os.path.abspath(tra_file), "n_events":n_events, "dtype":str(TRA_DTYPE.descr), "files":info,
+        "digest":digest, "cache_file":cache_file}
+    with tempfile.NamedTemporaryFile("w",dir=meta_dir,delete=False) as f:
+        json.dump(meta,f,indent=2)
+    os.replace(f.name,meta_file)
+
+    return meta
+
+def load_tra(tra_file, cache=True, cache_dir=None, chunk_size=CHUNK_SIZE):
+
+    """
+
+     Load the events of a tra file, using a binary sidecar cache.
+
+     input definitions:
+
+     tra_file: path to tra file
+
+     cache: Optional input. If False the tra file is parsed without using or writing the cache.
+
+     cache_dir: Optional input. Directory for the sidecar files.
+       - Default is to write the sidecar next to the tra file (<tra_file>.<digest>.npy, metadata in tra_file + ".npy.json").
+       - If the directory is not writable, the tra file is parsed without caching.
+
+     chunk_size: Optional input. Number of bytes read at a time when parsing.
+
+     Note: the first call parses the tra file and writes the sidecar (events.npy format + .json metadata).
+       Later calls memory-map the sidecar (read only) if it is still valid.
+       The sidecar is keyed by the sha1 content digest of the tra file (and its IN files), computed while parsing.
+       The cache is valid if size and mtime are unchanged (cheap first check) and the content digest is the same.
+
+    """
+
+    if cache == False:
+        return read_tra(tra_file, chunk_size)
+
+    if cache_dir is not None and os.path.isdir(cache_dir) == False:
+        os.makedirs(cache_dir)
+
+    meta_file = _meta_path(tra_file, cache_dir)
+    meta = _read_meta(meta_file)
+    if _cache_valid(tra_file, meta, chunk_size) == False:
+
+        if os.access(os.path.dirname(meta_file),os.W_OK) == False:
+            print("Cache directory not writable, reading %s without cache..." %tra_file)
+            return read_tra(tra_file, chunk_size)
+
+        print("Writing event cache for %s..." %tra_file)
+        meta = _write_cache(tra_file, meta_file, cache_dir, chunk_size)
+    cache_file = meta["cache_file"]
+
+    #empty files can not be memory-mapped:
+    if os.path.getsize(cache_file) == len(_npy_header(0)):
+        return np.zeros(0,dtype=TRA_DTYPE)
+
+    return np.load(cache_file,mmap_mode="r")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+##########################################################
+#
+# Purpose: Command line interface for running MEGAlib and processing its output, instead of editing client_code.py.
+#   - Each stage is a subcommand, e.g.
+#       python amegox.py run cosima --config inputs.yaml --seed 432020
+#       python amegox.py run revan --revan-config revan_R5_firstinteractionD1_MIPS_clustering.cfg
+#       python amegox.py run mimrec SixBins_2deg --numbins 6 --rad 2
+#       python amegox.py run response Response_2021 --energies 300 1000 3000 10000 --angles 0 30 --seed 432020 --revan-config revan_AMEGO_X.cfg
+#       python amegox.py run cosima-inputs --table candidate_models.txt --output-dir Candidates
+#       python amegox.py run sed Mimrec/SixBins_Energy_Dependent
+#       python amegox.py run reweight Models_2deg model_A.dat model_B.dat --numbins 6 --rad 2
+#       python amegox.py run fold Candidates candidate_*.dat --numbins 6 --no-runs
+#       python amegox.py run lc Mimrec/SixBins_10deg --numbins 1
+#       python amegox.py run lc Mimrec/SixBins_10deg --binning bayesian --p0 0.05
+#   - Modules are only imported by the subcommands that use them, so array jobs running cosima or revan
+#     do not load pandas, scipy, matplotlib, or astropy.
+#   - "check-imports" measures the import time of the modules in fresh interpreters against a time budget,
+#     and checks that the heavy dependencies are not loaded (exit code 1 if not).
+#
+# Index of functions:
+#
+#   make_parser()
+#   measure_import(module)
+#   check_imports(budget=IMPORT_BUDGET)
+#   main(argv=None)
+#
+##########################################################
+
+##########################################################
+#imports:
+import os
+import sys
+import argparse
+import subprocess
+##########################################################
+
+#default import time budget per module in seconds (check-imports):
+IMPORT_BUDGET = 1.0
+
+#heavy dependencies that each module must not load when imported:
+LIGHT_IMPORTS = {"amegox":["numpy","pandas","scipy","matplotlib","astropy"],
+    "Run_MEGAlib_module":["pandas","scipy","matplotlib","astropy"],
+    "Process_MEGAlib_module":["pandas","scipy","matplotlib","astropy"]}
+
+def _run_instance(args):
+
+    """Run_MEGAlib instance for the config file of the command."""
+
+    from Run_MEGAlib_module import Run_MEGAlib
+
+    return Run_MEGAlib(args.config, args.home)
+
+def _process_instance(args):
+
+    """Process_MEGAlib instance for the config file of the command."""
+
+    from Process_MEGAlib_module import Process_MEGAlib
+
+    instance = Process_MEGAlib(args.config, args.home)
+    if args.no_show == True:
+        instance.plots = False
+
+    return instance
+
+def _cosima(args):
+    _run_instance(args).run_cosima(args.seed, args.shards, args.mode, args.workers)
+
+def _revan(args):
+    _run_instance(args).run_revan(args.revan_config, args.chunks, args.workers)
+
+def _mimrec(args):
+    _run_instance(args).run_mimrec(args.save_dir, args.numbins, args.rad, args.mimrec_config, args.workers, args.engine, args.lc_numbins)
+
+def _energy_dependent(args):
+    _run_instance(args).energy_dependent_mimrec(args.save_dir, args.numbins, args.mimrec_config, args.engine, args.workers)
+
+def _sweep(args):
+    energy_ranges = "default"
+    if args.energy_ranges is not None:
+        energy_ranges = [[float(each) for each in this_range.split(",")] for this_range in args.energy_ranges]
+    _run_instance(args).sweep_mimrec(args.numbins, args.rad, energy_ranges, args.lc_numbins, args.prefix)
+
+def _reweight(args):
+    _run_instance(args).reweight_mimrec(args.save_dir, args.models, args.numbins, args.rad, args.lc_numbins, args.sim_file)
+
+def _fold(args):
+    rad = "default" if args.rad is None else args.rad
+    _run_instance(args).forward_fold(args.save_dir, args.models, args.numbins, rad, args.containment, args.lc_numbins, args.no_runs == False)
+
+def _response(args):
+    _run_instance(args).response_campaign(args.save_dir, args.energies, args.angles, args.triggers, args.shards, args.seed, args.revan_config, args.acceptance, args.workers)
+
+def _cosima_inputs(args):
+    models = args.models
+    if args.table is not None:
+        models = args.table
+    elif len(models) == 1 and os.path.isdir(models[0]):
+        models = models[0]
+    _process_instance(args).Make_Cosima_inputs(models, args.output_dir, args.energy_range, args.interpolation, args.tolerance)
+
+def _sed(args):
+    instance = _process_instance(args)
+    if args.no_effective_area == False:
+        instance.Effective_Area(args.wdir, plot=args.no_plot == False)
+    plot_model = "default"
+    if args.plot_model is not None:
+        import pandas as pd
+        df = pd.read_csv(instance.context.resolve(args.plot_model),delim_whitespace=True)
+        plot_model = {"energy":df["energy[eV]"]/1000.0, "flux":df["flux[erg/cm^2/s]"]}
+    instance.Make_SED(args.wdir, plot_model, plot=args.no_plot == False)
+
+def _lc(args):
+    _process_instance(args).Make_LC(args.wdir, args.numbins, args.no_plot == False, args.binning, args.edges, args.min_sigma, args.p0, args.event_file)
+
+def _batch(args):
+    from Batch_Process_module import process_runs
+    process_runs(args.config, args.wdirs, args.steps, args.lc_numbins, args.workers, args.home, plots=args.plots)
+
+def _check_imports(args):
+    return check_imports(args.budget)
+
+def _seed(value):
+
+    """Seed of cosima: an integer, or "none" for a random seed."""
+
+    return value if value == "none" else int(value)
+
+def make_parser():
+
+    """Argument parser with a subcommand for each stage (amegox run <stage>) and for check-imports."""
+
+    parser = argparse.ArgumentParser(prog="amegox", description="Run MEGAlib simulations and process their output.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    #options of all stages:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", default="inputs.yaml", help="inputs.yaml of the run (default: inputs.yaml)")
+    common.add_argument("--home", default=None, help="main working directory (default: current directory)")
+
+    plotting = argparse.ArgumentParser(add_help=False)
+    plotting.add_argument("--no-plot", action="store_true", help="do not make figures")
+    plotting.add_argument("--no-show", action="store_true", help="save figures without showing them (overrides plots in inputs.yaml)")
+
+    run = commands.add_parser("run", help="run a stage").add_subparsers(dest="stage", required=True)
+
+    this = run.add_parser("cosima", parents=[common], help="simulate the source with cosima")
+    this.add_argument("--seed", type=_seed, default="none")
+    this.add_argument("--shards", type=int, default=1)
+    this.add_argument("--mode", choices=["local","pbs"], default="local")
+    this.add_argument("--workers", type=int, default=None)
+    this.set_defaults(func=_cosima)
+
+    this = run.add_parser("revan", parents=[common], help="reconstruct the events with revan")
+    this.add_argument("--revan-config", default="none", help="revan configuration file in the Inputs directory")
+    this.add_argument("--chunks", type=int, default=1)
+    this.add_argument("--workers", type=int, default=None)
+    this.set_defaults(func=_revan)
+
+    this = run.add_parser("mimrec", parents=[common], help="extract spectrum and light curve")
+    this.add_argument("save_dir")
+    this.add_argument("--numbins", type=int, required=True)
+    this.add_argument("--rad", type=float, required=True)
+    this.add_argument("--mimrec-config", default="none", help="mimrec configuration file in the Inputs directory")
+    this.add_argument("--engine", choices=["python","mimrec"], default="mimrec", help="python histograms the tra files in-process (opt-in)")
+    this.add_argument("--lc-numbins", type=int, default=1000)
+    this.add_argument("--workers", type=int, default=None)
+    this.set_defaults(func=_mimrec)
+
+    this = run.add_parser("energy-dependent", parents=[common], help="extract spectrum with an energy-dependent ARM cut")
+    this.add_argument("save_dir")
+    this.add_argument("--numbins", type=int, required=True)
+    this.add_argument("--mimrec-config", default="none", help="mimrec configuration file in the Inputs directory")
+    this.add_argument("--engine", choices=["python","mimrec"], default="mimrec", help="python histograms the tra files in-process (opt-in)")
+    this.add_argument("--workers", type=int, default=None)
+    this.set_defaults(func=_energy_dependent)
+
+    this = run.add_parser("sweep", parents=[common], help="extract spectra for a grid of numbins, rad, and energy ranges")
+    this.add_argument("--numbins", type=int, nargs="+", required=True)
+    this.add_argument("--rad", type=float, nargs="+", required=True)
+    this.add_argument("--energy-ranges", nargs="+", default=None, help="energy ranges as min,max in keV (default: energy_range in inputs.yaml)")
+    this.add_argument("--lc-numbins", type=int, default=1000)
+    this.add_argument("--prefix", default="sweep")
+    this.set_defaults(func=_sweep)
+
+    this = run.add_parser("reweight", parents=[common], help="extract spectra for new source models by reweighting the simulation")
+    this.add_argument("save_dir")
+    this.add_argument("models", nargs="+", help="model spectrum files in the Inputs directory")
+    this.add_argument("--numbins", type=int, required=True)
+    this.add_argument("--rad", type=float, required=True)
+    this.add_argument("--lc-numbins", type=int, default=1000)
+    this.add_argument("--sim-file", default="default", help=".sim file with the true energies (default: cosima output)")
+    this.set_defaults(func=_reweight)
+
+    this = run.add_parser("fold", parents=[common], help="quick-look expected counts of source models from the performance tables")
+    this.add_argument("save_dir")
+    this.add_argument("models", nargs="+", help="model spectrum files in the Inputs directory")
+    this.add_argument("--numbins", type=int, required=True)
+    this.add_argument("--rad", type=float, default=None, help="radius of the extraction region in degrees (default: angular resolution)")
+    this.add_argument("--containment", type=float, default=1.0, help="fraction of the source events inside the extraction region")
+    this.add_argument("--lc-numbins", type=int, default=100)
+    this.add_argument("--no-runs", action="store_true", help="only write the summary, not a Mimrec run directory per model")
+    this.set_defaults(func=_fold)
+
+    this = run.add_parser("response", parents=[common], help="performance files of the mission from monoenergetic point sources")
+    this.add_argument("save_dir")
+    this.add_argument("--energies", type=float, nargs="+", required=True, help="energies of the sources in keV")
+    this.add_argument("--angles", type=float, nargs="+", default=[0.0], help="incidence angles (theta) in degrees")
+    this.add_argument("--triggers", type=int, default=20000, help="number of triggered events of each grid point")
+    this.add_argument("--shards", type=int, default=1)
+    this.add_argument("--seed", type=_seed, default="none")
+    this.add_argument("--revan-config", default="none", help="revan configuration file in the Inputs directory")
+    this.add_argument("--acceptance", type=float, default=15.0, help="acceptance radius of the ARM histograms in degrees")
+    this.add_argument("--workers", type=int, default=None)
+    this.set_defaults(func=_response)
+
+    this = run.add_parser("cosima-inputs", parents=[common], help="convert many model SEDs to Cosima spectrum and source files")
+    this.add_argument("models", nargs="*", help="model SED files, or a directory of them")
+    this.add_argument("--table", default=None, help="table with a column energy[eV] and one column per model instead")
+    this.add_argument("--output-dir", default="default", help="directory of the new files (default: Inputs)")
+    this.add_argument("--energy-range", type=float, nargs=2, default=[1e2,1e6], help="energy range of the spectra in keV")
+    this.add_argument("--interpolation", choices=["LIN","LOGLOG"], default="LIN")
+    this.add_argument("--tolerance", type=float, default=0.01)
+    this.set_defaults(func=_cosima_inputs, no_show=False)
+
+    this = run.add_parser("sed", parents=[common,plotting], help="effective area and SED of a Mimrec run")
+    this.add_argument("wdir", help="Mimrec run directory, i.e. Mimrec/name_of_run")
+    this.add_argument("--no-effective-area", action="store_true", help="use the existing Aeff.dat")
+    this.add_argument("--plot-model", default=None, help="model SED for the figure, with columns energy[eV] and flux[erg/cm^2/s]")
+    this.set_defaults(func=_sed)
+
+    this = run.add_parser("lc", parents=[common,plotting], help="rebinned light curve of a Mimrec run")
+    this.add_argument("wdir", help="Mimrec run directory, i.e. Mimrec/name_of_run")
+    this.add_argument("--numbins", type=int, default=None, help="number of bins (needed for binning uniform)")
+    this.add_argument("--binning", choices=["uniform","edges","significance","bayesian"], default="uniform")
+    this.add_argument("--edges", type=float, nargs="+", default=None, help="edges of the bins in seconds (binning edges)")
+    this.add_argument("--min-sigma", type=float, default=3.0, help="minimum significance of each bin (binning significance)")
+    this.add_argument("--p0", type=float, default=0.05, help="false-alarm probability of a block edge (binning bayesian)")
+    this.add_argument("--event-file", default=None, help="tra file with the event times for the blocks (binning bayesian)")
+    this.set_defaults(func=_lc)
+
+    this = run.add_parser("batch", parents=[common], help="process many Mimrec runs in parallel")
+    this.add_argument("wdirs", nargs="*", default=["Mimrec/*"], help="run directories or glob patterns (default: Mimrec/*)")
+    this.add_argument("--steps", nargs="+", default=["Effective_Area","Make_SED"])
+    this.add_argument("--lc-numbins", type=int, default=None)
+    this.add_argument("--workers", type=int, default=None)
+    this.add_argument("--plots", nargs="*", default=[], help="steps whose figures are rendered")
+    this.set_defaults(func=_batch)
+
+    this = commands.add_parser("check-imports", help="check the import time of the modules")
+    this.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="maximum import time per module in seconds")
+    this.set_defaults(func=_check_imports)
+
+    return parser
+
+def measure_import(module):
+
+    """
+
+     Import a module in a fresh interpreter.
+
+     input definitions:
+
+     module: Name of the module, relative to the directory of this file.
+
+     Note: returns the import time in seconds and the set of top-level modules loaded by the import.
+
+    """
+
+    code = "import sys, time; t = time.perf_counter(); import %s; print(time.perf_counter() - t); print(' '.join(sorted(set([each.split('.')[0] for each in sys.modules]))))"
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+
+    output = subprocess.run([sys.executable, "-c", code %module], cwd=this_dir, capture_output=True, text=True, check=True).stdout.split("\n")
+
+    return float(output[0]), set(output[1].split())
+
+def check_imports(budget=IMPORT_BUDGET):
+
+    """
+
+     Measure the import time of the modules in LIGHT_IMPORTS, each in a fresh interpreter.
+
+     input definitions:
+
+     budget: Optional input. Maximum import time per module in seconds.
+
+     Note: returns 0 if every module imports within the budget without loading its heavy dependencies, and 1 otherwise.
+
+    """
+
+    status = 0
+    for module,heavy in LIGHT_IMPORTS.items():
+        import_time, modules = measure_import(module)
+        loaded = [each for each in heavy if each in modules]
+        ok = import_time <= budget and len(loaded) == 0
+        print("%-25s %6.3f s  %s%s" %(module, import_time, "ok" if ok else "FAILED",
+            "" if len(loaded) == 0 else " (loads %s)" %", ".join(loaded)))
+        if ok == False:
+            status = 1
+
+    return status
+
+def main(argv=None):
+
+    """Parse the command line and run the subcommand; returns the exit code."""
+
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if getattr(args,"stage",None) == "lc" and args.binning == "uniform" and args.numbins is None:
+        parser.error("run lc: --numbins is needed for --binning uniform")
+    status = args.func(args)
+
+    return 0 if status is None else status
+
+########################
+if __name__=="__main__":
+    sys.exit(main())
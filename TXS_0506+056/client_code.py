@@ -3,6 +3,7 @@ import os, sys
 import pandas as pd
 from Run_MEGAlib_module import Run_MEGAlib
 from Process_MEGAlib_module import Process_MEGAlib
+from Batch_Process_module import process_runs
 
 def main(cmd_line):
 
@@ -40,12 +41,23 @@ def main(cmd_line):
     #instanceA.run_revan("revan_R5_firstinteractionD1_MIPS_clustering.cfg")
     #instanceA.run_mimrec("SixBins_2deg",6,2)
     #instanceA.energy_dependent_mimrec("100Bins_Energy_Dependent",100)
+    #instanceA.sweep_mimrec([6,10],[2,4,6,8,10])
+    #instanceA.forward_fold("Candidates",["Keivani_leptonic_model.txt"],6)
+    #instanceA.response_campaign("Response_2021",[300,1000,3000,10000],[0,30],seed=432020,config_file="revan_AMEGO_X.cfg")
+    #instanceA.reweight_mimrec("Models_2deg",["Keivani_leptonic_model.txt","Keivani_hadronic_model.txt"],6,2)
 
     #functions for processing the MEGAlib output:
     #instanceB.Make_Cosima_input("Inputs/Keivani_leptonic_model.txt")
+    #instanceB.Make_Cosima_inputs("Inputs/Candidate_models",output_dir="Inputs")
     #instanceB.Effective_Area("Mimrec/SixBins_Energy_Dependent/")
     #instanceB.Make_SED("Mimrec/SixBins_Energy_Dependent/",model_dict)
     #instanceB.Make_LC("Mimrec/SixBins_10deg/",1)
+    #instanceB.Make_LC("Mimrec/SixBins_10deg/",binning="bayesian",p0=0.05)
+    #instanceB.MC_Significance("Mimrec/SixBins_Energy_Dependent/","SED",n_realizations=10000)
+
+    #processing many Mimrec runs in parallel (e.g. from sweep_mimrec):
+    #process_runs(this_yaml,"Mimrec/sweep_*",["Effective_Area","Make_SED"])
+    #process_runs(this_yaml,"Mimrec/Models_2deg/*",["Effective_Area","Make_SED"])
 
 ########################
 if __name__=="__main__":
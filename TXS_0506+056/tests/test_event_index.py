@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Event_Index_module import extract_time_window, merge_event_files, exposure
+
+
+def write_tra(tra_file, times, start, stop):
+
+    with open(tra_file, "w") as f:
+        f.write("TYPE TRA\nUF doublesided\nTB %s\n\n" % start)
+        for i, t in enumerate(times):
+            f.write("SE\nET PH\nID %d\nTI %.3f\nPE 100.0 1.0\n" % (i + 1, t))
+        f.write("EN\n\nTE %s\n" % stop)
+
+
+def records(tra_file, key):
+
+    with open(tra_file, "r") as f:
+        return [line.split()[1:] for line in f if line.split()[:1] == [key]]
+
+
+def test_extract_then_merge_has_one_tb_and_te(tmp_path):
+
+    source = str(tmp_path / "source.tra")
+    window = str(tmp_path / "window.tra")
+    merged = str(tmp_path / "merged.tra")
+    write_tra(source, [0.5 + 0.1 * i for i in range(10)], 0.5, 1.5)
+
+    extract_time_window(source, 0.6, 0.9, window, index_dir=str(tmp_path))
+    assert [float(each[0]) for each in records(window, "TB")] == [0.6]
+    assert [float(each[0]) for each in records(window, "TE")] == [0.9]
+    assert abs(exposure(window, index_dir=str(tmp_path)) - 0.3) < 1e-9
+
+    merge_event_files([window, source], merged, time_offsets=[10.0, 0.0], index_dir=str(tmp_path))
+    assert [float(each[0]) for each in records(merged, "TB")] == [0.5]
+    assert [float(each[0]) for each in records(merged, "TE")] == [10.9]
+    assert len(records(merged, "SE")) == 13
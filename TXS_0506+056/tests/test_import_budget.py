@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amegox
+
+
+@pytest.mark.parametrize("module", sorted(amegox.LIGHT_IMPORTS))
+def test_import_budget(module):
+
+    import_time, modules = amegox.measure_import(module)
+
+    assert import_time <= amegox.IMPORT_BUDGET
+    assert [each for each in amegox.LIGHT_IMPORTS[module] if each in modules] == []